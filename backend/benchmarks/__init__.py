@@ -0,0 +1,10 @@
+"""
+Camera-free benchmarks for the posture/blink hot paths.
+
+Synthetic landmark streams (benchmarks.fixtures) stand in for MediaPipe, so
+everything after inference runs exactly as it does live:
+
+    cd backend
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --compare bench.json
+"""
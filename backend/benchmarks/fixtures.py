@@ -0,0 +1,178 @@
+"""
+Synthetic landmark streams standing in for the camera and MediaPipe.
+
+A SyntheticSession holds per-frame normalized landmarks in the layout of a
+landmark store (see src.landmark_store), generated from a seeded RNG so
+every run sees the same frames. It can be fed to src.replay.replay()
+directly, or turned into MediaPipe-shaped results (protobuf landmark
+lists) for the analyzers and the pipeline.
+"""
+import math
+from types import SimpleNamespace
+
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+from src.blink_engine import LEFT_EYE, RIGHT_EYE
+from src.landmark_store import EYES_SHAPE, POSE_SHAPE
+from src.posture_engine import mp_pose
+
+FACE_MESH_POINTS = 478   # with refine_landmarks=True
+
+# Neck angle vs vertical (degrees) for each posture; see compute_bad_posture_score.
+GOOD_NECK_DEG = 15.0
+SLOUCHED_NECK_DEG = 85.0
+
+OPEN_EAR = 0.30
+CLOSED_EAR = 0.10
+BLINK_FRAMES = 4
+
+# name -> segments of (seconds, posture, blinks/min, present)
+SCENARIOS = {
+    "good": [(60, "good", 15, True)],
+    "slouched": [(60, "slouched", 15, True)],
+    "mixed": [(15, "good", 15, True), (15, "slouched", 15, True)] * 2,
+    "low_blink": [(120, "good", 4, True)],   # past the tracker's seeded first minute
+    "away": [(20, "good", 15, True), (20, None, 0, False), (20, "good", 15, True)],
+}
+
+_PL = mp_pose.PoseLandmark
+
+
+class SyntheticSession:
+    """
+    `seconds` of frames at `fps` following the segments of a scenario.
+    Attributes match LandmarkStore: timestamps, pose (n, 33, 4), eyes
+    (n, 12, 3), pose_valid, face_valid, width, height, fps; `face` holds the
+    full (n, 478, 3) mesh, of which only the eye points are meaningful.
+    """
+
+    def __init__(self, scenario="mixed", fps=30.0, width=640, height=480, seed=0, start_time=1_700_000_000.0):
+        self.scenario = scenario
+        self.fps = fps
+        self.width = width
+        self.height = height
+        rng = np.random.default_rng(seed)
+
+        segments = SCENARIOS[scenario]
+        n = int(sum(seconds for seconds, *_ in segments) * fps)
+        self.timestamps = start_time + np.arange(n) / fps
+        self.pose = np.full((n,) + POSE_SHAPE, np.nan, dtype=np.float32)
+        self.face = np.full((n, FACE_MESH_POINTS, 3), np.nan, dtype=np.float32)
+        self.pose_valid = np.zeros(n, dtype=bool)
+        self.face_valid = np.zeros(n, dtype=bool)
+        self.ear = np.full(n, np.nan, dtype=np.float32)   # ground truth
+
+        i = 0
+        for seconds, posture, blink_rate, present in segments:
+            m = int(seconds * fps)
+            if present:
+                neck = GOOD_NECK_DEG if posture == "good" else SLOUCHED_NECK_DEG
+                for k in range(i, i + m):
+                    self.pose[k] = self._pose(rng, neck + rng.normal(0.0, 3.0))
+                self.ear[i:i + m] = _ear_track(rng, m, fps, blink_rate)
+                for k in range(i, i + m):
+                    self.face[k] = self._face(rng, self.pose[k], self.ear[k])
+                self.pose_valid[i:i + m] = True
+                self.face_valid[i:i + m] = True
+            i += m
+
+        self.eyes = np.ascontiguousarray(self.face[:, LEFT_EYE + RIGHT_EYE])
+        assert self.eyes.shape[1:] == EYES_SHAPE
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # ----------------- Geometry -----------------
+    def _pose(self, rng, neck_deg):
+        w, h = self.width, self.height
+        pts = np.zeros(POSE_SHAPE, dtype=np.float32)
+        pts[:, 3] = 0.99
+
+        mid_sh = np.array([0.5, 0.62])
+        half_sh = 0.14
+        pts[_PL.LEFT_SHOULDER, :2] = mid_sh + (half_sh, 0.0)
+        pts[_PL.RIGHT_SHOULDER, :2] = mid_sh - (half_sh, 0.0)
+        pts[_PL.LEFT_HIP, :2] = (0.5 + 0.09, 0.98)
+        pts[_PL.RIGHT_HIP, :2] = (0.5 - 0.09, 0.98)
+        for lm in (_PL.LEFT_ELBOW, _PL.LEFT_WRIST, _PL.RIGHT_ELBOW, _PL.RIGHT_WRIST):
+            side = 1.0 if lm.name.startswith("LEFT") else -1.0
+            pts[lm, :2] = (0.5 + side * 0.2, 0.85)
+
+        # nose at the neck angle from the shoulder midpoint, in pixel space
+        neck_px = 0.25 * h
+        theta = math.radians(neck_deg)
+        nose = mid_sh + (neck_px * math.sin(theta) / w, -neck_px * math.cos(theta) / h)
+        pts[_PL.NOSE, :2] = nose
+        pts[_PL.NOSE, 2] = -0.02
+        for lm, (dx, dy) in {
+            _PL.LEFT_EYE_INNER: (0.015, -0.03), _PL.LEFT_EYE: (0.03, -0.03), _PL.LEFT_EYE_OUTER: (0.045, -0.03),
+            _PL.RIGHT_EYE_INNER: (-0.015, -0.03), _PL.RIGHT_EYE: (-0.03, -0.03), _PL.RIGHT_EYE_OUTER: (-0.045, -0.03),
+            _PL.LEFT_EAR: (0.07, -0.01), _PL.RIGHT_EAR: (-0.07, -0.01),
+            _PL.MOUTH_LEFT: (0.02, 0.04), _PL.MOUTH_RIGHT: (-0.02, 0.04),
+        }.items():
+            pts[lm, :2] = nose + (dx, dy)
+            pts[lm, 2] = -0.02
+
+        pts[:, :3] += rng.normal(0.0, 0.002, (POSE_SHAPE[0], 3))
+        return pts
+
+    def _face(self, rng, pose, ear):
+        w, h = self.width, self.height
+        nose = pose[_PL.NOSE, :2]
+        pts = np.empty((FACE_MESH_POINTS, 3), dtype=np.float32)
+        pts[:, :2] = nose + rng.normal(0.0, 0.02, (FACE_MESH_POINTS, 2))
+        pts[:, 2] = rng.normal(0.0, 0.01, FACE_MESH_POINTS)
+
+        # p1..p6 of each eye so that EAR == ear: corners `eye_px` apart,
+        # both lids `ear * eye_px` apart
+        eye_px = 0.05 * w
+        for eye, side in ((LEFT_EYE, -1.0), (RIGHT_EYE, 1.0)):
+            cx, cy = nose[0] * w + side * 0.045 * w, nose[1] * h - 0.04 * h
+            half, lid = eye_px / 2.0, ear * eye_px / 2.0
+            layout = [(-half, 0.0), (-half / 3, -lid), (half / 3, -lid), (half, 0.0), (half / 3, lid), (-half / 3, lid)]
+            for idx, (dx, dy) in zip(eye, layout):
+                pts[idx, 0] = (cx + dx) / w
+                pts[idx, 1] = (cy + dy) / h
+        return pts
+
+    # ----------------- MediaPipe-shaped results -----------------
+    def results(self, i):
+        """{"pose": ..., "face": ...} for frame i, shaped like MediaPipe's output."""
+        pose = None
+        if self.pose_valid[i]:
+            pose = landmark_pb2.NormalizedLandmarkList()
+            for x, y, z, v in self.pose[i].tolist():
+                pose.landmark.add(x=x, y=y, z=z, visibility=v)
+        faces = None
+        if self.face_valid[i]:
+            face = landmark_pb2.NormalizedLandmarkList()
+            for x, y, z in self.face[i].tolist():
+                face.landmark.add(x=x, y=y, z=z)
+            faces = [face]
+        return {
+            "pose": SimpleNamespace(pose_landmarks=pose),
+            "face": SimpleNamespace(multi_face_landmarks=faces),
+        }
+
+    def all_results(self):
+        return [self.results(i) for i in range(len(self))]
+
+
+def _ear_track(rng, n, fps, blinks_per_min):
+    """Open-eye EAR with noise and BLINK_FRAMES-long closures at the given rate."""
+    ear = OPEN_EAR + rng.normal(0.0, 0.01, n)
+    if blinks_per_min > 0:
+        period = 60.0 * fps / blinks_per_min
+        start = rng.uniform(0, period)
+        while start + BLINK_FRAMES < n:
+            k = int(start)
+            ear[k:k + BLINK_FRAMES] = CLOSED_EAR + rng.normal(0.0, 0.01, BLINK_FRAMES)
+            start += period * rng.uniform(0.7, 1.3)
+    return ear.astype(np.float32)
+
+
+def synthetic_frames(count=8, width=640, height=480, seed=0):
+    """A few random BGR frames for the preprocessing stage (content is irrelevant)."""
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
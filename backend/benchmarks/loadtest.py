@@ -0,0 +1,293 @@
+"""
+End-to-end load test: a real server running `--sessions` sessions fed by
+a replay source instead of the webcam, `--clients` WebSocket clients (spread
+over the sessions) subscribed to the per-frame metrics.
+
+The server is started as a subprocess (uvicorn, in a temporary directory so
+its metrics database is thrown away) with AXIAL_FRAME_SOURCE pointing at
+`--source` ("synthetic", a video file or an image directory), or `--url`
+targets one that is already running. Recording is started with POST /start
+(once per session) and, for `--duration` seconds, the test collects per
+client:
+
+  - latency of every metrics message (receive time - its "ts", i.e. from
+    the end of processing the frame to the client),
+  - messages and events received (with `--stream`, the binary
+    "metrics_stream" batches instead of JSON metrics; latency per frame),
+  - the resident memory (VmRSS) of the server and its session workers,
+    local server only, once a second, and the CPU use of the server
+    process itself (fan-out and serialization).
+
+    python -m benchmarks.loadtest --clients 8 --duration 60 --out load.json
+    python -m benchmarks.loadtest --sessions 4 --clients 8
+    python -m benchmarks.loadtest --clients 8 --stream
+    python -m benchmarks.loadtest --max-p99-ms 50 --max-rss-growth-mb 20   # exit 1 if exceeded
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+import websockets
+
+from src.metrics_stream import MetricsStreamDecoder
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, source, pace, workdir, **env):
+    env = dict(
+        os.environ,
+        AXIAL_FRAME_SOURCE=source,
+        AXIAL_FRAME_PACE=pace,
+        AXIAL_METRICS_DB=os.path.join(workdir, "metrics.db"),
+        **env,
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--app-dir", BACKEND_DIR, "main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env,
+    )
+
+
+async def wait_ready(client, url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get(f"{url}/sessions")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {url} not ready after {timeout}s")
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def cpu_sec(pid):
+    # utime + stime of one process
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return None
+
+
+async def run_client(url, stop, stats, stream=False):
+    decoder = MetricsStreamDecoder()
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"action": "subscribe", "types": ["metrics_stream" if stream else "metrics"]}))
+        while not stop.is_set():
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            now = time.time()
+            if isinstance(raw, bytes):
+                frames = decoder.feed(raw)
+                stats["latencies"].extend(now - f["ts"] for f in frames)
+                stats["frames"] += len(frames)
+                stats["gaps"] = decoder.gaps
+                stats["messages"] += 1
+                stats["bytes"] += len(raw)
+                continue
+            msg = json.loads(raw)
+            if msg.get("type") == "metrics":
+                stats["latencies"].append(now - msg["ts"])
+                stats["frames"] += 1
+            else:
+                stats["events"][msg.get("type")] = stats["events"].get(msg.get("type"), 0) + 1
+            stats["messages"] += 1
+            stats["bytes"] += len(raw)
+
+
+def process_tree(pid):
+    """pid and its descendants (the session workers)."""
+    pids, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        pids.append(p)
+        try:
+            tasks = os.listdir(f"/proc/{p}/task")
+        except OSError:
+            continue
+        for task in tasks:   # children started from any thread
+            try:
+                with open(f"/proc/{p}/task/{task}/children") as f:
+                    todo.extend(int(c) for c in f.read().split())
+            except OSError:
+                pass
+    return pids
+
+
+async def sample_rss(pid, stop, samples, start):
+    while not stop.is_set():
+        sizes = [mb for mb in map(rss_mb, process_tree(pid)) if mb is not None]
+        if sizes:
+            samples.append((time.monotonic() - start, sum(sizes)))
+        await asyncio.sleep(1.0)
+
+
+def percentiles_ms(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000.0
+    return {"p50": p50, "p95": p95, "p99": p99, "max": max(values) * 1000.0}
+
+
+def rss_report(samples, warmup_sec):
+    if not samples:
+        return None
+    steady = [(t, mb) for t, mb in samples if t >= warmup_sec] or samples
+    t, mb = np.array(steady).T
+    slope = float(np.polyfit(t, mb, 1)[0]) if len(steady) > 2 else 0.0
+    return {
+        "start_mb": samples[0][1],
+        "end_mb": samples[-1][1],
+        "peak_mb": max(mb for _, mb in samples),
+        "growth_mb": float(mb[-1] - mb[0]),   # after the warm-up
+        "slope_mb_per_min": 60.0 * slope,
+        "samples": samples,
+    }
+
+
+async def load_test(args):
+    proc, workdir, server_cpu = None, None, None
+    url = args.url
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix="axial-load-")
+        port = free_port()
+        proc = start_server(port, args.source, args.pace, workdir)
+        url = f"http://127.0.0.1:{port}"
+    ws_url = url.replace("http", "ws", 1) + "/current_status"
+
+    clients = [{"latencies": [], "events": {}, "messages": 0, "frames": 0, "gaps": 0, "bytes": 0} for _ in range(args.clients)]
+    rss_samples = []
+    stop = asyncio.Event()
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as http:
+            await wait_ready(http, url, args.startup_timeout)
+            session_ids = []
+            for _ in range(args.sessions):
+                response = await http.post(f"{url}/start")
+                response.raise_for_status()
+                session_ids.append(response.json()["sessionId"])
+            start = time.monotonic()
+            tasks = [
+                asyncio.create_task(run_client(f"{ws_url}?session={session_ids[i % len(session_ids)]}", stop, c, args.stream))
+                for i, c in enumerate(clients)
+            ]
+            if proc is not None:
+                tasks.append(asyncio.create_task(sample_rss(proc.pid, stop, rss_samples, start)))
+                server_cpu = cpu_sec(proc.pid)
+            await asyncio.sleep(args.duration)
+            stop.set()
+            await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - start
+            if proc is not None:
+                server_cpu = 100.0 * (cpu_sec(proc.pid) - server_cpu) / elapsed
+            server = {
+                "sessions": (await http.get(f"{url}/sessions")).json(),
+                "clients": (await http.get(f"{url}/clients")).json(),
+            }
+            for session_id in session_ids:
+                await http.post(f"{url}/stop", params={"session": session_id})
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    latencies = [x for c in clients for x in c["latencies"]]
+    return {
+        "config": vars(args),
+        "duration_sec": elapsed,
+        "latency_ms": percentiles_ms(latencies),
+        "per_client": [
+            {
+                "messages": c["messages"],
+                "msgs_per_sec": c["messages"] / elapsed,
+                "frames_per_sec": c["frames"] / elapsed,
+                "bytes": c["bytes"],
+                "stream_gaps": c["gaps"],
+                "events": c["events"],
+                "latency_ms": percentiles_ms(c["latencies"]),
+            }
+            for c in clients
+        ],
+        "throughput_msgs_per_sec": sum(c["messages"] for c in clients) / elapsed,
+        "rss": rss_report(rss_samples, args.warmup),
+        "server_cpu_pct": server_cpu,
+        "server": server,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the server with a replayed frame source and WebSocket clients.")
+    parser.add_argument("--sessions", type=int, default=1, help="concurrent monitoring sessions")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent WebSocket clients, spread over the sessions")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to record")
+    parser.add_argument("--source", default="synthetic", help='"synthetic", a video file or an image directory')
+    parser.add_argument("--pace", choices=("realtime", "fast"), default="realtime", help="replay at the source fps or as fast as processed")
+    parser.add_argument("--stream", action="store_true", help='subscribe to the binary "metrics_stream" instead of JSON metrics')
+    parser.add_argument("--url", help="use a running server instead of starting one (no RSS sampling)")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of RSS samples ignored for growth")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--max-p99-ms", type=float, help="fail if the p99 latency exceeds this")
+    parser.add_argument("--max-rss-growth-mb", type=float, help="fail if RSS grows more than this after the warm-up")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(load_test(args))
+    latency, rss = report["latency_ms"], report["rss"]
+    frames = sum(c["frames_per_sec"] for c in report["per_client"])
+    kib = sum(c["bytes"] for c in report["per_client"]) / report["duration_sec"] / 1024.0
+    print(f"{args.sessions} sessions, {args.clients} clients, {report['duration_sec']:.1f}s, "
+          f"{report['throughput_msgs_per_sec']:.1f} msgs/s, {frames:.1f} frames/s, {kib:.1f} KiB/s total")
+    if latency:
+        print("latency ms: " + "  ".join(f"{k} {v:.2f}" for k, v in latency.items()))
+    if report["server_cpu_pct"] is not None:
+        print(f"server process cpu: {report['server_cpu_pct']:.1f}%")
+    if rss:
+        print(f"rss: {rss['start_mb']:.1f} -> {rss['end_mb']:.1f} MB (peak {rss['peak_mb']:.1f}, {rss['slope_mb_per_min']:+.2f} MB/min)")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.max_p99_ms is not None and (latency is None or latency["p99"] > args.max_p99_ms):
+        failures.append(f"p99 latency {latency and round(latency['p99'], 2)} ms > {args.max_p99_ms} ms")
+    if args.max_rss_growth_mb is not None and rss is not None and rss["growth_mb"] > args.max_rss_growth_mb:
+        failures.append(f"RSS grew {rss['growth_mb']:.1f} MB > {args.max_rss_growth_mb} MB")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
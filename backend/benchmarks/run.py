@@ -0,0 +1,469 @@
+"""
+Benchmark runner. Every benchmark is timed in `--repeat` rounds after a
+warm-up round, with the garbage collector off (like timeit); the report
+keeps the median and min per-iteration time of the rounds, their spread,
+per-iteration latency percentiles and, from a separate tracemalloc pass,
+the peak and retained allocations. Inputs come from seeded fixtures, so
+two reports from the same machine are directly comparable:
+
+    python -m benchmarks.run --out before.json
+    ... change something ...
+    python -m benchmarks.run --compare before.json   # exit 1 on regression
+"""
+import argparse
+import asyncio
+import fnmatch
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from benchmarks.fixtures import SyntheticSession, synthetic_frames
+from src.blink_engine import EYE_LANDMARKS, LEFT_EYE_ROWS, BlinkAnalyzer, compute_EAR
+from src.broadcast import METRICS_STREAM_TYPE, METRICS_TYPE
+from src.instrumentation import PipelineMetrics
+from src.metrics_stream import MetricsStreamEncoder
+from src.monitor import AdaptiveScheduler, SessionSink
+from src.pipeline import FrameContext, Pipeline
+from src.posture_engine import (
+    PostureAnalyzer,
+    compute_bad_posture_score,
+    compute_bad_posture_score_batch,
+    compute_posture_metrics,
+    compute_posture_metrics_batch,
+)
+from src.replay import replay
+from src.tracker import SessionTracker
+from src.utils import landmarks_to_array
+
+REPORT_VERSION = 1
+LOOP_SCENARIOS = ("good", "slouched", "mixed", "low_blink", "away")
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register `setup() -> (step(i), iterations)` under `name`."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+# ----------------- Fixtures (built once per run) -----------------
+_sessions = {}
+_results = {}
+
+
+def session(scenario):
+    if scenario not in _sessions:
+        _sessions[scenario] = SyntheticSession(scenario)
+    return _sessions[scenario]
+
+
+def mp_results(scenario):
+    if scenario not in _results:
+        _results[scenario] = session(scenario).all_results()
+    return _results[scenario]
+
+
+def pixel_points(scenario):
+    s = session(scenario)
+    scale = np.array([s.width, s.height, s.width], dtype=np.float32)
+    valid = s.pose_valid & s.face_valid
+    pose = np.ascontiguousarray(s.pose[valid, :, :3] * scale)
+    eyes = np.ascontiguousarray(s.eyes[valid] * scale)
+    return pose, eyes
+
+
+class NullHub:
+    """
+    Stands in for the BroadcastHub; `subscribed` (True, False or the types
+    that have subscribers) decides whether metrics messages are built.
+    """
+
+    def __init__(self, subscribed=False):
+        self.subscribed = subscribed
+        self.published = 0
+
+    def publish(self, message):
+        self.published += 1
+
+    def publish_binary(self, msg_type, data):
+        self.published += 1
+
+    def has_subscribers(self, msg_type):
+        if isinstance(self.subscribed, bool):
+            return self.subscribed
+        return msg_type in self.subscribed
+
+
+class FixtureInference:
+    """ParallelInference stand-in that hands out prerecorded results in order."""
+
+    def __init__(self, results):
+        self.results = results
+        self.workers = {"pose": None, "face": None}
+        self.i = -1
+
+    def process(self, rgb, only=None, inputs=None):
+        self.i = (self.i + 1) % len(self.results)
+        return {name: r for name, r in self.results[self.i].items() if only is None or name in only}
+
+    async def process_async(self, rgb, only=None, inputs=None):
+        return self.process(rgb, only, inputs)
+
+    def latency(self, name):
+        return 0.0
+
+    def close(self):
+        pass
+
+
+def _context(results, i, frame):
+    ctx = FrameContext(i, 1_700_000_000.0 + i / 30.0, frame, None, True)
+    ctx.results = results[i]
+    return ctx
+
+
+# ----------------- Scoring functions (per call) -----------------
+@benchmark("landmarks_to_array/pose")
+def _():
+    results = [r["pose"].pose_landmarks.landmark for r in mp_results("mixed")]
+    buf = np.empty((33, 3), dtype=np.float32)
+    return (lambda i: landmarks_to_array(results[i], 640, 480, buf)), len(results)
+
+
+@benchmark("landmarks_to_array/eyes")
+def _():
+    results = [r["face"].multi_face_landmarks[0].landmark for r in mp_results("mixed")]
+    buf = np.empty((12, 3), dtype=np.float32)
+    return (lambda i: landmarks_to_array(results[i], 640, 480, buf, EYE_LANDMARKS)), len(results)
+
+
+@benchmark("compute_posture_metrics")
+def _():
+    pose, _ = pixel_points("mixed")
+    return (lambda i: compute_posture_metrics(pose[i])), len(pose)
+
+
+@benchmark("compute_bad_posture_score")
+def _():
+    pose, _ = pixel_points("mixed")
+    metrics = [compute_posture_metrics(p) for p in pose]
+    return (lambda i: compute_bad_posture_score(metrics[i])), len(metrics)
+
+
+@benchmark("compute_posture_metrics_batch")
+def _():
+    # every pose frame of the scenario (1 800) per iteration
+    pose, _ = pixel_points("mixed")
+    return (lambda i: compute_posture_metrics_batch(pose)), 20
+
+
+@benchmark("compute_bad_posture_score_batch")
+def _():
+    pose, _ = pixel_points("mixed")
+    metrics = compute_posture_metrics_batch(pose)
+    return (lambda i: compute_bad_posture_score_batch(metrics)), 20
+
+
+@benchmark("compute_EAR")
+def _():
+    _, eyes = pixel_points("mixed")
+    return (lambda i: compute_EAR(eyes[i][LEFT_EYE_ROWS])), len(eyes)
+
+
+# ----------------- Per-frame stages -----------------
+@benchmark("analyze/posture")
+def _():
+    results = mp_results("mixed")
+    frame = synthetic_frames(1)[0]
+    analyzer = PostureAnalyzer()
+    contexts = [_context(results, i, frame) for i in range(len(results))]
+    return (lambda i: analyzer.analyze(contexts[i])), len(contexts)
+
+
+@benchmark("analyze/blink")
+def _():
+    results = mp_results("mixed")
+    frame = synthetic_frames(1)[0]
+    analyzer = BlinkAnalyzer()
+    contexts = [_context(results, i, frame) for i in range(len(results))]
+    return (lambda i: analyzer.analyze(contexts[i])), len(contexts)
+
+
+def _tracker_setup(scenario):
+    s = session(scenario)
+    scale = np.array([s.width, s.height, s.width], dtype=np.float32)
+    scores, ears = [], []
+    for i in range(len(s)):
+        scores.append(compute_bad_posture_score(compute_posture_metrics(s.pose[i, :, :3] * scale)) if s.pose_valid[i] else None)
+        ears.append(float(s.ear[i]) if s.face_valid[i] else None)
+    timestamps = s.timestamps.tolist()
+    tracker = SessionTracker(start_time=timestamps[0])
+
+    def step(i):
+        now = timestamps[i]
+        tracker.update_posture(now, scores[i])
+        tracker.update_blink(now, ears[i])
+        tracker.step(now)
+
+    # the tracker is stateful: every round replays the whole stream on a fresh one
+    def reset():
+        nonlocal tracker
+        tracker = SessionTracker(start_time=timestamps[0])
+
+    step.reset = reset
+    return step, len(s)
+
+
+def _sink_setup(scenario, subscribed):
+    s = session(scenario)
+    results = mp_results(scenario)
+    frame = synthetic_frames(1)[0]
+    posture, blink = PostureAnalyzer(), BlinkAnalyzer()
+    contexts = []
+    for i in range(len(results)):
+        ctx = _context(results, i, frame)
+        ctx.ts = float(s.timestamps[i])
+        posture.analyze(ctx)
+        blink.analyze(ctx)
+        contexts.append(ctx)
+    hub = NullHub(subscribed)
+    sink = SessionSink(SessionTracker(start_time=contexts[0].ts), AdaptiveScheduler(), hub, stream=MetricsStreamEncoder())
+
+    def reset():
+        sink.tracker = SessionTracker(start_time=contexts[0].ts)
+        sink.stream.reset()
+
+    step = lambda i: sink(contexts[i])
+    step.reset = reset
+    return step, len(contexts)
+
+
+for _scenario in LOOP_SCENARIOS:
+    benchmark(f"tracker/{_scenario}")(lambda scenario=_scenario: _tracker_setup(scenario))
+
+benchmark("sink/mixed")(lambda: _sink_setup("mixed", subscribed=False))
+benchmark("sink/mixed+metrics")(lambda: _sink_setup("mixed", subscribed={METRICS_TYPE}))
+benchmark("sink/mixed+stream")(lambda: _sink_setup("mixed", subscribed={METRICS_STREAM_TYPE}))
+
+
+# ----------------- End to end -----------------
+def _pipeline_setup(scenario, use_async, instrumented=False):
+    """
+    One frame through Pipeline: mirror/RGB preprocessing of a 640x480 frame,
+    analyzers, SessionSink. Inference is replaced by the fixture results, so
+    this is the loop's own cost on top of MediaPipe. `instrumented` adds
+    the per-stage histograms of /metrics.
+    """
+    s = session(scenario)
+    results = mp_results(scenario)
+    frames = synthetic_frames()
+    hub = NullHub()
+    pipeline = Pipeline([PostureAnalyzer(), BlinkAnalyzer()], scheduler=AdaptiveScheduler())
+    pipeline.inference = FixtureInference(results)
+    sink = SessionSink(SessionTracker(), pipeline.scheduler, hub)
+    pipeline.sinks.append(sink)
+    if instrumented:
+        PipelineMetrics().attach(pipeline)
+    timestamps = s.timestamps.tolist()
+
+    if use_async:
+        loop = asyncio.new_event_loop()
+
+        def step(i):
+            due = pipeline._due(timestamps[i])
+            if due is None or due:
+                loop.run_until_complete(pipeline.process_async(frames[i % len(frames)], i, timestamps[i], due))
+    else:
+        def step(i):
+            due = pipeline._due(timestamps[i])
+            if due is None or due:
+                pipeline.process(frames[i % len(frames)], i, timestamps[i], due)
+
+    def reset():
+        pipeline.inference.i = -1
+        pipeline.scheduler = sink.scheduler = AdaptiveScheduler()
+        sink.tracker = SessionTracker(start_time=timestamps[0])
+
+    step.reset = reset
+    return step, len(results)
+
+
+benchmark("pipeline/mixed")(lambda: _pipeline_setup("mixed", use_async=False))
+benchmark("pipeline/mixed-async")(lambda: _pipeline_setup("mixed", use_async=True))
+benchmark("pipeline/mixed+instrumented")(lambda: _pipeline_setup("mixed", use_async=False, instrumented=True))
+
+
+@benchmark("replay/mixed")
+def _():
+    # whole stream per iteration: offline re-scoring throughput
+    s = session("mixed")
+    return (lambda i: replay(s)), 3
+
+
+# ----------------- Harness -----------------
+def _round(step, n):
+    reset = getattr(step, "reset", None)
+    if reset is not None:
+        reset()
+    times = np.empty(n, dtype=np.float64)
+    clock = time.perf_counter
+    t_start = clock()
+    for i in range(n):
+        t0 = clock()
+        step(i)
+        times[i] = clock() - t0
+    return clock() - t_start, times
+
+
+def _allocations(step, n):
+    reset = getattr(step, "reset", None)
+    if reset is not None:
+        reset()
+    step(0)  # lazily built buffers are not the steady state
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for i in range(n):
+        step(i)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base, (current - base) / n
+
+
+def run_benchmark(setup, repeat):
+    step, n = setup()
+    _round(step, n)  # warm-up
+
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        rounds = [_round(step, n) for _ in range(repeat)]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    per_iter = [total / n for total, _ in rounds]
+    latencies = np.concatenate([times for _, times in rounds])
+    median = statistics.median(per_iter)
+    peak, retained = _allocations(step, n)
+    return {
+        "iterations": n,
+        "repeat": repeat,
+        "median_us": median * 1e6,
+        "min_us": min(per_iter) * 1e6,
+        "spread_pct": 100.0 * (max(per_iter) - min(per_iter)) / median if median > 0 else 0.0,
+        "per_sec": 1.0 / median if median > 0 else None,
+        "p50_us": float(np.percentile(latencies, 50)) * 1e6,
+        "p95_us": float(np.percentile(latencies, 95)) * 1e6,
+        "p99_us": float(np.percentile(latencies, 99)) * 1e6,
+        "alloc_peak_kb": peak / 1024.0,
+        "retained_b_per_iter": retained,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "version": REPORT_VERSION,
+        "timestamp": time.time(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "mediapipe": mp.__version__,
+    }
+
+
+def compare(report, baseline, threshold):
+    """Rows of (name, old min, new min, ratio, regressed) for benchmarks in both reports."""
+    rows = []
+    for name, new in report["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        # best round: the least disturbed by the rest of the machine
+        ratio = new["min_us"] / old["min_us"] if old["min_us"] > 0 else float("inf")
+        # a slowdown within the noise of either run is not a regression
+        noise = max(new["spread_pct"], old["spread_pct"]) / 100.0
+        regressed = ratio > 1.0 + max(threshold, noise)
+        rows.append((name, old["min_us"], new["min_us"], ratio, regressed))
+    return rows
+
+
+def print_report(report):
+    print(f"{'benchmark':32} {'median us':>11} {'min us':>10} {'spread':>7} {'p95 us':>10} {'p99 us':>10} {'peak KiB':>9} {'B/iter':>7}")
+    for name, r in report["results"].items():
+        print(
+            f"{name:32} {r['median_us']:11.2f} {r['min_us']:10.2f} {r['spread_pct']:6.1f}% "
+            f"{r['p95_us']:10.2f} {r['p99_us']:10.2f} {r['alloc_peak_kb']:9.1f} {r['retained_b_per_iter']:7.1f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the posture/blink hot paths on synthetic landmarks.")
+    parser.add_argument("-k", "--filter", action="append", help="only benchmarks matching this glob (repeatable)")
+    parser.add_argument("--repeat", type=int, default=7, help="timed rounds per benchmark")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown counted as a regression (0.10 = 10%%)")
+    parser.add_argument("--list", action="store_true", help="list benchmark names and exit")
+    args = parser.parse_args(argv)
+
+    names = [
+        name for name in BENCHMARKS
+        if not args.filter or any(fnmatch.fnmatch(name, pattern) for pattern in args.filter)
+    ]
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    report = {"environment": environment(), "results": {}}
+    for name in names:
+        report["results"][name] = run_benchmark(BENCHMARKS[name], args.repeat)
+        print(f"  {name}: {report['results'][name]['median_us']:.2f} us", file=sys.stderr)
+    print_report(report)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["environment"].get("machine") != report["environment"]["machine"]:
+            print("warning: baseline was recorded on a different machine", file=sys.stderr)
+        print(f"\n{'benchmark (min)':32} {'baseline us':>12} {'now us':>10} {'ratio':>7}")
+        regressions = 0
+        for name, old, new, ratio, regressed in compare(report, baseline, args.threshold):
+            regressions += regressed
+            print(f"{name:32} {old:12.2f} {new:10.2f} {ratio:6.2f}x{'  REGRESSION' if regressed else ''}")
+        if regressions:
+            print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
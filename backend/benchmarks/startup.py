@@ -0,0 +1,149 @@
+"""
+Cold-start report: how long a fresh server takes to answer HTTP and how long
+from POST /start until the first processed frame reaches a WebSocket client.
+
+Every run starts a new server (see loadtest.start_server) and measures:
+
+  - import_sec: importing main in a fresh interpreter, and which heavy
+    modules (cv2, mediapipe) that pulled in,
+  - ready_sec: process start -> first answer to GET /sessions,
+  - prewarm_sec: what the session workers report for their prewarm,
+  - start_call_sec: POST /start round trip,
+  - first_result_sec: POST /start -> first "metrics" message.
+
+`--start-after` is when /start is sent: "ready" (as soon as the server
+answers), "prewarmed" (once every worker reports its prewarm done) or a
+number of seconds after ready.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --prewarm off --out cold.json
+    python -m benchmarks.startup --start-after prewarmed
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+
+from benchmarks.loadtest import BACKEND_DIR, free_port, start_server, wait_ready
+
+HEAVY_MODULES = ("cv2", "mediapipe", "matplotlib")
+
+IMPORT_PROBE = f"""
+import sys, time
+t = time.perf_counter()
+import main
+print(time.perf_counter() - t)
+print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+
+def measure_import(workdir):
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], cwd=workdir, check=True, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=BACKEND_DIR, AXIAL_METRICS_DB=os.path.join(workdir, "import.db")),
+    ).stdout.splitlines()
+    return float(out[0]), out[1].split() if len(out) > 1 else []
+
+
+async def wait_prewarmed(client, url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        workers = (await client.get(f"{url}/sessions")).json()["workers"]
+        if workers and all(w.get("prewarm_sec") is not None for w in workers):
+            return
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"workers not prewarmed after {timeout}s")
+
+
+async def first_metrics(ws):
+    while True:
+        msg = json.loads(await ws.recv())
+        if msg.get("type") == "metrics":
+            return msg
+
+
+async def one_run(args):
+    workdir = tempfile.mkdtemp(prefix="axial-startup-")
+    result = {}
+    result["import_sec"], result["heavy_modules"] = measure_import(workdir)
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    started = time.monotonic()
+    proc = start_server(port, args.source, "realtime", workdir, AXIAL_PREWARM="1" if args.prewarm == "on" else "0")
+    try:
+        async with httpx.AsyncClient(timeout=30.0) as http:
+            await wait_ready(http, url, args.startup_timeout)
+            result["ready_sec"] = time.monotonic() - started
+
+            if args.start_after == "prewarmed":
+                await wait_prewarmed(http, url, args.startup_timeout)
+            elif args.start_after != "ready":
+                await asyncio.sleep(float(args.start_after))
+
+            ws_url = url.replace("http", "ws", 1) + "/current_status"
+            async with websockets.connect(ws_url, max_size=None) as ws:
+                await ws.send(json.dumps({"action": "subscribe", "types": ["metrics"]}))
+                await asyncio.sleep(0.1)   # let the subscription reach the server
+                t = time.monotonic()
+                response = await http.post(f"{url}/start")
+                response.raise_for_status()
+                result["start_call_sec"] = time.monotonic() - t
+                await asyncio.wait_for(first_metrics(ws), args.startup_timeout)
+                result["first_result_sec"] = time.monotonic() - t
+
+            workers = (await http.get(f"{url}/sessions")).json()["workers"]
+            result["prewarm_sec"] = [w.get("prewarm_sec") for w in workers]
+            await http.post(f"{url}/stop")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+
+def summarize(runs, key):
+    values = [r[key] for r in runs]
+    return {"median": statistics.median(values), "min": min(values), "max": max(values)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure server time-to-ready and time-to-first-result.")
+    parser.add_argument("--runs", type=int, default=3, help="fresh servers to start")
+    parser.add_argument("--source", default="synthetic", help='frame source of the session ("synthetic", a video, an image directory)')
+    parser.add_argument("--prewarm", choices=("on", "off"), default="on", help="AXIAL_PREWARM of the server")
+    parser.add_argument("--start-after", default="ready", help='"ready", "prewarmed" or seconds after ready')
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    runs = [asyncio.run(one_run(args)) for _ in range(args.runs)]
+    report = {
+        "config": vars(args),
+        "runs": runs,
+        **{key: summarize(runs, key) for key in ("import_sec", "ready_sec", "start_call_sec", "first_result_sec")},
+    }
+    heavy = sorted({m for r in runs for m in r["heavy_modules"]})
+    print(f"import main: {report['import_sec']['median'] * 1000:.0f} ms (loads {', '.join(heavy) or 'no heavy modules'})")
+    for key in ("ready_sec", "start_call_sec", "first_result_sec"):
+        s = report[key]
+        print(f"{key[:-4]}: {s['median'] * 1000:.0f} ms (min {s['min'] * 1000:.0f}, max {s['max'] * 1000:.0f})")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,46 @@
-import threading
+import os
 import asyncio
+from datetime import datetime, timezone
+from typing import Optional
 
 import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
 
-from src.monitor import run_combined_monitor, main_backend
+from src.analytics import RANGES, AnalyticsQueries
+from src.autotune import LEVELS
+from src.broadcast import COALESCE, BroadcastHub
+from src.instrumentation import PipelineMetrics, render_snapshots
+from src.metrics_store import MetricsStore
+from src.sessions import AdmissionError, SessionManager, camera_device
 
 app = FastAPI()
 
-# shared flag to control recording start/stop
-recording_flag = {"recording": False}
+# FaceMesh on the Pose head crop instead of the full frame (see BlinkAnalyzer)
+FACE_ROI = False
+
+# Default frame source of a session: the webcam unless AXIAL_FRAME_SOURCE
+# names another one ("synthetic", a video file or an image directory; see
+# capture.open_source). AXIAL_FRAME_PACE=fast replays every frame as fast
+# as it is processed. /start can pick a source per session, but only a
+# webcam ("camera", "camera:N"), "synthetic" or, when AXIAL_REPLAY_DIR is
+# set, a file or image directory inside that directory (by relative name).
+FRAME_SOURCE = os.environ.get("AXIAL_FRAME_SOURCE")
+REPLAY_DIR = os.environ.get("AXIAL_REPLAY_DIR")
+FRAME_REALTIME = os.environ.get("AXIAL_FRAME_PACE", "realtime") != "fast"
+
+# per-frame session history + per-minute/per-hour rollups (SQLite, WAL)
+METRICS_DB_PATH = os.environ.get("AXIAL_METRICS_DB", "data/metrics.db")
+metrics_store = MetricsStore(METRICS_DB_PATH)
+# cached range queries over the store for the Analytics screen
+analytics = AnalyticsQueries(metrics_store)
+
+# per-stage latency histograms for /metrics; False leaves the loop untimed
+INSTRUMENTATION = True
+# the server's own stages (broadcast.send); each session times its pipeline
+pipeline_metrics = PipelineMetrics() if INSTRUMENTATION else None
 
 # Allow Electron frontend to connect
 app.add_middleware(
@@ -20,65 +50,304 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ----------------- WebSocket Manager -----------------
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+# ----------------- WebSocket Broadcast Hub -----------------
+# Events are published from the monitor thread; the hub hands them to this
+# server's loop and gives every client its own bounded queue and sender.
+# COALESCE: if a client falls behind, only the newest event of each type is kept.
+# This hub gets the events of every session; each session also has its own.
+posture_manager = BroadcastHub(maxsize=64, policy=COALESCE)
+posture_manager.metrics = pipeline_metrics
+
+# ----------------- Sessions -----------------
+# Every session is its own pipeline (source, scheduler, tracker, autotuner)
+# in a worker process. A worker hosts SESSIONS_PER_WORKER sessions, up to
+# MAX_WORKERS workers (None: half the cores); new sessions are refused
+# while the workers use more than MAX_CPU_PCT of the machine.
+MAX_WORKERS = None
+SESSIONS_PER_WORKER = 2
+MAX_CPU_PCT = 85.0
+# Run each session's Pose/FaceMesh in processes of their own, frames passed
+# through shared memory: sessions sharing a worker no longer contend for
+# its GIL, at the cost of two more processes per session.
+PROCESS_INFERENCE = False
+# Nothing heavy (cv2, mediapipe, the camera) is loaded by the server; with
+# PREWARM one worker is started right after startup and loads the models in
+# the background, so the first /start does not wait for them.
+# AXIAL_PREWARM=0 leaves it all to the first /start.
+PREWARM = os.environ.get("AXIAL_PREWARM", "1") != "0"
+
+sessions = SessionManager(
+    posture_manager,
+    store=metrics_store,
+    max_workers=MAX_WORKERS,
+    sessions_per_worker=SESSIONS_PER_WORKER,
+    max_cpu_pct=MAX_CPU_PCT,
+    metrics=pipeline_metrics,
+    session_options={
+        "face_roi": FACE_ROI,
+        # seconds a paused session (/pause) keeps its camera and graphs open
+        "idle_release_sec": 30.0,
+        # throttles Pose/FaceMesh while the user's state is stable; rates are in Hz
+        "scheduler": {"posture_idle_hz": 3.0, "blink_idle_hz": 10.0},
+        # Pose complexity / capture resolution picked from measured frame time and
+        # CPU; max_cpu_pct is of the session's own cores (see AutoTuner)
+        "autotune": {"target_fps": 30.0, "max_cpu_pct": 75.0},
+        "instrumentation": INSTRUMENTATION,
+        "process_inference": PROCESS_INFERENCE,
+        # "metrics_stream" subscribers: frames per binary batch, its max age
+        # (seconds) and how often a batch starts with every field
+        "stream": {"batch_frames": 8, "max_delay": 0.25, "keyframe_sec": 1.0},
+    },
+)
+
+def get_session(session_id=None):
+    # no id: the newest live session (what a single-user frontend means)
+    try:
+        return sessions.get(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no session {session_id}" if session_id else "no active session")
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+def iso_time(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts is not None else None
 
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+# ----------------- Session Config -----------------
+class SessionConfig(BaseModel):
+    # same shape as the frontend's SessionStartRequest
+    posture: bool = True
+    eyeStrain: bool = True
+    distractions: bool = False
+    # per session, backend only
+    source: Optional[str] = None       # default: AXIAL_FRAME_SOURCE / the webcam
+    realtime: Optional[bool] = None    # default: AXIAL_FRAME_PACE
+    record: Optional[bool] = None      # write history to the metrics store;
+                                       # default: only for a webcam source
 
-    async def broadcast(self, message: dict):
-        # Called from run_combined_monitor in a background thread
-        for connection in list(self.active_connections):
-            try:
-                await connection.send_json(message)
-            except WebSocketDisconnect:
-                self.disconnect(connection)
+    def frame_source(self):
+        # never hand a client-supplied path or URL to OpenCV as is
+        source = self.source
+        if source is None:
+            return FRAME_SOURCE
+        if source in ("camera", "synthetic"):
+            return source
+        if source.startswith("camera:") and source[7:].isdigit():
+            return source
+        if REPLAY_DIR is not None and source and not os.path.isabs(source):
+            root = os.path.realpath(REPLAY_DIR)
+            path = os.path.realpath(os.path.join(root, source))
+            if path.startswith(root + os.sep) and os.path.exists(path):
+                return path
+        allowed = '"camera", "camera:N", "synthetic"'
+        if REPLAY_DIR is not None:
+            allowed += " or a replay under AXIAL_REPLAY_DIR"
+        raise HTTPException(status_code=400, detail=f"source must be {allowed}")
 
-posture_manager = ConnectionManager()
+    def stages(self):
+        # distractions has no pipeline stage yet, so it does not load anything
+        stages = set()
+        if self.posture:
+            stages.add("posture")
+        if self.eyeStrain:
+            stages.add("eye_strain")
+        if not stages:
+            raise HTTPException(status_code=400, detail="select posture and/or eyeStrain")
+        return stages
 
 # ----------------- HTTP Endpoints -----------------
+# `session` (query) picks a session by id; without it the newest live one.
 @app.post("/start")
-async def start_recording():
-    recording_flag["recording"] = True
-    return {"status": "recording started"}
+async def start_recording(config: Optional[SessionConfig] = None):
+    # Starts a new session; only the stages it asked for are loaded and run.
+    config = config or SessionConfig()
+    stages = config.stages()
+    source = config.frame_source()
+    # synthetic and replayed frames stay out of the user's Analytics history
+    record = camera_device(source) is not None if config.record is None else config.record
+    try:
+        session = sessions.create(
+            stages,
+            source=source,
+            realtime=FRAME_REALTIME if config.realtime is None else config.realtime,
+            record=record,
+        )
+    except AdmissionError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "status": "recording started",
+        "sessionId": session.id,
+        "startTime": iso_time(session.started_at),
+        "stages": sorted(stages),
+    }
+
+@app.post("/config")
+async def update_config(config: SessionConfig, session: Optional[str] = None):
+    # add/remove stages mid-session; the camera keeps running
+    stages = config.stages()
+    sessions.configure(get_session(session).id, stages)
+    return {"stages": sorted(stages)}
+
+@app.post("/pause")
+async def pause_recording(session: Optional[str] = None):
+    # keeps the session; its camera and graphs are released after idle_release_sec
+    return {"sessionId": sessions.pause(get_session(session).id).id, "paused": True}
+
+@app.post("/resume")
+async def resume_recording(session: Optional[str] = None):
+    return {"sessionId": sessions.pause(get_session(session).id, False).id, "paused": False}
 
 @app.post("/stop")
-async def stop_recording():
-    recording_flag["recording"] = False
-    return {"status": "recording stopped"}
+async def stop_recording(session: Optional[str] = None):
+    # ends the session: its camera and graphs are released before we return
+    if session is None and not any(s.live for s in sessions.sessions.values()):
+        # nothing to stop (server restarted, worker crashed): not an error
+        return {"status": "no active session", "sessionId": None, "endTime": None, "duration": 0.0}
+    ended = await sessions.close(get_session(session).id)
+    return {
+        "status": "recording stopped",
+        "sessionId": ended.id,
+        "endTime": iso_time(ended.ended_at or datetime.now(timezone.utc).timestamp()),
+        "duration": ended.duration(),
+    }
+
+@app.get("/sessions")
+async def session_list():
+    # every live (and recently ended) session, worker load, admission counters
+    return sessions.stats()
+
+@app.get("/sessions/{session_id}")
+async def session_info(session_id: str):
+    return get_session(session_id).info()
+
+@app.delete("/sessions/{session_id}")
+async def session_close(session_id: str):
+    return (await sessions.close(get_session(session_id).id)).info()
+
+@app.get("/scheduler")
+async def scheduler_stats(session: Optional[str] = None):
+    # current per-model inference rates and the CPU time saved by throttling
+    return get_session(session).stats.get("scheduler", {})
+
+@app.get("/autotune")
+async def autotune_stats(session: Optional[str] = None):
+    # chosen Pose complexity/resolution, what each level measured, switch log
+    return get_session(session).stats.get("autotune", {})
+
+class AutotuneConfig(BaseModel):
+    enabled: Optional[bool] = None
+    level: Optional[int] = None   # pin a level (index into "levels")
+
+@app.post("/autotune")
+async def update_autotune(config: AutotuneConfig, session: Optional[str] = None):
+    target = get_session(session)
+    if config.level is not None and not 0 <= config.level < len(LEVELS):
+        raise HTTPException(status_code=400, detail=f"level must be 0..{len(LEVELS) - 1}")
+    # applied by the session's monitor loop; stats show it after the next report
+    sessions.set_autotune(target.id, config.enabled, config.level)
+    return target.stats.get("autotune", {})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # Prometheus text format: stage latency histograms, fps, drops, queue depth;
+    # one `session` label per live session, the server's own samples unlabeled
+    if pipeline_metrics is None:
+        raise HTTPException(status_code=404, detail="instrumentation is disabled")
+    live = [s for s in sessions.sessions.values() if s.live]
+    snapshots = {None: pipeline_metrics.snapshot()}
+    snapshots.update({s.id: s.stats["metrics"] for s in live if s.stats.get("metrics")})
+    hubs = {None: posture_manager, **{s.id: s.hub for s in live}}
+    return PlainTextResponse(render_snapshots(snapshots, hubs), media_type="text/plain; version=0.0.4")
+
+@app.get("/storage")
+async def storage_stats():
+    # metrics store write/rollup counters and analytics cache hit rate
+    return {"store": metrics_store.stats(), "analytics_cache": analytics.stats()}
+
+# ----------------- Analytics Endpoints -----------------
+# Plain `def`: FastAPI runs them in its threadpool, so SQLite reads never
+# block the event loop. Either pass a preset `range` (day/week/month/year)
+# or explicit `start`/`end` (unix seconds) and `bucket` (seconds).
+# `tz_offset` (seconds east of UTC) aligns day buckets to local midnight.
+def resolve_range(range, start, end, bucket, tz_offset):
+    if range is not None:
+        if range not in RANGES:
+            raise HTTPException(status_code=400, detail=f"range must be one of {sorted(RANGES)}")
+        preset_start, preset_end, preset_bucket = analytics.preset(range, offset=-tz_offset)
+        start = preset_start if start is None else start
+        end = preset_end if end is None else end
+        bucket = preset_bucket if bucket is None else bucket
+    if start is None or end is None or end <= start:
+        raise HTTPException(status_code=400, detail="need range or start < end")
+    if bucket is None:
+        bucket = max(int(end - start) // 60, 1)   # about 60 points
+    if bucket < 1:
+        raise HTTPException(status_code=400, detail="bucket must be >= 1 second")
+    return start, end, bucket
+
+@app.get("/analytics/series")
+def analytics_series(
+    range: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    bucket: Optional[int] = None,
+    tz_offset: int = 0,
+):
+    # posture score, bad-posture time and blink rate per bucket
+    start, end, bucket = resolve_range(range, start, end, bucket, tz_offset)
+    return analytics.series(start, end, bucket, offset=-tz_offset)
+
+@app.get("/analytics/summary")
+def analytics_summary(
+    range: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    tz_offset: int = 0,
+):
+    # totals: time in bad posture, average score, blink rate, warning counts
+    start, end, _ = resolve_range(range, start, end, None, tz_offset)
+    return analytics.summary(start, end)
+
+@app.get("/clients")
+async def client_stats():
+    # per-client queue depth, lag and drop counters, per hub; "stream" is
+    # the session's metrics_stream encoder (batches, suppressed values)
+    return {
+        "all": posture_manager.stats(),
+        "sessions": {
+            s.id: {**s.hub.stats(), "stream": s.stats.get("stream")}
+            for s in sessions.sessions.values() if s.live
+        },
+    }
 
 # ----------------- WebSocket Endpoints -----------------
 @app.websocket("/current_status")
-async def ws_posture(websocket: WebSocket):
-    await posture_manager.connect(websocket)
-    try:
-        # Just keep the connection open; the background task will push messages.
-        while True:
-            await asyncio.sleep(1)
-    except WebSocketDisconnect:
-        posture_manager.disconnect(websocket)
-
-# ----------------- Background posture/blink thread -----------------
-def start_posture_thread():
-    def run():
-        # This runs your new combined monitor forever in its own event loop
-        asyncio.run(
-            main_backend(recording_flag, posture_manager)
-            # run_combined_monitor(recording_flag, posture_manager, blink_manager)
-        )
-
-    threading.Thread(target=run, daemon=True).start()
+async def ws_posture(websocket: WebSocket, session: Optional[str] = None):
+    # Pushes events as they are published and reads subscribe/unsubscribe
+    # requests, e.g. {"action": "subscribe", "types": ["metrics"]}.
+    # "metrics_stream" gets the same values as binary batches instead
+    # (src/metrics_stream.py has the layout and a decoder).
+    # Without `session`, events of every session (each has a "sessionId").
+    # Returns as soon as the client disconnects.
+    if session is None:
+        await posture_manager.serve(websocket)
+    elif session in sessions.sessions:
+        await sessions.sessions[session].hub.serve(websocket)
+    else:
+        await websocket.close(code=4404)
 
 @app.on_event("startup")
 async def startup_event():
-    start_posture_thread()
+    # bind before the session workers start publishing
+    posture_manager.bind(asyncio.get_running_loop())
+    metrics_store.start()
+    sessions.bind(asyncio.get_running_loop())
+    if PREWARM:
+        sessions.prewarm()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # stop the workers (releases their cameras), then flush queued samples
+    # and run a last rollup
+    await asyncio.to_thread(sessions.shutdown)
+    await asyncio.to_thread(metrics_store.stop)
 
 # ----------------- Main -----------------
 if __name__ == "__main__":
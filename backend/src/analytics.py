@@ -0,0 +1,243 @@
+import threading
+import time
+from collections import OrderedDict
+
+from src.metrics_store import BUCKET_COLUMNS, RAW_BUCKETS_SQL, ROLLUP_BUCKETS_SQL
+
+# Presets for the frontend's TimeRangeSelector: (span, bucket) in seconds.
+RANGES = {
+    "day": (86400, 3600),
+    "week": (7 * 86400, 86400),
+    "month": (30 * 86400, 86400),
+    "year": (365 * 86400, 30 * 86400),
+}
+
+WARNING_TYPES = ("posture_warning", "blink_warning")
+
+
+class AnalyticsQueries:
+    """
+    Read side of the MetricsStore for the Analytics screen.
+
+    A range is answered from the coarsest data that can represent the
+    requested bucket size: rollup_1h for the whole hours up to its
+    watermark, rollup_1m for the whole minutes up to its own, and raw
+    samples for the rest: the not-yet-rolled tail, a range edge that is
+    not on a minute, or buckets finer than a minute. Results are cached;
+    each batch the store commits drops only the entries whose range
+    reaches the new rows, so refreshing a past range is a dict lookup and
+    a live range is recomputed at most once per store flush.
+    """
+
+    def __init__(self, store, cache_size=256):
+        self.store = store
+        self.cache_size = cache_size
+        self._cache = OrderedDict()   # key -> (end, result)
+        self._lock = threading.Lock()
+        self._generation = 0          # bumped by every invalidation
+        self._invalidated_since = float("inf")
+        self._local = threading.local()
+        store.add_listener(self._invalidate)
+
+        # ---- COUNTERS ----
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # ----------------- Cache -----------------
+    def _cached(self, key, end, compute):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        result = compute()
+        with self._lock:
+            # new rows landed while computing: the result may miss them
+            if self._generation != generation and end > self._invalidated_since:
+                return result
+            self._cache[key] = (end, result)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _invalidate(self, oldest_ts):
+        # runs on the store's writer thread after every committed batch
+        with self._lock:
+            stale = [key for key, (end, _) in self._cache.items() if end > oldest_ts]
+            for key in stale:
+                del self._cache[key]
+            self.invalidations += len(stale)
+            self._generation += 1
+            self._invalidated_since = oldest_ts
+
+    def _db(self):
+        # one read connection per server thread; WAL readers never block the writer
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self.store.connect()
+        return db
+
+    # ----------------- Bucketed reads -----------------
+    def _buckets(self, start, end, size, offset):
+        """Aggregated rows per bucket, merged across rollup tiers and raw samples."""
+        db = self._db()
+        marks = self.store.watermarks(db)
+        tiers = []   # (step, table, watermark), coarsest first
+        if size % 60 == 0 and offset % 60 == 0:
+            if size % 3600 == 0 and offset % 3600 == 0:
+                tiers.append((3600, "rollup_1h", marks["rollup_1h"]))
+            tiers.append((60, "rollup_1m", marks["rollup_1m"]))
+
+        segments = []   # (sql, lo, hi)
+        _cover(segments, start, end, tiers)
+
+        merged = {}
+        for sql, lo, hi in segments:
+            if lo >= hi:
+                continue
+            params = {"start": lo, "end": hi, "size": size, "offset": offset % size}
+            for row in db.execute(sql, params):
+                row = dict(zip(BUCKET_COLUMNS, row))
+                acc = merged.get(row["bucket"])
+                if acc is None:
+                    merged[row["bucket"]] = row
+                else:
+                    _merge(acc, row)
+        return [merged[b] for b in sorted(merged)]
+
+    def _warning_counts(self, start, end):
+        rows = self._db().execute(
+            "SELECT type, COUNT(*) FROM events WHERE ts >= ? AND ts < ? AND type IN (?, ?) GROUP BY type",
+            (start, end) + WARNING_TYPES,
+        )
+        counts = dict.fromkeys(WARNING_TYPES, 0)
+        counts.update(rows)
+        return counts
+
+    # ----------------- Public queries -----------------
+    def series(self, start, end, bucket, offset=0):
+        """Posture score / bad posture / blink rate per bucket over [start, end)."""
+        start, end, bucket, offset = int(start), int(end), int(bucket), int(offset)
+
+        def compute():
+            return {
+                "start": start,
+                "end": end,
+                "bucket": bucket,
+                "points": [_point(row) for row in self._buckets(start, end, bucket, offset)],
+            }
+
+        return self._cached(("series", start, end, bucket, offset), end, compute)
+
+    def summary(self, start, end):
+        """Totals over [start, end): tracked/bad posture time, blink rate, warnings."""
+        start, end = int(start), int(end)
+
+        def compute():
+            # Bucket size only picks the source here (rows are summed up);
+            # hour-aligned ranges are served from rollup_1h.
+            if start % 3600 == 0 and end - start >= 3600:
+                size = _round_up(end - start, 3600)
+            elif start % 60 == 0 and end - start >= 60:
+                size = _round_up(end - start, 60)
+            else:
+                size = max(end - start, 1)
+            total = dict.fromkeys(BUCKET_COLUMNS[1:], None)
+            for row in self._buckets(start, end, size, start):
+                _merge(total, row)
+            out = _point(total)
+            del out["t"]
+            out.update(start=start, end=end, warnings=self._warning_counts(start, end))
+            return out
+
+        return self._cached(("summary", start, end), end, compute)
+
+    def preset(self, name, now=None, offset=0):
+        """(start, end, bucket) for a TimeRangeSelector preset, ending at the current bucket."""
+        span, bucket = RANGES[name]
+        now = time.time() if now is None else now
+        # quantized so repeated refreshes share one cache entry per bucket
+        end = int((now - offset) // bucket + 1) * bucket + offset
+        return end - span, end, bucket
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+def _round_up(x, step):
+    return -(-x // step) * step
+
+
+def _cover(segments, lo, hi, tiers):
+    """
+    Split [lo, hi) into (sql, lo, hi) segments: each tier only serves the
+    part that is aligned to its own buckets and already rolled up; the
+    unaligned head and tail fall through to the finer tiers and finally
+    to raw samples, so a range never gains or loses part of a bucket.
+    """
+    if lo >= hi:
+        return
+    if not tiers:
+        segments.append((RAW_BUCKETS_SQL, lo, hi))
+        return
+    (step, table, mark), finer = tiers[0], tiers[1:]
+    a = _round_up(lo, step)
+    b = (min(hi, mark) // step) * step if mark is not None else a
+    if a >= b:
+        _cover(segments, lo, hi, finer)
+        return
+    _cover(segments, lo, a, finer)
+    segments.append((ROLLUP_BUCKETS_SQL.format(table=table), a, b))
+    _cover(segments, b, hi, finer)
+
+
+def _merge(acc, row):
+    for name, value in row.items():
+        if name in ("bucket", "session_id") or value is None:
+            continue
+        prev = acc.get(name)
+        if prev is None:
+            acc[name] = value
+        elif name.endswith("_min"):
+            acc[name] = min(prev, value)
+        elif name.endswith("_max"):
+            acc[name] = max(prev, value)
+        else:
+            acc[name] = prev + value
+
+
+def _ratio(num, den, scale=1.0):
+    return num * scale / den if num is not None and den else None
+
+
+def _point(row):
+    posture_n = row.get("posture_n") or 0
+    return {
+        "t": row.get("bucket"),
+        "frames": row.get("frames") or 0,
+        "tracked_sec": row.get("tracked_sec") or 0.0,
+        "posture_sec": row.get("posture_sec") or 0.0,
+        "bad_posture_sec": row.get("bad_sec") or 0.0,
+        "bad_posture_pct": _ratio(row.get("bad_sec"), row.get("posture_sec"), 100.0),
+        "posture_score": _ratio(row.get("posture_sum"), posture_n),
+        "posture_score_min": row.get("posture_min"),
+        "posture_score_max": row.get("posture_max"),
+        "back_angle": _ratio(row.get("back_angle_sum"), posture_n),
+        "neck_angle": _ratio(row.get("neck_angle_sum"), posture_n),
+        "head_forward_cm": _ratio(row.get("head_forward_sum"), posture_n),
+        "shoulder_tilt_deg": _ratio(row.get("shoulder_tilt_sum"), posture_n),
+        "ear": _ratio(row.get("ear_sum"), row.get("ear_n")),
+        "blinks": row.get("blinks") or 0,
+        "blink_rate_per_min": _ratio(row.get("blinks"), row.get("face_sec"), 60.0),
+    }
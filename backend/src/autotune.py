@@ -0,0 +1,237 @@
+import time
+from collections import deque
+
+# Settings ladder, cheapest first: (pose model_complexity, width, height).
+LEVELS = (
+    (0, 320, 240),
+    (0, 640, 480),
+    (1, 640, 480),   # the old hardcoded setting
+    (2, 640, 480),
+    (2, 1280, 720),
+)
+DEFAULT_LEVEL = 2
+
+
+class AutoTuner:
+    """
+    Picks the Pose complexity and capture resolution at runtime so that
+    processing a frame fits the budget of `target_fps`.
+
+    As a pipeline sink it measures, per window of `interval_sec`, the mean
+    frame processing time (preprocess -> sinks), the per-model inference
+    latency and the session's CPU use. After each window:
+      - over budget (frame time above `down_ratio` of the budget, or CPU
+        above `max_cpu_pct`): one level down at once;
+      - well under budget (below `up_ratio` of both) for `up_windows`
+        windows in a row: one level up.
+    The gap between the two ratios, the windows needed to go up and
+    dropping the window right after a switch (graph reload, camera
+    settling) damp the switching; a level that was left for being too slow
+    is not tried again for `backoff_sec`, doubled every time it fails.
+
+    CPU use is the session's share of its process (process CPU time split
+    evenly between the `cpu_share` sessions that process runs) plus the
+    model processes of its pipeline, if any (inference.ProcessInference),
+    as a percentage of `cpu_cores` cores: the cores the session may use.
+
+    Switches are decided in the sink and applied by apply() from the
+    monitor loop, which can await the graph reload.
+    """
+
+    name = "autotune"
+
+    def __init__(
+        self,
+        levels=LEVELS,
+        level=DEFAULT_LEVEL,
+        target_fps=30.0,
+        max_cpu_pct=75.0,
+        cpu_cores=1.0,
+        interval_sec=5.0,
+        down_ratio=0.9,
+        up_ratio=0.6,
+        up_windows=3,
+        backoff_sec=60.0,
+        max_backoff_sec=960.0,
+        enabled=True,
+    ):
+        self.levels = levels
+        self.level = level
+        self.budget = 1.0 / target_fps
+        self.max_cpu_pct = max_cpu_pct
+        self.cpu_cores = cpu_cores
+        self.cpu_share = 1         # sessions in this process (set by the worker)
+        self.interval_sec = interval_sec
+        self.down_ratio = down_ratio
+        self.up_ratio = up_ratio
+        self.up_windows = up_windows
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.enabled = enabled
+
+        self.pipeline = None
+        self.pending = None        # level to switch to, applied by apply()
+        self._calm = 0             # consecutive under-budget windows
+        self._settling = False     # drop the window after a switch
+        self._blocked_until = {}   # level -> time it may be tried again
+        self._backoff = {}         # level -> next backoff, seconds
+        self.unavailable = set()   # levels whose graph failed to load
+        self._reset_window(time.time())
+
+        # ---- STATS ----
+        self.effect = {}           # level -> measurements of its last window
+        self.switches = deque(maxlen=20)
+
+    @property
+    def settings(self):
+        complexity, width, height = self.levels[self.level]
+        return {"pose_complexity": complexity, "width": width, "height": height}
+
+    def attach(self, pipeline):
+        """Measure `pipeline` (as its last sink) and apply switches to it."""
+        self.pipeline = pipeline
+        pipeline.sinks.append(self)
+        return self
+
+    # ----------------- Measuring (pipeline sink) -----------------
+    def _reset_window(self, now):
+        self._start = now
+        self._cpu_start = time.process_time()
+        self._child_cpu_start = self._child_cpu()
+        self._last_ts = None
+        self._frames = 0
+        self._frame_sec = 0.0
+        self._model_sec = {}
+        self._model_runs = {}
+
+    def _child_cpu(self):
+        # CPU seconds of the pipeline's model processes; 0 when they run in ours
+        cpu_time = getattr(self.pipeline.inference if self.pipeline is not None else None, "cpu_time", None)
+        return cpu_time() if cpu_time is not None else 0.0
+
+    def __call__(self, ctx):
+        now = ctx.ts
+        if self._last_ts is not None and now - self._last_ts > 1.0:
+            # paused or stalled: CPU use over the gap means nothing
+            self._reset_window(now)
+        self._last_ts = now
+
+        self._frames += 1
+        self._frame_sec += time.perf_counter() - ctx.started
+        inference = self.pipeline.inference
+        for name in ctx.results:
+            self._model_sec[name] = self._model_sec.get(name, 0.0) + inference.latency(name)
+            self._model_runs[name] = self._model_runs.get(name, 0) + 1
+
+        if now - self._start >= self.interval_sec:
+            self._end_window(now)
+
+    def _end_window(self, now):
+        wall = now - self._start
+        own = (time.process_time() - self._cpu_start) / max(self.cpu_share, 1)
+        child = self._child_cpu()
+        # a reopened pipeline (pause, stage change) starts its count at 0
+        child -= self._child_cpu_start if child >= self._child_cpu_start else 0.0
+        window = {
+            "frames": self._frames,
+            "fps": self._frames / wall,
+            "frame_ms": 1000.0 * self._frame_sec / self._frames,
+            "model_ms": {name: 1000.0 * sec / self._model_runs[name] for name, sec in self._model_sec.items()},
+            "cpu_pct": 100.0 * (own + child) / (wall * self.cpu_cores),
+        }
+        self._reset_window(now)
+        if self._settling:
+            self._settling = False
+            return
+        self.effect[self.level] = {**window, "ts": now}
+        if self.enabled and self.pending is None:
+            self._decide(now, window)
+
+    def _decide(self, now, window):
+        budget_ms = 1000.0 * self.budget
+        frame_ms, cpu = window["frame_ms"], window["cpu_pct"]
+
+        if frame_ms > budget_ms * self.down_ratio or cpu > self.max_cpu_pct:
+            self._calm = 0
+            down = self._next(range(self.level - 1, -1, -1))
+            if down is not None:
+                backoff = self._backoff.get(self.level, self.backoff_sec)
+                self._blocked_until[self.level] = now + backoff
+                self._backoff[self.level] = min(2 * backoff, self.max_backoff_sec)
+                self._switch(now, down, "over budget", window)
+        elif frame_ms < budget_ms * self.up_ratio and cpu < self.max_cpu_pct * self.up_ratio:
+            self._calm += 1
+            up = self._next(range(self.level + 1, len(self.levels)))
+            if self._calm >= self.up_windows and up is not None and now >= self._blocked_until.get(up, 0.0):
+                self._calm = 0
+                self._switch(now, up, "headroom", window)
+        else:
+            self._calm = 0
+
+    def _next(self, candidates):
+        return next((level for level in candidates if level not in self.unavailable), None)
+
+    def _switch(self, now, level, reason, window):
+        self.pending = level
+        self.switches.append({
+            "ts": now,
+            "from": self.level,
+            "to": level,
+            "reason": reason,
+            "frame_ms": window["frame_ms"],
+            "cpu_pct": window["cpu_pct"],
+        })
+
+    # ----------------- Switching (monitor loop) -----------------
+    async def apply(self):
+        """Apply a pending switch: reload Pose and/or resize the capture."""
+        if self.pending is None:
+            return False
+        pipeline = self.pipeline
+        old, previous = self.settings, self.level
+        self.level, self.pending = self.pending, None
+        new = self.settings
+
+        if new["pose_complexity"] != old["pose_complexity"] and "pose" in pipeline.analyzers:
+            try:
+                await self._set_pose_complexity(new["pose_complexity"])
+            except Exception as e:
+                # e.g. the model file for that complexity could not be fetched
+                print(f"autotune: cannot load pose complexity {new['pose_complexity']}: {e}")
+                self.unavailable.add(self.level)
+                self.level = previous
+                await self._set_pose_complexity(old["pose_complexity"])
+                self._reset_window(time.time())
+                return False
+        if (new["width"], new["height"]) != (old["width"], old["height"]):
+            pipeline.source.set_resolution(new["width"], new["height"])
+
+        self._settling = True
+        self._reset_window(time.time())
+        print(f"autotune: level {self.level} {new}")
+        return True
+
+    async def _set_pose_complexity(self, complexity):
+        # imported here so the server can use LEVELS without loading mediapipe
+        from src.posture_engine import PostureAnalyzer
+
+        await self.pipeline.set_analyzers([
+            PostureAnalyzer(model_complexity=complexity) if a.model == "pose" else a
+            for a in self.pipeline.analyzers.values()
+        ])
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "level": self.level,
+            "settings": self.settings,
+            "pending": self.pending,
+            "levels": [{"pose_complexity": c, "width": w, "height": h} for c, w, h in self.levels],
+            "target_frame_ms": 1000.0 * self.budget,
+            "max_cpu_pct": self.max_cpu_pct,
+            "cpu_cores": self.cpu_cores,
+            "effect": self.effect,
+            "blocked_until": dict(self._blocked_until),
+            "unavailable": sorted(self.unavailable),
+            "switches": list(self.switches),
+        }
@@ -1,9 +1,12 @@
+import math
 import cv2
 import mediapipe as mp
 import numpy as np
 import time
-from collections import deque
-from src.utils import wait_for_unpause
+from src.capture import FrameGrabber
+from src.pipeline import Pipeline, Preprocess
+from src.stats import EventRateWindow
+from src.utils import wait_for_unpause, landmarks_to_array, mirror_x
 
 mp_face_mesh = mp.solutions.face_mesh
 
@@ -11,68 +14,198 @@ mp_face_mesh = mp.solutions.face_mesh
 LEFT_EYE = [33, 160, 158, 133, 153, 144] 
 RIGHT_EYE = [362, 385, 387, 263, 373, 380]
 
+# EAR threshold & blink detection defaults
+EAR_THRESHOLD = 0.23          # Typical threshold
+EAR_CONSEC_FRAMES = 2         # How many frames to count as blink
+
+def create_face_mesh():
+    return mp_face_mesh.FaceMesh(
+        refine_landmarks=True,
+        max_num_faces=1,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+
+# Both eyes are converted to one (12, 3) array per frame, in this order.
+EYE_LANDMARKS = LEFT_EYE + RIGHT_EYE
+LEFT_EYE_ROWS = slice(0, 6)
+RIGHT_EYE_ROWS = slice(6, 12)
+
+# EYE_LANDMARKS as seen on the mirrored image, for landmarks from an
+# unflipped frame: each index replaced by its mirror point on the mesh.
+EYE_LANDMARKS_MIRRORED = [263, 387, 385, 362, 380, 373, 133, 158, 160, 33, 144, 153]
+
+# Pose landmarks on the head (nose, eyes, ears, mouth) used to place the
+# FaceMesh crop in ROI mode.
+POSE_HEAD = slice(mp.solutions.pose.PoseLandmark.NOSE.value, mp.solutions.pose.PoseLandmark.MOUTH_RIGHT.value + 1)
+
+def head_box(pose_landmarks, width, height, margin=2.0, min_visibility=0.5, step=32):
+    """
+    Square crop (x0, y0, x1, y1) in pixels around the Pose head landmarks,
+    `margin` times their span (ear to ear is about the face width), or None
+    when the head is not visible. The side is rounded up to `step` so the
+    crop shape, and the buffer it is copied into, rarely changes.
+    """
+    head = [lm for lm in pose_landmarks.landmark[POSE_HEAD] if lm.visibility >= min_visibility]
+    if len(head) < 3:
+        return None
+    xs = [lm.x * width for lm in head]
+    ys = [lm.y * height for lm in head]
+    span = max(max(xs) - min(xs), max(ys) - min(ys))
+    side = min(-(-int(span * margin) // step) * step, width, height)
+    if side <= 0:
+        return None
+
+    cx = (min(xs) + max(xs)) / 2.0
+    cy = (min(ys) + max(ys)) / 2.0
+    x0 = min(max(int(cx - side / 2), 0), width - side)
+    y0 = min(max(int(cy - side / 2), 0), height - side)
+    return x0, y0, x0 + side, y0 + side
+
 def euclidean(p1, p2):
     return np.linalg.norm(p1 - p2)
 
-def get_point(landmarks, idx, w, h):
-    lm = landmarks[idx]
-    return np.array([lm.x * w, lm.y * h], dtype=np.float32)
-
-def compute_EAR(landmarks, w, h, eye_indices):
-    pts = [get_point(landmarks, i, w, h) for i in eye_indices]
+def compute_EAR(eye):
+    """
+    `eye` holds the six landmarks p1..p6 of one eye as rows (a slice of the
+    per-frame eye array, see EYE_LANDMARKS); only x and y are used.
+    """
+    p1, p2, p3, p4, p5, p6 = eye[:, :2].tolist()
 
     # For 6 landmarks:
     # EAR = (||p2 - p6|| + ||p3 - p5||) / (2 * ||p1 - p4||)
-    v1 = euclidean(pts[1], pts[5])
-    v2 = euclidean(pts[2], pts[4])
-    h_len = euclidean(pts[0], pts[3])
+    v1 = math.dist(p2, p6)
+    v2 = math.dist(p3, p5)
+    h_len = math.dist(p1, p4)
 
     ear = (v1 + v2) / (2.0 * h_len + 1e-6)
     return float(ear)
 
-def eye_fatigue_detector():
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-    face_mesh = mp_face_mesh.FaceMesh(
-        refine_landmarks=True,
-        max_num_faces=1,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5
+class BlinkAnalyzer:
+    """
+    Pipeline stage for FaceMesh: eye landmarks -> EAR. Sets ctx.values
+    "face_detected" and "ear" (None when no face) on frames where FaceMesh ran.
+
+    With `roi`, FaceMesh runs on a crop around the head found by Pose
+    instead of the full frame. Pose runs in parallel with FaceMesh, so the
+    box comes from the latest Pose result (the previous frame's); at
+    webcam rates the head moves far less than the margin in between. The
+    box only moves once the head has drifted by a fraction of it, because
+    FaceMesh tracks the face in the coordinates of the image it last saw.
+    If nothing is found in the crop, FaceMesh searches the full frame again.
+    """
+
+    model = "face"
+
+    def __init__(self, factory=create_face_mesh, roi=False, margin=2.0):
+        self.factory = factory
+        self.roi = roi
+        self.margin = margin
+        self._pts = None  # reused (12, 3) eye landmark buffer
+        self._box = None  # head box for the next frame, from Pose
+        self._used = None  # box FaceMesh ran on this frame (None = full frame)
+        self._crop = None  # reused crop buffer
+        self._tracking = None  # "crop" / "full": where FaceMesh last found the face
+
+        # ---- COUNTERS ----
+        self.roi_runs = 0
+        self.fallbacks = 0
+
+    def model_input(self, ctx):
+        self._used = self._box
+        if self._used is None:
+            return None
+        x0, y0, x1, y1 = self._used
+        if x1 > ctx.width or y1 > ctx.height:
+            # capture resolution changed since the box was placed
+            self._used = self._box = None
+            return None
+        view = ctx.rgb[y0:y1, x0:x1]
+        if self._crop is None or self._crop.shape != view.shape:
+            self._crop = np.empty_like(view)
+        np.copyto(self._crop, view)
+        self.roi_runs += 1
+        return self._crop
+
+    def fallback(self, ctx):
+        if self._used is None or ctx.results[self.model].multi_face_landmarks:
+            return None
+        if self._tracking == "full":
+            # the miss came from the full-frame track applied to the crop;
+            # tracking is reset now, so run the face detector on the crop
+            self._tracking = None
+            return self._crop
+        self._used = self._box = None
+        self.fallbacks += 1
+        return ctx.rgb
+
+    def analyze(self, ctx):
+        results = ctx.results[self.model]
+        found = bool(results.multi_face_landmarks)
+        self._tracking = ("full" if self._used is None else "crop") if found else None
+        self._update_box(ctx)
+        if not found:
+            ctx.values.update(face_detected=False, ear=None)
+            return
+
+        face = results.multi_face_landmarks[0]
+        indices = EYE_LANDMARKS_MIRRORED if ctx.mirror_landmarks else EYE_LANDMARKS
+        if self._used is None:
+            self._pts = landmarks_to_array(face.landmark, ctx.width, ctx.height, self._pts, indices)
+        else:
+            # crop coordinates -> full frame
+            x0, y0, x1, y1 = self._used
+            self._pts = landmarks_to_array(face.landmark, x1 - x0, y1 - y0, self._pts, indices)
+            self._pts[:, 0] += x0
+            self._pts[:, 1] += y0
+        if ctx.mirror_landmarks:
+            mirror_x(self._pts, ctx.width)
+
+        # Compute EAR for both eyes
+        left_EAR = compute_EAR(self._pts[LEFT_EYE_ROWS])
+        right_EAR = compute_EAR(self._pts[RIGHT_EYE_ROWS])
+        ctx.values.update(face_detected=True, ear=(left_EAR + right_EAR) / 2.0)
+
+    def _update_box(self, ctx):
+        if not self.roi:
+            return
+        pose = ctx.results.get("pose")
+        if pose is None:
+            return  # Pose skipped this frame: keep the last box
+        box = None
+        if pose.pose_landmarks is not None:
+            box = head_box(pose.pose_landmarks, ctx.width, ctx.height, self.margin)
+        if box is not None and self._box is not None and _same_box(box, self._box):
+            return
+        self._box = box
+
+
+def _same_box(a, b, drift=0.125):
+    # same size, center moved less than `drift` of the side
+    side = a[2] - a[0]
+    return (
+        side == b[2] - b[0] and a[3] - a[1] == b[3] - b[1]
+        and abs(a[0] - b[0]) < side * drift and abs(a[1] - b[1]) < side * drift
     )
 
-    # EAR threshold & blink detection state
-    EAR_THRESHOLD = 0.23          # Typical threshold
-    EAR_CONSEC_FRAMES = 2         # How many frames to count as blink
-    frame_counter = 0
-    blink_count = 0
-
-    # Rolling history of blink timestamps (60 seconds)
-    blink_times = deque()
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+def eye_fatigue_detector():
+    # Blink detection state
+    frame_counter = 0
 
-        frame = cv2.flip(frame, 1)
-        h, w, _ = frame.shape
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    # Rolling blink count over the last 60 seconds
+    blink_times = EventRateWindow(60, start_time=time.time())
 
-        results = face_mesh.process(rgb)
+    def show(ctx):
+        nonlocal frame_counter
+        frame = ctx.frame
+        h = ctx.height
 
         blink_rate = 0
         display_text = "Face not detected"
 
-        if results.multi_face_landmarks:
-            face = results.multi_face_landmarks[0]
-            lm = face.landmark
-
-            # Compute EAR for both eyes
-            left_EAR = compute_EAR(lm, w, h, LEFT_EYE)
-            right_EAR = compute_EAR(lm, w, h, RIGHT_EYE)
-            EAR = (left_EAR + right_EAR) / 2.0
+        if ctx.values["face_detected"]:
+            EAR = ctx.values["ear"]
 
             # Blink detection
             if EAR < EAR_THRESHOLD:
@@ -80,17 +213,11 @@ def eye_fatigue_detector():
             else:
                 if frame_counter >= EAR_CONSEC_FRAMES:
                     # Genuine blink
-                    t = time.time()
-                    blink_times.append(t)
+                    blink_times.add(time.time())
                 frame_counter = 0
 
-            # Remove timestamps older than 60 seconds
-            now = time.time()
-            while blink_times and now - blink_times[0] > 60:
-                blink_times.popleft()
-
             # Compute blinks per minute
-            blink_rate = len(blink_times)
+            blink_rate = blink_times.count(time.time())
 
             display_text = f"EAR: {EAR:.3f}  Blinks/min: {blink_rate}"
 
@@ -118,10 +245,17 @@ def eye_fatigue_detector():
         )
 
         cv2.imshow("Eye Fatigue Monitor", frame)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
+        return cv2.waitKey(1) & 0xFF != ord("q")
+
+    # this window draws on the frame, so flip the pixels themselves
+    pipeline = Pipeline(
+        [BlinkAnalyzer()],
+        source=FrameGrabber(0, width=640, height=480),
+        preprocess=Preprocess(flip_pixels=True),
+    )
+    with pipeline:
+        pipeline.run(show)
 
-    cap.release()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
@@ -131,72 +265,37 @@ if __name__ == "__main__":
 # USED FOR WEBSOCKET
 # ---------------------------
 async def run_blink_monitor(recording_flag, blink_manager):
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-    face_mesh = mp_face_mesh.FaceMesh(
-        refine_landmarks=True,
-        max_num_faces=1,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5
-    )
+    pipeline = Pipeline([BlinkAnalyzer()], source=FrameGrabber(0, width=640, height=480))
+    await pipeline.open_async()
 
-    # EAR threshold & blink detection state
-    EAR_THRESHOLD = 0.23          # Typical threshold
-    EAR_CONSEC_FRAMES = 2         # How many frames to count as blink
+    # Blink detection state
     frame_counter = 0
-    blink_count = 0
 
-    # Rolling history of blink timestamps (60 seconds)
-    blink_times = deque()
+    # Rolling blink count over the last 60 seconds
+    blink_times = EventRateWindow(60, start_time=time.time())
 
     while True:
         await wait_for_unpause(recording_flag)
 
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame = cv2.flip(frame, 1)
-        h, w, _ = frame.shape
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        results = face_mesh.process(rgb)
-
-        blink_rate = 0
-        display_text = "Face not detected"
+        ctx = await pipeline.step()
+        if ctx is None or not ctx.values["face_detected"]:
+            continue
 
-        if results.multi_face_landmarks:
-            face = results.multi_face_landmarks[0]
-            lm = face.landmark
+        EAR = ctx.values["ear"]
 
-            # Compute EAR for both eyes
-            left_EAR = compute_EAR(lm, w, h, LEFT_EYE)
-            right_EAR = compute_EAR(lm, w, h, RIGHT_EYE)
-            EAR = (left_EAR + right_EAR) / 2.0
-
-            # Blink detection
-            if EAR < EAR_THRESHOLD:
-                frame_counter += 1
-            else:
-                if frame_counter >= EAR_CONSEC_FRAMES:
-                    # Genuine blink
-                    t = time.time()
-                    blink_times.append(t)
-                frame_counter = 0
-
-            # Remove timestamps older than 60 seconds
-            now = time.time()
-            while blink_times and now - blink_times[0] > 60:
-                blink_times.popleft()
-
-            # Compute blinks per minute
-            blink_rate = len(blink_times)
-            is_bad_now = blink_rate > 10
+        # Blink detection
+        if EAR < EAR_THRESHOLD:
+            frame_counter += 1
+        else:
+            if frame_counter >= EAR_CONSEC_FRAMES:
+                # Genuine blink
+                blink_times.add(time.time())
+            frame_counter = 0
 
-            # send to socket connections
-            current_blink = "bad" if is_bad_now else "good"
-            await blink_manager.broadcast({"blink": blink_rate})
+        # Compute blinks per minute
+        blink_rate = blink_times.count(time.time())
+        is_bad_now = blink_rate > 10
 
-    cap.release()
\ No newline at end of file
+        # send to socket connections
+        current_blink = "bad" if is_bad_now else "good"
+        await blink_manager.broadcast({"blink": blink_rate})
@@ -0,0 +1,284 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+
+# Edge events every client gets unless it subscribes to something else.
+# Raw per-frame "metrics" are opt-in because they are sent at frame rate.
+EVENT_TYPES = ("posture_warning", "posture_resolved", "blink_warning", "blink_resolved")
+METRICS_TYPE = "metrics"
+# The same per-frame values as compact binary batches (see metrics_stream).
+METRICS_STREAM_TYPE = "metrics_stream"
+DEFAULT_SUBSCRIPTIONS = frozenset(EVENT_TYPES)
+ALL_TYPES = "*"
+# Sent as binary frames, only to clients that name them ("*" is every JSON
+# type) and never coalesced: a stream batch depends on the ones before it.
+BINARY_TYPES = frozenset({METRICS_STREAM_TYPE})
+
+
+def covers(types, msg_type):
+    """Whether the subscription set `types` includes `msg_type`."""
+    return msg_type in types or (ALL_TYPES in types and msg_type not in BINARY_TYPES)
+
+
+class ClientChannel:
+    """
+    Outbound queue for one WebSocket client. The queue is bounded: with
+    DROP_OLDEST the oldest pending message is discarded when it is full;
+    with COALESCE a new message replaces a pending one of the same "type"
+    (only the latest state matters) and is queued at the tail, falling back
+    to drop-oldest.
+    All methods run on the server loop.
+    """
+
+    def __init__(self, client_id, websocket, maxsize=64, policy=DROP_OLDEST):
+        self.id = client_id
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.subscriptions = set()   # managed by BroadcastHub._set_subscriptions
+        self.queue = deque()   # (published_at, type, text or bytes)
+        self.ready = asyncio.Event()
+        self.connected_at = time.time()
+
+        # ---- COUNTERS ----
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_lag = 0.0    # publish -> send completed, seconds
+        self.max_lag = 0.0
+
+    def wants(self, msg_type):
+        return covers(self.subscriptions, msg_type)
+
+    def offer(self, published_at, msg_type, text):
+        if self.policy == COALESCE and msg_type is not None and msg_type not in BINARY_TYPES:
+            # the pending one goes and the new one joins the tail, so a
+            # lagging client still sees the types in the order they happened
+            for i, (_, queued_type, _) in enumerate(self.queue):
+                if queued_type == msg_type:
+                    del self.queue[i]
+                    self.coalesced += 1
+                    break
+
+        if len(self.queue) >= self.maxsize:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append((published_at, msg_type, text))
+        self.ready.set()
+
+    def lag(self):
+        """Age of the oldest message still waiting to be sent, seconds."""
+        if not self.queue:
+            return 0.0
+        return time.monotonic() - self.queue[0][0]
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "subscriptions": sorted(self.subscriptions),
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "lag_ms": self.lag() * 1000.0,
+            "last_send_lag_ms": self.last_lag * 1000.0,
+            "max_send_lag_ms": self.max_lag * 1000.0,
+        }
+
+
+class BroadcastHub:
+    """
+    Fan-out of monitor events to every connected WebSocket client.
+
+    publish() may be called from any thread and never blocks: the message
+    is handed to the server loop with call_soon_threadsafe, serialized once
+    and queued for the clients subscribed to its "type". serve() runs one
+    connection: it waits on the client's outbound queue and on incoming
+    client messages at the same time, so a slow client only backs up (and
+    eventually drops from) its own queue and disconnects are seen at once.
+    """
+
+    def __init__(self, maxsize=64, policy=DROP_OLDEST):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.loop = None
+        self.channels = {}
+        self._ids = itertools.count(1)
+        self._subscribers = {}   # type -> number of subscribed clients
+        self._listeners = []
+
+        # ---- COUNTERS ----
+        self.published = 0
+        self.unbound_drops = 0   # published before the server loop was bound
+        self.dropped_closed = 0  # drops of clients that have disconnected since
+        self.metrics = None      # optional PipelineMetrics for send latency
+
+    def bind(self, loop=None):
+        """Attach the hub to the server's event loop (call from startup)."""
+        self.loop = loop or asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+
+    # ----------------- Producer side (any thread) -----------------
+    def publish(self, message):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            self.unbound_drops += 1
+            return
+        published_at = time.monotonic()
+        if threading.get_ident() == self._loop_thread:
+            self._fanout(message, published_at)
+        else:
+            loop.call_soon_threadsafe(self._fanout, message, published_at)
+
+    def publish_binary(self, msg_type, data):
+        """publish() of an already encoded message, sent as a binary frame."""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            self.unbound_drops += 1
+            return
+        published_at = time.monotonic()
+        if threading.get_ident() == self._loop_thread:
+            self._fanout_binary(msg_type, data, published_at)
+        else:
+            loop.call_soon_threadsafe(self._fanout_binary, msg_type, data, published_at)
+
+    async def broadcast(self, message):
+        # awaitable alias kept for the older monitor loops
+        self.publish(message)
+
+    def has_subscribers(self, msg_type):
+        """Cheap check so producers can skip building messages nobody wants."""
+        if self._subscribers.get(msg_type):
+            return True
+        return msg_type not in BINARY_TYPES and bool(self._subscribers.get(ALL_TYPES))
+
+    def subscribed_types(self):
+        """Types (or ALL_TYPES) at least one client is subscribed to."""
+        return frozenset(t for t, n in self._subscribers.items() if n)
+
+    def add_listener(self, callback):
+        """Call `callback(hub)` on the server loop whenever subscribed_types() changes."""
+        self._listeners.append(callback)
+
+    # ----------------- Server loop side -----------------
+    def _fanout(self, message, published_at):
+        self.published += 1
+        msg_type = message.get("type") if isinstance(message, dict) else None
+        text = None
+        for channel in self.channels.values():
+            if not channel.wants(msg_type):
+                continue
+            if text is None:
+                text = json.dumps(message)   # serialized once, only if someone wants it
+            channel.offer(published_at, msg_type, text)
+
+    def _fanout_binary(self, msg_type, data, published_at):
+        self.published += 1
+        for channel in self.channels.values():
+            if channel.wants(msg_type):
+                channel.offer(published_at, msg_type, data)   # the same bytes for everyone
+
+    def _set_subscriptions(self, channel, types):
+        before = self.subscribed_types() if self._listeners else None
+        for t in channel.subscriptions:
+            self._subscribers[t] -= 1
+        channel.subscriptions = set(types)
+        for t in channel.subscriptions:
+            self._subscribers[t] = self._subscribers.get(t, 0) + 1
+        if before is not None and self.subscribed_types() != before:
+            for callback in self._listeners:
+                callback(self)
+
+    async def serve(self, websocket):
+        """Run one client connection until it disconnects."""
+        await websocket.accept()
+        channel = ClientChannel(next(self._ids), websocket, self.maxsize, self.policy)
+        self.channels[websocket] = channel
+        self._set_subscriptions(channel, DEFAULT_SUBSCRIPTIONS)
+
+        sender = asyncio.create_task(self._sender(channel))
+        receiver = asyncio.create_task(self._receiver(channel))
+        try:
+            # whichever side ends first (client closed, send failed) ends both
+            await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (sender, receiver):
+                task.cancel()
+            await asyncio.gather(sender, receiver, return_exceptions=True)
+            self.disconnect(websocket)
+
+    def disconnect(self, websocket):
+        channel = self.channels.pop(websocket, None)
+        if channel is not None:
+            self.dropped_closed += channel.dropped
+            self._set_subscriptions(channel, ())
+
+    async def _sender(self, channel):
+        while True:
+            await channel.ready.wait()
+            while channel.queue:
+                published_at, _, text = channel.queue.popleft()
+                if isinstance(text, bytes):
+                    await channel.websocket.send_bytes(text)
+                else:
+                    await channel.websocket.send_text(text)
+                channel.sent += 1
+                channel.last_lag = time.monotonic() - published_at
+                channel.max_lag = max(channel.max_lag, channel.last_lag)
+                if self.metrics is not None:
+                    self.metrics.observe("broadcast.send", channel.last_lag)
+            channel.ready.clear()
+
+    async def _receiver(self, channel):
+        """
+        Handle client control messages:
+            {"action": "subscribe", "types": ["posture_warning", "metrics"]}
+            {"action": "unsubscribe", "types": ["metrics"]}
+        Use "*" to receive every JSON type; binary ones (BINARY_TYPES, e.g.
+        "metrics_stream") must be named. Returns when the client disconnects.
+        """
+        websocket = channel.websocket
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            try:
+                request = json.loads(message.get("text") or message.get("bytes") or "")
+                action = request.get("action")
+                types = request.get("types") or []
+            except (ValueError, AttributeError):
+                channel.offer(time.monotonic(), "error", json.dumps({"type": "error", "detail": "invalid message"}))
+                continue
+            # a bare string would otherwise be split into its characters
+            if not isinstance(types, list) or not all(isinstance(t, str) for t in types):
+                channel.offer(time.monotonic(), "error", json.dumps({"type": "error", "detail": "types must be a list of strings"}))
+                continue
+            types = set(types)
+
+            if action == "subscribe":
+                self._set_subscriptions(channel, channel.subscriptions | types)
+            elif action == "unsubscribe":
+                self._set_subscriptions(channel, channel.subscriptions - types)
+            elif action == "set":
+                self._set_subscriptions(channel, types)
+            else:
+                channel.offer(time.monotonic(), "error", json.dumps({"type": "error", "detail": f"unknown action: {action}"}))
+                continue
+
+            channel.offer(time.monotonic(), "subscribed", json.dumps({
+                "type": "subscribed",
+                "types": sorted(channel.subscriptions),
+            }))
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "unbound_drops": self.unbound_drops,
+            "clients": [channel.stats() for channel in self.channels.values()],
+        }
@@ -0,0 +1,322 @@
+import asyncio
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+class FrameGrabber:
+    """
+    Owns a cv2.VideoCapture on a background thread and keeps only the newest
+    frame. Frames are written into a small ring of preallocated buffers; a
+    frame that gets overwritten before anyone read it is counted as dropped
+    instead of being queued, so the consumer never falls behind the camera.
+    """
+
+    def __init__(self, src=0, width=640, height=480, num_buffers=3, metrics=None):
+        # one slot being written, one published, one held by the reader
+        if num_buffers < 3:
+            raise ValueError("FrameGrabber needs at least 3 buffers")
+
+        self.src = src
+        self.width = width
+        self.height = height
+        self.num_buffers = num_buffers
+        self.fps = 30
+
+        self.cap = None
+        self._slots = [None] * num_buffers
+        self._latest = -1      # slot holding the newest published frame
+        self._reading = -1     # slot currently handed out to the consumer
+        self._seq = 0          # sequence number of the newest frame
+        self._read_seq = 0     # sequence number of the last frame consumed
+
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._resize = None    # (width, height) requested while running
+        self.finished = False  # the source ran out of frames (files only)
+        self.metrics = metrics  # optional PipelineMetrics ("capture" stage)
+
+        # ---- COUNTERS ----
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.read_failures = 0
+
+    # ----------------- Lifecycle -----------------
+    def start(self):
+        if self._thread is not None:
+            return self
+
+        w, h = self._open()
+        # preallocate the ring at the resolution the source actually gave us
+        if w > 0 and h > 0:
+            self._slots = [np.empty((h, w, 3), dtype=np.uint8) for _ in range(self.num_buffers)]
+
+        # frames from before a restart are never handed out
+        with self._cond:
+            self._latest = -1
+            self._reading = -1
+            self._read_seq = self._seq
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def set_resolution(self, width, height):
+        """
+        Change the capture resolution. While running, the capture thread
+        applies it between two reads, so the camera is not reopened; the
+        ring slots follow the new frame size on their own.
+        """
+        if self._thread is None:
+            self.width, self.height = width, height
+        else:
+            self._resize = (width, height)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ----------------- Producer -----------------
+    def _open(self):
+        """Open the camera; returns the frame size it actually delivers."""
+        self.cap = cv2.VideoCapture(self.src)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH,  self.width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        if fps <= 0 or fps > 120:
+            fps = 30
+        self.fps = fps
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def _grab(self, buf):
+        # (ok, frame); frame is `buf` unless OpenCV had to allocate
+        return self.cap.read(buf)
+
+    def _free_slot(self):
+        for i in range(self.num_buffers):
+            if i != self._latest and i != self._reading:
+                return i
+        raise RuntimeError("no free frame buffer")  # unreachable with >= 3 slots
+
+    def _apply_resize(self):
+        width, height = self._resize
+        self._resize = None
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        # what the camera actually gave us
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or width
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or height
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._resize is not None:
+                self._apply_resize()
+
+            with self._cond:
+                slot = self._free_slot()
+
+            buf = self._slots[slot]
+            t0 = time.perf_counter()
+            ret, frame = self._grab(buf)
+            if self.metrics is not None:
+                self.metrics.observe("capture", time.perf_counter() - t0)
+            if self.finished or self._stop.is_set():
+                break
+            if not ret:
+                self.read_failures += 1
+                time.sleep(0.01)
+                continue
+
+            # Unknown size up front (or a resolution change): keep the array
+            # OpenCV allocated as this slot's buffer from now on.
+            if frame is not buf:
+                self._slots[slot] = frame
+
+            with self._cond:
+                if self._seq > self._read_seq:
+                    # previous frame was never consumed -> latest frame wins
+                    self.frames_dropped += 1
+                self._latest = slot
+                self._seq += 1
+                self.frames_captured += 1
+                self._cond.notify_all()
+
+    # ----------------- Consumer -----------------
+    def read(self, timeout=None):
+        """
+        Block until a frame newer than the last one returned is available.
+        Returns (seq, frame), or (None, None) on timeout/stop. The frame is a
+        view into the ring and stays valid until the next call to read().
+        """
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._seq > self._read_seq or self._stop.is_set(),
+                timeout,
+            )
+            if not ready or self._stop.is_set():
+                return None, None
+
+            self._reading = self._latest
+            self._read_seq = self._seq
+            self._cond.notify_all()   # a paced-by-consumer producer waits for this
+            return self._seq, self._slots[self._reading]
+
+    async def read_async(self, timeout=1.0):
+        # wait for the next frame without blocking the event loop
+        return await asyncio.to_thread(self.read, timeout)
+
+    def stats(self):
+        return {
+            "source": str(self.src),
+            "frames_captured": self.frames_captured,
+            "frames_dropped": self.frames_dropped,
+            "read_failures": self.read_failures,
+            "fps": self.fps,
+            "resolution": [self.width, self.height],
+        }
+
+
+class ReplaySource(FrameGrabber):
+    """
+    Camera stand-in with FrameGrabber's interface, for load tests and
+    deterministic replays without a webcam.
+
+    Frames come from `path` (a video file or a directory of images) or,
+    with no path, from a fixed set of seeded synthetic frames. With
+    `realtime` the frames are paced at `fps` and a slow consumer drops
+    frames exactly as with a camera; otherwise every frame is handed out
+    once, as fast as the consumer takes them, so two runs see the same
+    frame sequence. `loop` starts over at the end; without it the source
+    reports `finished` and read() times out from then on.
+    """
+
+    def __init__(self, path=None, fps=30.0, realtime=True, loop=True, width=640, height=480,
+                 seed=0, synthetic_frames=8, num_buffers=3, metrics=None):
+        super().__init__(path or "synthetic", width, height, num_buffers, metrics)
+        self.path = path
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+        self.seed = seed
+        self.synthetic_frames = synthetic_frames
+
+        self._images = None     # image paths, for a directory
+        self._frames = None     # synthetic frames
+        self._index = 0
+        self._next_at = None
+
+    def _open(self):
+        self.finished = False
+        self._index = 0
+        self._next_at = None
+        if self.path is None:
+            rng = np.random.default_rng(self.seed)
+            self._frames = [
+                rng.integers(0, 256, (self.height, self.width, 3), dtype=np.uint8)
+                for _ in range(self.synthetic_frames)
+            ]
+        elif os.path.isdir(self.path):
+            self._images = sorted(
+                os.path.join(self.path, name)
+                for name in os.listdir(self.path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            if not self._images:
+                raise ValueError(f"no images in {self.path}")
+        else:
+            self.cap = cv2.VideoCapture(self.path)
+            if not self.cap.isOpened():
+                raise ValueError(f"cannot open {self.path}")
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            if 0 < fps <= 120:
+                self.fps = fps
+        return self.width, self.height
+
+    def _apply_resize(self):
+        self.width, self.height = self._resize
+        self._resize = None
+        if self._frames is not None:
+            self._open()
+
+    def _next_frame(self):
+        if self._frames is not None:
+            frame = self._frames[self._index % len(self._frames)]
+            self._index += 1
+            return frame
+        if self._images is not None:
+            if self._index >= len(self._images):
+                if not self.loop:
+                    return None
+                self._index = 0
+            frame = cv2.imread(self._images[self._index])
+            self._index += 1
+            return frame
+        ok, frame = self.cap.read()
+        if not ok and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read()
+        return frame if ok else None
+
+    def _wait_turn(self):
+        if self.realtime:
+            now = time.perf_counter()
+            if self._next_at is None or now - self._next_at > 1.0 / self.fps:
+                self._next_at = now   # first frame, or fell behind: no burst to catch up
+            elif self._next_at > now:
+                self._stop.wait(self._next_at - now)
+            self._next_at += 1.0 / self.fps
+        else:
+            # lockstep: the next frame only once the consumer took the last one
+            with self._cond:
+                self._cond.wait_for(lambda: self._read_seq >= self._seq or self._stop.is_set())
+
+    def _grab(self, buf):
+        self._wait_turn()
+        if self._stop.is_set():
+            return False, None
+        frame = self._next_frame()
+        if frame is None:
+            self.finished = True
+            return False, None
+        if frame.shape[:2] != (self.height, self.width):
+            frame = cv2.resize(frame, (self.width, self.height))
+        if buf is None or buf.shape != frame.shape:
+            return True, frame.copy()
+        np.copyto(buf, frame)
+        return True, buf
+
+
+def open_source(spec=None, width=640, height=480, realtime=True):
+    """
+    Frame source from a spec string: None, "camera" or "camera:N" for a
+    webcam, "synthetic" for ReplaySource's generated frames, anything else
+    is a video file or image directory replayed by ReplaySource.
+    """
+    if spec is None or spec == "camera":
+        return FrameGrabber(0, width=width, height=height)
+    if spec.startswith("camera:"):
+        return FrameGrabber(int(spec.split(":", 1)[1]), width=width, height=height)
+    if spec == "synthetic":
+        return ReplaySource(None, width=width, height=height, realtime=realtime)
+    return ReplaySource(spec, width=width, height=height, realtime=realtime)
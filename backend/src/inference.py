@@ -0,0 +1,385 @@
+import asyncio
+import multiprocessing
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.shared_frames import SharedFrameReader, SharedFrameRing
+
+
+class InferenceWorker:
+    """
+    A single MediaPipe graph pinned to its own thread. Graphs are not
+    thread-safe, so each model gets one persistent instance and one thread
+    that builds it, runs it and closes it.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.model = None
+        self.last_latency = 0.0  # seconds spent in the last process() call
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"infer-{name}")
+        # Build the graph on the thread that will run it. Not waited on here,
+        # so several workers can load their models at the same time; frames
+        # submitted meanwhile simply queue behind the build.
+        self.ready = self._executor.submit(self._build, factory)
+
+    def _build(self, factory):
+        self.model = factory()
+
+    def _process(self, rgb):
+        t0 = time.perf_counter()
+        result = self.model.process(rgb)
+        self.last_latency = time.perf_counter() - t0
+        return result
+
+    def submit(self, rgb):
+        return self._executor.submit(self._process, rgb)
+
+    def close(self):
+        self.ready.exception()  # let a pending build finish first
+        if self.model is not None:
+            self._executor.submit(self.model.close).result()
+            self.model = None
+        self._executor.shutdown(wait=True)
+
+
+class ParallelInference:
+    """
+    Sends the same RGB frame to every model at once and joins the results,
+    so per-frame latency is the slowest model rather than the sum of them.
+    MediaPipe releases the GIL inside process(), so the workers really do
+    run side by side on multi-core machines.
+    """
+
+    def __init__(self, factories):
+        self.workers = {name: InferenceWorker(name, factory) for name, factory in factories.items()}
+        # all graphs load concurrently; wait until every one is usable
+        for worker in self.workers.values():
+            worker.ready.result()
+
+    def add(self, name, factory):
+        """Load one more model next to the running ones (blocks until ready)."""
+        if name in self.workers:
+            return
+        worker = InferenceWorker(name, factory)
+        worker.ready.result()
+        self.workers = {**self.workers, name: worker}
+
+    def remove(self, name):
+        worker = self.workers.get(name)
+        if worker is None:
+            return
+        # swap the dict first so a concurrent submit() never sees a closed worker
+        self.workers = {n: w for n, w in self.workers.items() if n != name}
+        worker.close()
+
+    def submit(self, rgb, only=None, inputs=None):
+        # The caller must not modify `rgb` until every future has completed.
+        # `only` restricts the frame to a subset of the models; `inputs`
+        # gives some models their own image (e.g. a crop) instead of `rgb`.
+        return {
+            name: worker.submit(rgb if inputs is None else inputs.get(name, rgb))
+            for name, worker in self.workers.items()
+            if only is None or name in only
+        }
+
+    def process(self, rgb, only=None, inputs=None):
+        futures = self.submit(rgb, only, inputs)
+        return {name: fut.result() for name, fut in futures.items()}
+
+    async def process_async(self, rgb, only=None, inputs=None):
+        futures = self.submit(rgb, only, inputs)
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures.values()))
+        return dict(zip(futures.keys(), results))
+
+    def latency(self, name):
+        return self.workers[name].last_latency
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+        self.workers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------------------------
+# PROCESS-BASED INFERENCE
+# ---------------------------
+# MediaPipe result fields shipped back from model processes. Each landmark
+# list becomes an (N, 4) float32 array of x, y, z, visibility.
+LANDMARK_FIELDS = ("pose_landmarks", "multi_face_landmarks")
+
+Landmark = namedtuple("Landmark", "x y z visibility")
+
+
+class LandmarkArray:
+    """
+    Array-backed stand-in for a MediaPipe NormalizedLandmarkList:
+    `.landmark[i].x`, slicing, iteration and len() work as on the protobuf,
+    and utils.landmarks_to_array reads `.array` directly.
+    """
+
+    __slots__ = ("array",)
+
+    def __init__(self, array):
+        self.array = array
+
+    @property
+    def landmark(self):
+        return self
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Landmark(*row) for row in self.array[index].tolist()]
+        return Landmark(*self.array[index].tolist())
+
+    def __iter__(self):
+        return (Landmark(*row) for row in self.array.tolist())
+
+
+def _landmark_array(landmarks):
+    points = landmarks.landmark
+    flat = chain.from_iterable((p.x, p.y, p.z, p.visibility) for p in points)
+    return np.fromiter(flat, dtype=np.float32, count=4 * len(points)).reshape(-1, 4)
+
+
+def pack_results(results):
+    """MediaPipe results -> {field: array, [arrays] or None} (small, picklable)."""
+    packed = {}
+    for field in LANDMARK_FIELDS:
+        if not hasattr(results, field):
+            continue
+        value = getattr(results, field)
+        if value is None:
+            packed[field] = None
+        elif isinstance(value, list):
+            packed[field] = [_landmark_array(v) for v in value]
+        else:
+            packed[field] = _landmark_array(value)
+    return packed
+
+
+def unpack_results(packed):
+    """pack_results() output -> object shaped like the MediaPipe results."""
+    fields = {}
+    for field, value in packed.items():
+        if value is None:
+            fields[field] = None
+        elif isinstance(value, list):
+            fields[field] = [LandmarkArray(v) for v in value]
+        else:
+            fields[field] = LandmarkArray(value)
+    return SimpleNamespace(**fields)
+
+
+def _model_process(factory, conn):
+    """Body of a model process: build the graph, then serve (ring, slot, seq) requests."""
+    try:
+        model = factory()
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", None))
+
+    reader = None
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break   # the parent went away
+            if request is None:
+                break
+            ring_name, slot_bytes, slot, seq = request
+            if reader is None or reader.name != ring_name:
+                if reader is not None:
+                    reader.close()
+                reader = SharedFrameReader(ring_name, slot_bytes)
+
+            current, image = reader.frame(slot)
+            if current != seq:
+                conn.send(("stale", 0.0, None, time.process_time()))
+                continue
+            t0 = time.perf_counter()
+            results = model.process(image)
+            latency = time.perf_counter() - t0
+            del image
+            # re-check: the writer must not have reused the slot meanwhile
+            status = "ok" if reader.seq(slot) == seq else "stale"
+            conn.send((status, latency, pack_results(results), time.process_time()))
+    finally:
+        model.close()
+        if reader is not None:
+            reader.close()
+
+
+class ProcessWorker:
+    """
+    A MediaPipe graph in its own process, so its Python glue never competes
+    for the GIL with the monitor loop. Frames are read from a
+    SharedFrameRing in place (only slot index and sequence number are sent)
+    and landmarks come back as small arrays. A thread per worker waits on
+    the pipe, so submit() returns a Future like InferenceWorker.submit().
+    """
+
+    def __init__(self, name, factory, mp_context=None):
+        self.name = name
+        self.last_latency = 0.0
+        self.cpu_sec = 0.0   # CPU time of the model process, as of its last reply
+        self.stale = 0       # frames replaced while the model read them
+        ctx = mp_context or multiprocessing.get_context("spawn")
+        self._conn, child = ctx.Pipe()
+        # daemonic processes cannot have children, so a model process is
+        # only daemonic where allowed; either way it exits with its parent
+        # because the pipe closes
+        self.process = ctx.Process(
+            target=_model_process, args=(factory, child),
+            name=f"infer-{name}", daemon=not multiprocessing.current_process().daemon,
+        )
+        self.process.start()
+        child.close()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"infer-{name}")
+        self.ready = self._executor.submit(self._wait_ready)
+
+    def _wait_ready(self):
+        status, detail = self._conn.recv()
+        if status != "ready":
+            raise RuntimeError(f"{self.name} model failed to load: {detail}")
+
+    def _process(self, ring, slot, seq):
+        self._conn.send((ring.name, ring.slot_bytes, slot, seq))
+        status, latency, packed, self.cpu_sec = self._conn.recv()
+        self.last_latency = latency
+        if status != "ok":
+            self.stale += 1
+            raise RuntimeError(f"{self.name}: frame {seq} was replaced while it was processed")
+        return unpack_results(packed)
+
+    def submit(self, ring, slot, seq):
+        return self._executor.submit(self._process, ring, slot, seq)
+
+    def close(self):
+        self.ready.exception()
+        if self.process.is_alive():
+            self._executor.submit(self._conn.send, None).result()
+        self._executor.shutdown(wait=True)
+        self.process.join(timeout=5.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._conn.close()
+
+
+class ProcessInference:
+    """
+    ParallelInference with one process per model. Frames travel through a
+    SharedFrameRing: acquire() gives the pipeline a slot to write the RGB
+    frame into (Preprocess converts straight into it), submit() only sends
+    its index and sequence number. Images that are not ring slots (crops,
+    frames pushed by callers) are copied into a free slot first.
+
+    A slot stays reserved while any model reads it. The ring grows (is
+    replaced) when a larger frame arrives, e.g. after a resolution switch.
+    """
+
+    def __init__(self, factories, slots=4):
+        self.slots = slots
+        self.ring = None
+        self.cpu_sec = 0.0   # of model processes removed since
+        self._mp = multiprocessing.get_context("spawn")
+        self.workers = {name: ProcessWorker(name, factory, self._mp) for name, factory in factories.items()}
+        for worker in self.workers.values():
+            worker.ready.result()
+
+    def add(self, name, factory):
+        if name in self.workers:
+            return
+        worker = ProcessWorker(name, factory, self._mp)
+        worker.ready.result()
+        self.workers = {**self.workers, name: worker}
+
+    def remove(self, name):
+        worker = self.workers.get(name)
+        if worker is None:
+            return
+        self.workers = {n: w for n, w in self.workers.items() if n != name}
+        self.cpu_sec += worker.cpu_sec
+        worker.close()
+
+    def acquire(self, shape):
+        """A shared buffer of `shape` for the next frame (valid until the next acquire)."""
+        if self.ring is None or not self.ring.fits(shape):
+            if self.ring is not None:
+                self.ring.close()   # called between frames: no slot is in use
+            self.ring = SharedFrameRing(shape, self.slots)
+        return self.ring.acquire(shape)[2]
+
+    def _slot(self, image, copied):
+        found = self.ring.locate(image) if self.ring is not None else None
+        if found is not None:
+            return found
+        found = copied.get(id(image))
+        if found is None:
+            ring = self.ring
+            if ring is None or not ring.fits(image.shape):
+                self.acquire(image.shape)
+                ring = self.ring
+            slot, seq, view = ring.acquire(image.shape)
+            np.copyto(view, image)
+            found = copied[id(image)] = (slot, seq)
+        return found
+
+    def submit(self, rgb, only=None, inputs=None):
+        futures, copied = {}, {}
+        for name, worker in self.workers.items():
+            if only is not None and name not in only:
+                continue
+            slot, seq = self._slot(rgb if inputs is None else inputs.get(name, rgb), copied)
+            ring = self.ring
+            ring.hold(slot)
+            future = worker.submit(ring, slot, seq)
+            future.add_done_callback(lambda _, ring=ring, slot=slot: ring.release(slot))
+            futures[name] = future
+        return futures
+
+    def process(self, rgb, only=None, inputs=None):
+        futures = self.submit(rgb, only, inputs)
+        return {name: fut.result() for name, fut in futures.items()}
+
+    async def process_async(self, rgb, only=None, inputs=None):
+        futures = self.submit(rgb, only, inputs)
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures.values()))
+        return dict(zip(futures.keys(), results))
+
+    def latency(self, name):
+        return self.workers[name].last_latency
+
+    def cpu_time(self):
+        """CPU seconds used by the model processes (not counted in ours)."""
+        return self.cpu_sec + sum(w.cpu_sec for w in self.workers.values())
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+        self.workers = {}
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,196 @@
+import bisect
+import time
+
+# Histogram bucket upper bounds, seconds (Prometheus convention).
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+PREFIX = "axial"
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram. observe() is a bisect and three
+    increments; every stage has one writer thread, so there is no lock
+    (a scrape may see one observation half-applied).
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class PipelineMetrics:
+    """
+    Per-stage timings of the live loop plus the counters around it,
+    rendered in the Prometheus text format by render().
+
+    Stages (label `stage`):
+      read_wait      waiting for the next frame from the grabber
+      capture        cap.read() on the grabber thread
+      preprocess     mirror/flip + BGR->RGB
+      inference      all due models, in parallel (wall time)
+      model.<name>   one model's process() call
+      analyze.<name> landmarks -> metrics/score, EAR
+      sink.<name>    tracker/events/store/broadcast, autotune
+      frame          preprocess -> last sink
+      broadcast.send publish -> sent to a client (server loop)
+
+    The pipeline, grabber and hub only call observe() when they hold a
+    PipelineMetrics; with none attached, nothing is timed at all.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, fps_alpha=0.05):
+        self.buckets = buckets
+        self.histograms = {}
+        self.fps_alpha = fps_alpha
+        self.fps = 0.0            # EWMA of processed frames per second
+        self._last_frame = None
+        self.pipeline = None
+        self.started = time.time()
+
+    def attach(self, pipeline):
+        self.pipeline = pipeline
+        pipeline.metrics = self
+        if pipeline.source is not None:
+            pipeline.source.metrics = self
+        return self
+
+    def observe(self, stage, seconds):
+        hist = self.histograms.get(stage)
+        if hist is None:
+            hist = self.histograms[stage] = Histogram(self.buckets)
+        hist.observe(seconds)
+
+    def frame_done(self, now):
+        last, self._last_frame = self._last_frame, now
+        if last is None:
+            return
+        dt = now - last
+        if dt <= 0:
+            return
+        if dt > 1.0:
+            self.fps = 0.0   # paused or stalled: start over
+        else:
+            self.fps += self.fps_alpha * (1.0 / dt - self.fps)
+
+    # ----------------- Exposition -----------------
+    def snapshot(self):
+        """
+        Plain-data copy of everything render() shows, picklable so a session
+        worker can ship it to the server process (see render_snapshots).
+        """
+        snap = {
+            "buckets": self.buckets,
+            "histograms": {stage: (list(h.counts), h.sum, h.count) for stage, h in self.histograms.items()},
+            "started": self.started,
+        }
+        pipeline = self.pipeline
+        if pipeline is not None:
+            snap["fps"] = self.fps
+            snap["frames"] = pipeline.frames
+            snap["skipped"] = pipeline.skipped
+            source = pipeline.source
+            if source is not None and hasattr(source, "stats"):
+                stats = source.stats()
+                snap["capture"] = {k: stats[k] for k in ("frames_captured", "frames_dropped", "read_failures")}
+        return snap
+
+    def render(self, hub=None):
+        return render_snapshots({None: self.snapshot()}, {None: hub} if hub is not None else {})
+
+
+def render_snapshots(snapshots, hubs=None):
+    """
+    Prometheus text for several PipelineMetrics snapshots and hubs, keyed by
+    session id; every sample of a non-None key gets a `session` label.
+    """
+    lines = []
+
+    def label(key, extra=""):
+        parts = ([f'session="{key}"'] if key is not None else []) + ([extra] if extra else [])
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def metric(name, kind, help_text, samples):
+        if not samples:
+            return
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{PREFIX}_{name}{labels} {value}")
+
+    # histogram samples carry their _bucket/_sum/_count suffix in front of the labels
+    samples = []
+    for key, snap in snapshots.items():
+        bounds = tuple(snap["buckets"]) + (float("inf"),)
+        for stage in sorted(snap["histograms"]):
+            counts, total, count = snap["histograms"][stage]
+            stage_label = f'stage="{stage}"'
+            cumulative = 0
+            for bound, c in zip(bounds, counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(("_bucket" + label(key, f'{stage_label},le="{le}"'), cumulative))
+            samples.append(("_sum" + label(key, stage_label), repr(total)))
+            samples.append(("_count" + label(key, stage_label), count))
+    metric("stage_seconds", "histogram", "Time spent per frame in each stage.", samples)
+
+    now = time.time()
+    pipelines = {key: snap for key, snap in snapshots.items() if "frames" in snap}
+    metric("fps", "gauge", "Effective processed frames per second.", [
+        (label(key), round(snap["fps"], 3)) for key, snap in pipelines.items()
+    ])
+    metric("uptime_seconds", "gauge", "Seconds since the metrics were created.", [
+        (label(key), round(now - snap["started"], 3)) for key, snap in snapshots.items()
+    ])
+    metric("frames_total", "counter", "Frames read from the camera by the pipeline.", [
+        sample
+        for key, snap in pipelines.items()
+        for sample in (
+            (label(key, 'result="processed"'), snap["frames"] - snap["skipped"]),
+            (label(key, 'result="skipped"'), snap["skipped"]),
+        )
+    ])
+    captures = {key: snap["capture"] for key, snap in snapshots.items() if "capture" in snap}
+    metric("capture_frames_total", "counter", "Frames captured by the grabber.", [
+        (label(key), c["frames_captured"]) for key, c in captures.items()
+    ])
+    metric("capture_dropped_total", "counter", "Captured frames overwritten before they were processed.", [
+        (label(key), c["frames_dropped"]) for key, c in captures.items()
+    ])
+    metric("capture_read_failures_total", "counter", "Failed camera reads.", [
+        (label(key), c["read_failures"]) for key, c in captures.items()
+    ])
+
+    hubs = hubs or {}
+    channels = {key: list(hub.channels.values()) for key, hub in hubs.items()}
+    metric("broadcast_clients", "gauge", "Connected WebSocket clients.", [
+        (label(key), len(chs)) for key, chs in channels.items()
+    ])
+    metric("broadcast_queue_depth", "gauge", "Messages waiting in client queues.", [
+        sample
+        for key, chs in channels.items()
+        for sample in (
+            (label(key, 'agg="sum"'), sum(len(c.queue) for c in chs)),
+            (label(key, 'agg="max"'), max((len(c.queue) for c in chs), default=0)),
+        )
+    ])
+    metric("broadcast_published_total", "counter", "Messages published to the hub.", [
+        (label(key), hub.published) for key, hub in hubs.items()
+    ])
+    metric("broadcast_dropped_total", "counter", "Messages dropped from full client queues.", [
+        (label(key), hub.dropped_closed + sum(c.dropped for c in channels[key])) for key, hub in hubs.items()
+    ])
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,147 @@
+import json
+import os
+
+import numpy as np
+
+# Per-frame record layout (normalized MediaPipe coordinates, float32):
+#   pose: (33, 4) x, y, z, visibility
+#   eyes: (12, 3) x, y, z of blink_engine.EYE_LANDMARKS, in that order
+POSE_SHAPE = (33, 4)
+EYES_SHAPE = (12, 3)
+
+STORE_VERSION = 1
+
+_FILES = {
+    "timestamps": ("timestamps.f64", np.float64, ()),
+    "pose": ("pose.f32", np.float32, POSE_SHAPE),
+    "eyes": ("eyes.f32", np.float32, EYES_SHAPE),
+    "flags": ("flags.u8", np.uint8, (2,)),   # [pose_valid, face_valid]
+}
+
+
+class LandmarkWriter:
+    """
+    Append-only writer for a landmark store directory. Rows are staged in
+    preallocated chunk arrays and written with one write() per file per
+    chunk. Missing detections are stored as NaN rows with a cleared flag.
+    A store already in `directory` is replaced, never appended to: the
+    column files and meta.json always describe the same run.
+    """
+
+    def __init__(self, directory, width, height, fps, chunk_frames=256):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.meta = {
+            "version": STORE_VERSION,
+            "width": width,
+            "height": height,
+            "fps": fps,
+            "frames": 0,
+        }
+        self._files = {
+            name: open(os.path.join(directory, filename), "wb")
+            for name, (filename, _, _) in _FILES.items()
+        }
+        self._chunk = {
+            name: np.empty((chunk_frames,) + shape, dtype=dtype)
+            for name, (_, dtype, shape) in _FILES.items()
+        }
+        self._n = 0
+        self._write_meta()
+
+    def append(self, timestamp, pose=None, eyes=None):
+        """`pose` is a (33, 4) and `eyes` a (12, 3) normalized array, or None."""
+        i = self._n
+        chunk = self._chunk
+        chunk["timestamps"][i] = timestamp
+        if pose is None:
+            chunk["pose"][i] = np.nan
+        else:
+            chunk["pose"][i] = pose
+        if eyes is None:
+            chunk["eyes"][i] = np.nan
+        else:
+            chunk["eyes"][i] = eyes
+        chunk["flags"][i, 0] = pose is not None
+        chunk["flags"][i, 1] = eyes is not None
+
+        self._n += 1
+        if self._n == len(chunk["timestamps"]):
+            self.flush()
+
+    def append_batch(self, timestamps, pose, eyes, pose_valid, face_valid):
+        """Append many frames at once (arrays with a leading frame axis)."""
+        self.flush()
+        flags = np.stack([pose_valid, face_valid], axis=1).astype(np.uint8)
+        for name, arr in (("timestamps", timestamps), ("pose", pose), ("eyes", eyes), ("flags", flags)):
+            _, dtype, _ = _FILES[name]
+            self._files[name].write(np.ascontiguousarray(arr, dtype=dtype).tobytes())
+        self.meta["frames"] += len(timestamps)
+
+    def flush(self):
+        if self._n:
+            for name, f in self._files.items():
+                f.write(self._chunk[name][:self._n].tobytes())
+            self.meta["frames"] += self._n
+            self._n = 0
+        for f in self._files.values():
+            f.flush()
+        self._write_meta()
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_meta(self):
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+
+class LandmarkStore:
+    """
+    Read side of a landmark store: every column is a read-only np.memmap,
+    so opening hours of landmarks costs nothing until rows are touched.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"unsupported landmark store version: {self.meta.get('version')}")
+
+        self.width = self.meta["width"]
+        self.height = self.meta["height"]
+        self.fps = self.meta["fps"]
+
+        # frame count comes from the file sizes, so a store whose writer
+        # crashed before updating meta.json is still readable
+        n = min(
+            os.path.getsize(os.path.join(directory, filename))
+            // (np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64)))
+            for filename, dtype, shape in _FILES.values()
+        )
+
+        columns = {}
+        for name, (filename, dtype, shape) in _FILES.items():
+            path = os.path.join(directory, filename)
+            if n == 0:
+                columns[name] = np.empty((0,) + shape, dtype=dtype)
+            else:
+                columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(n,) + shape)
+
+        self.timestamps = columns["timestamps"]
+        self.pose = columns["pose"]
+        self.eyes = columns["eyes"]
+        self.pose_valid = columns["flags"][:, 0].astype(bool)
+        self.face_valid = columns["flags"][:, 1].astype(bool)
+
+    def __len__(self):
+        return len(self.timestamps)
@@ -0,0 +1,400 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# Per-frame sample columns, in insert order. Scores, EAR and posture
+# metrics are None when the model did not run this frame or found nothing;
+# `bad` (1/0, None = unknown) and `face` (1/0) are the tracker's state.
+SAMPLE_FIELDS = (
+    "posture_score",
+    "avg_score",
+    "bad",
+    "face",
+    "ear",
+    "back_angle",
+    "neck_angle",
+    "head_forward_cm",
+    "shoulder_tilt_deg",
+)
+
+# A sample stands for the time until the next one, capped so that pauses
+# (no samples) are not counted as tracked time.
+MAX_SAMPLE_GAP_SEC = 1.0
+
+# Every table has a trailing session_id ('' = written without a session):
+# concurrent sessions record into the same tables, and each one's sample
+# durations and buckets are computed over its own rows only.
+
+# Columns every rollup table keeps per session and bucket. Averages are
+# stored as sums + counts so minute buckets roll up into hours exactly.
+_ROLLUP_COLUMNS = """
+    bucket INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    tracked_sec REAL NOT NULL,
+    posture_sec REAL NOT NULL,
+    bad_sec REAL NOT NULL,
+    face_sec REAL NOT NULL,
+    posture_n INTEGER NOT NULL,
+    posture_sum REAL,
+    posture_min REAL,
+    posture_max REAL,
+    ear_n INTEGER NOT NULL,
+    ear_sum REAL,
+    ear_min REAL,
+    blinks INTEGER NOT NULL,
+    back_angle_sum REAL,
+    neck_angle_sum REAL,
+    head_forward_sum REAL,
+    shoulder_tilt_sum REAL,
+    session_id TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (bucket, session_id)
+"""
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS samples (
+    ts REAL NOT NULL,
+    {", ".join(f"{name} REAL" for name in SAMPLE_FIELDS)},
+    session_id TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+
+CREATE TABLE IF NOT EXISTS events (
+    ts REAL NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT,
+    session_id TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+
+CREATE TABLE IF NOT EXISTS rollup_1m ({_ROLLUP_COLUMNS});
+CREATE TABLE IF NOT EXISTS rollup_1h ({_ROLLUP_COLUMNS});
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+# Aggregates of raw samples + blink events into buckets of :size seconds
+# starting at :offset (mod :size), one row per session and bucket. Used
+# for minute rollups and for reads finer than a minute / newer than the
+# last rollup.
+RAW_BUCKETS_SQL = f"""
+WITH s AS (
+    SELECT *, MIN(
+        COALESCE(LEAD(ts) OVER (PARTITION BY session_id ORDER BY ts) - ts, 0), {MAX_SAMPLE_GAP_SEC}
+    ) AS dt
+    FROM samples WHERE ts >= :start AND ts < :end + {MAX_SAMPLE_GAP_SEC}
+)
+SELECT
+    b.bucket,
+    COALESCE(s.frames, 0), COALESCE(s.tracked_sec, 0), COALESCE(s.posture_sec, 0),
+    COALESCE(s.bad_sec, 0), COALESCE(s.face_sec, 0),
+    COALESCE(s.posture_n, 0), s.posture_sum, s.posture_min, s.posture_max,
+    COALESCE(s.ear_n, 0), s.ear_sum, s.ear_min,
+    COALESCE(e.blinks, 0),
+    s.back_angle_sum, s.neck_angle_sum, s.head_forward_sum, s.shoulder_tilt_sum,
+    b.session_id
+FROM (
+    SELECT CAST((ts - :offset) / :size AS INTEGER) * :size + :offset AS bucket, session_id
+    FROM samples WHERE ts >= :start AND ts < :end
+    UNION
+    SELECT CAST((ts - :offset) / :size AS INTEGER) * :size + :offset, session_id
+    FROM events WHERE type = 'blink' AND ts >= :start AND ts < :end
+) AS b
+LEFT JOIN (
+    SELECT
+        CAST((ts - :offset) / :size AS INTEGER) * :size + :offset AS bucket,
+        session_id,
+        COUNT(*) AS frames,
+        SUM(dt) AS tracked_sec,
+        SUM(CASE WHEN bad IS NOT NULL THEN dt ELSE 0 END) AS posture_sec,
+        SUM(CASE WHEN bad = 1 THEN dt ELSE 0 END) AS bad_sec,
+        SUM(CASE WHEN face = 1 THEN dt ELSE 0 END) AS face_sec,
+        COUNT(posture_score) AS posture_n,
+        SUM(posture_score) AS posture_sum,
+        MIN(posture_score) AS posture_min,
+        MAX(posture_score) AS posture_max,
+        COUNT(ear) AS ear_n,
+        SUM(ear) AS ear_sum,
+        MIN(ear) AS ear_min,
+        SUM(back_angle) AS back_angle_sum,
+        SUM(neck_angle) AS neck_angle_sum,
+        SUM(head_forward_cm) AS head_forward_sum,
+        SUM(shoulder_tilt_deg) AS shoulder_tilt_sum
+    FROM s WHERE ts < :end
+    GROUP BY 1, 2
+) AS s ON s.bucket = b.bucket AND s.session_id = b.session_id
+LEFT JOIN (
+    SELECT
+        CAST((ts - :offset) / :size AS INTEGER) * :size + :offset AS bucket,
+        session_id,
+        COUNT(*) AS blinks
+    FROM events WHERE type = 'blink' AND ts >= :start AND ts < :end
+    GROUP BY 1, 2
+) AS e ON e.bucket = b.bucket AND e.session_id = b.session_id
+"""
+
+# Re-aggregates a rollup table into coarser buckets (sizes that are a
+# multiple of the table's own bucket), per session.
+ROLLUP_BUCKETS_SQL = """
+SELECT
+    ((bucket - :offset) / :size) * :size + :offset,
+    SUM(frames), SUM(tracked_sec), SUM(posture_sec), SUM(bad_sec), SUM(face_sec),
+    SUM(posture_n), SUM(posture_sum), MIN(posture_min), MAX(posture_max),
+    SUM(ear_n), SUM(ear_sum), MIN(ear_min), SUM(blinks),
+    SUM(back_angle_sum), SUM(neck_angle_sum), SUM(head_forward_sum), SUM(shoulder_tilt_sum),
+    session_id
+FROM {table} WHERE bucket >= :start AND bucket < :end
+GROUP BY 1, session_id
+"""
+
+# column order of both queries above (and of the rollup tables)
+BUCKET_COLUMNS = (
+    "bucket", "frames", "tracked_sec", "posture_sec", "bad_sec", "face_sec",
+    "posture_n", "posture_sum", "posture_min", "posture_max",
+    "ear_n", "ear_sum", "ear_min", "blinks",
+    "back_angle_sum", "neck_angle_sum", "head_forward_sum", "shoulder_tilt_sum",
+    "session_id",
+)
+
+
+class MetricsStore:
+    """
+    Append-only session history in a local SQLite database (WAL mode).
+
+    record_sample() / record_event() only put a tuple on a queue, so the
+    inference loop never waits on disk. A writer thread drains the queue
+    in one transaction per batch and, every `rollup_interval` seconds,
+    folds completed minutes into `rollup_1m` and completed hours into
+    `rollup_1h`. Raw samples and minute buckets are pruned after their
+    retention period; hour buckets are kept (about 9k rows a year).
+    """
+
+    def __init__(
+        self,
+        path,
+        flush_interval=1.0,
+        rollup_interval=60.0,
+        raw_retention_sec=2 * 86400,
+        minute_retention_sec=30 * 86400,
+        max_pending=100_000,
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.rollup_interval = rollup_interval
+        self.raw_retention_sec = raw_retention_sec
+        self.minute_retention_sec = minute_retention_sec
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._thread = None
+        self._dirty_since = None  # oldest ts written since the last rollup
+        self._listeners = []
+
+        with self.connect() as db:
+            _migrate(db)
+            db.executescript(_SCHEMA)
+
+        # ---- COUNTERS ----
+        self.samples_written = 0
+        self.events_written = 0
+        self.dropped = 0          # queue full: writer fell behind
+        self.batches = 0
+        self.last_flush_ms = 0.0
+        self.last_rollup_ms = 0.0
+
+    def connect(self):
+        """A new connection with the store's pragmas (one per thread)."""
+        db = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # ----------------- Producer side (any thread, never blocks) -----------------
+    def record_sample(self, ts, session_id="", **values):
+        """Queue one frame; keyword names are SAMPLE_FIELDS, missing ones are NULL."""
+        self._put(("s", (ts,) + tuple(values.get(name) for name in SAMPLE_FIELDS) + (session_id,)))
+
+    def record_event(self, ts, event_type, data=None, session_id=""):
+        self._put(("e", (ts, event_type, None if data is None else json.dumps(data), session_id)))
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    # ----------------- Writer thread -----------------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics-store", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        db = self.connect()
+        next_rollup = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                self._stop.wait(self.flush_interval)
+                self._flush(db)
+                if time.monotonic() >= next_rollup:
+                    self.rollup(db)
+                    next_rollup = time.monotonic() + self.rollup_interval
+            self._flush(db)
+            self.rollup(db)
+        finally:
+            db.close()
+
+    def _flush(self, db):
+        samples, events = [], []
+        while True:
+            try:
+                kind, row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            (samples if kind == "s" else events).append(row)
+        if not samples and not events:
+            return
+
+        t0 = time.perf_counter()
+        with db:
+            if samples:
+                db.executemany(
+                    f"INSERT INTO samples VALUES (?, {', '.join('?' * len(SAMPLE_FIELDS))}, ?)",
+                    samples,
+                )
+            if events:
+                db.executemany("INSERT INTO events VALUES (?, ?, ?, ?)", events)
+        self.last_flush_ms = (time.perf_counter() - t0) * 1000.0
+        self.samples_written += len(samples)
+        self.events_written += len(events)
+        self.batches += 1
+
+        oldest = min(row[0] for row in samples + events)
+        if self._dirty_since is None or oldest < self._dirty_since:
+            self._dirty_since = oldest
+        for listener in self._listeners:
+            listener(oldest)
+
+    def add_listener(self, callback):
+        """`callback(oldest_ts)` runs on the writer thread after each committed batch."""
+        self._listeners.append(callback)
+
+    # ----------------- Rollups + retention -----------------
+    def rollup(self, db=None, now=None):
+        """Fold completed minutes/hours into the rollup tables and prune old rows."""
+        own = db is None
+        if own:
+            db = self.connect()
+        now = time.time() if now is None else now
+        t0 = time.perf_counter()
+        try:
+            with db:
+                # Completed minutes only. The last rolled minute is rolled
+                # again, picking up rows that were still queued last time,
+                # and so is anything older that was written since.
+                minute_end = int(now // 60) * 60
+                minute_start = self._watermark(db, "rollup_1m")
+                if minute_start is None:
+                    first = db.execute("SELECT MIN(ts) FROM samples").fetchone()[0]
+                    minute_start = int(first // 60) * 60 if first is not None else minute_end
+                minute_start = min(minute_start, minute_end) - 60
+                if self._dirty_since is not None:
+                    minute_start = min(minute_start, int(self._dirty_since // 60) * 60)
+                self._dirty_since = None
+                db.execute(
+                    "INSERT OR REPLACE INTO rollup_1m " + RAW_BUCKETS_SQL,
+                    {"start": minute_start, "end": minute_end, "size": 60, "offset": 0},
+                )
+                self._set_watermark(db, "rollup_1m", minute_end)
+
+                hour_end = (minute_end // 3600) * 3600
+                hour_start = self._watermark(db, "rollup_1h")
+                if hour_start is None:
+                    first = db.execute("SELECT MIN(bucket) FROM rollup_1m").fetchone()[0]
+                    hour_start = (first // 3600) * 3600 if first is not None else hour_end
+                hour_start = min(hour_start, hour_end, (minute_start // 3600) * 3600) - 3600
+                db.execute(
+                    "INSERT OR REPLACE INTO rollup_1h " + ROLLUP_BUCKETS_SQL.format(table="rollup_1m"),
+                    {"start": hour_start, "end": hour_end, "size": 3600, "offset": 0},
+                )
+                self._set_watermark(db, "rollup_1h", hour_end)
+
+                # retention: never prune what has not been rolled up yet;
+                # warning/resolved events are rare and kept for analytics
+                raw_cutoff = min(now - self.raw_retention_sec, minute_start)
+                db.execute("DELETE FROM samples WHERE ts < ?", (raw_cutoff,))
+                db.execute("DELETE FROM events WHERE ts < ? AND type = 'blink'", (raw_cutoff,))
+                db.execute(
+                    "DELETE FROM rollup_1m WHERE bucket < ?",
+                    (min(now - self.minute_retention_sec, hour_start),),
+                )
+        finally:
+            if own:
+                db.close()
+        self.last_rollup_ms = (time.perf_counter() - t0) * 1000.0
+
+    def watermarks(self, db):
+        """End (exclusive) of the data already in rollup_1m / rollup_1h."""
+        return {name: self._watermark(db, name) for name in ("rollup_1m", "rollup_1h")}
+
+    @staticmethod
+    def _watermark(db, name):
+        row = db.execute("SELECT value FROM meta WHERE key = ?", (name,)).fetchone()
+        return None if row is None else int(row[0])
+
+    @staticmethod
+    def _set_watermark(db, name, value):
+        db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, value))
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "pending": self._queue.qsize(),
+            "samples_written": self.samples_written,
+            "events_written": self.events_written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "last_flush_ms": self.last_flush_ms,
+            "last_rollup_ms": self.last_rollup_ms,
+        }
+
+
+def _migrate(db):
+    """Add session_id to a database written before sessions were recorded apart."""
+    def columns(table):
+        return [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+    for table in ("samples", "events"):
+        cols = columns(table)
+        if cols and "session_id" not in cols:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN session_id TEXT NOT NULL DEFAULT ''")
+    # the rollups' primary key changes, so they are rebuilt
+    for table in ("rollup_1m", "rollup_1h"):
+        cols = columns(table)
+        if cols and "session_id" not in cols:
+            db.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            db.execute(f"CREATE TABLE {table} ({_ROLLUP_COLUMNS})")
+            db.execute(f"INSERT INTO {table} SELECT *, '' FROM {table}_old")
+            db.execute(f"DROP TABLE {table}_old")
@@ -0,0 +1,211 @@
+import math
+import struct
+import uuid
+
+# Per-frame fields of the binary "metrics_stream", in bit order of the
+# record masks. posture is sent as a code (POSTURE_CODES).
+FIELDS = (
+    "posture",
+    "posture_score",
+    "avg_score",
+    "ear",
+    "blink_rate_per_min",
+    "back_angle",
+    "neck_angle",
+    "head_forward_cm",
+    "shoulder_tilt_deg",
+)
+NUMERIC_FIELDS = FIELDS[1:]
+POSTURE_CODES = {"unknown": 0, "good": 1, "bad": 2}
+POSTURES = {code: name for name, code in POSTURE_CODES.items()}
+
+# A value is resent once it moved more than this from the last value sent.
+EPSILON = {
+    "posture": 0.0,
+    "posture_score": 0.005,
+    "avg_score": 0.005,
+    "ear": 0.002,
+    "blink_rate_per_min": 0.05,
+    "back_angle": 0.1,
+    "neck_angle": 0.1,
+    "head_forward_cm": 0.05,
+    "shoulder_tilt_deg": 0.1,
+}
+
+MAGIC = b"AX"
+VERSION = 1
+KEYFRAME = 0x01
+# magic, version, flags, stream id (session uuid), batch seq, ts of the
+# first record, record count
+HEADER = struct.Struct("<2sBB16sIdH")
+# per record: µs after the batch ts, mask of the fields that follow as float32
+RECORD = struct.Struct("<IH")
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+
+
+class MetricsStreamEncoder:
+    """
+    Packs per-frame metrics into compact binary batches (little-endian):
+
+        header   2s magic "AX", u8 version, u8 flags (1 = keyframe),
+                 16s stream id, u32 batch seq, f64 ts, u16 records
+        record   u32 µs after the header ts, u16 field mask,
+                 one f32 per set bit of the mask, in FIELDS order
+
+    A field is only sent when it moved more than its EPSILON from the last
+    value sent (None is NaN; posture is its POSTURE_CODES code), so values
+    that hold still - a throttled model's result, a stable score - cost
+    nothing. Every `keyframe_sec` the first record of a batch carries every
+    field, so a client that joined late or missed a batch (see the seq)
+    is complete again within that time.
+
+    add() buffers a frame and returns the batch once it holds
+    `batch_frames` frames or its first frame is `max_delay` seconds old;
+    the batch is encoded once for every subscriber.
+    """
+
+    def __init__(self, stream_id=None, batch_frames=8, max_delay=0.25, keyframe_sec=1.0, epsilon=None):
+        self.stream_id = uuid.UUID(stream_id).bytes if stream_id else bytes(16)
+        self.batch_frames = batch_frames
+        self.max_delay = max_delay
+        self.keyframe_sec = keyframe_sec
+        eps = dict(EPSILON, **(epsilon or {}))
+        self.epsilon = [eps[f] for f in FIELDS]
+        self.seq = 0
+        self.reset()
+
+        # ---- COUNTERS ----
+        self.batches = 0
+        self.records = 0
+        self.values_sent = 0
+        self.bytes = 0
+
+    def reset(self):
+        """Drop buffered frames; the next batch is a keyframe (e.g. after the last subscriber left)."""
+        self._last = None          # last value sent per field, None = send all
+        self._records = []         # (ts, mask, values)
+        self._keyframe = False
+        self._next_keyframe = 0.0
+
+    @property
+    def active(self):
+        return self._last is not None or bool(self._records)
+
+    def add(self, ts, values):
+        """Buffer one frame of `values` (FIELDS -> value); returns a batch to send, or None."""
+        if not self._records:
+            self._keyframe = self._last is None or ts >= self._next_keyframe
+            full = self._keyframe
+            if full:
+                self._next_keyframe = ts + self.keyframe_sec
+        else:
+            full = False
+
+        row = [POSTURE_CODES.get(values.get("posture"), 0)]
+        # float(): posture metrics are numpy scalars, slow to compare
+        row += [math.nan if v is None else float(v) for v in map(values.get, NUMERIC_FIELDS)]
+        if full:
+            mask, changed = ALL_FIELDS, row
+            self._last = row[:]
+        else:
+            last = self._last
+            mask, changed = 0, []
+            for i, v, prev, eps in zip(range(len(row)), row, last, self.epsilon):
+                # NaN != NaN: a value that appears or disappears is a change
+                if (v != v) != (prev != prev) or abs(v - prev) > eps:
+                    mask |= 1 << i
+                    changed.append(v)
+                    last[i] = v
+        self._records.append((ts, mask, changed))
+
+        if len(self._records) >= self.batch_frames or ts - self._records[0][0] >= self.max_delay:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """The buffered frames as one batch, or None if there are none."""
+        records = self._records
+        if not records:
+            return None
+        self._records = []
+        ts0 = records[0][0]
+        fmt = ["<", HEADER.format[1:]]
+        items = [MAGIC, VERSION, KEYFRAME if self._keyframe else 0, self.stream_id, self.seq, ts0, len(records)]
+        for ts, mask, changed in records:
+            fmt.append(f"IH{len(changed)}f")
+            items.append(round((ts - ts0) * 1e6))
+            items.append(mask)
+            items.extend(changed)
+            self.values_sent += len(changed)
+        data = struct.pack("".join(fmt), *items)
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.batches += 1
+        self.records += len(records)
+        self.bytes += len(data)
+        return data
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "records": self.records,
+            "values_sent": self.values_sent,
+            "values_suppressed": self.records * len(FIELDS) - self.values_sent,
+            "bytes": self.bytes,
+        }
+
+
+def decode_batch(data):
+    """
+    One batch as {"stream_id", "seq", "keyframe", "records"}; every record
+    is (ts, {field: value}) with only the fields it carries (None for NaN).
+    """
+    magic, version, flags, stream_id, seq, ts0, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"not a metrics stream batch (magic {magic!r}, version {version})")
+    offset = HEADER.size
+    records = []
+    for _ in range(count):
+        dt, mask = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        names = [name for i, name in enumerate(FIELDS) if mask >> i & 1]
+        raw = struct.unpack_from(f"<{len(names)}f", data, offset)
+        offset += 4 * len(names)
+        values = {}
+        for name, v in zip(names, raw):
+            if name == "posture":
+                values[name] = POSTURES.get(int(v), "unknown")
+            else:
+                values[name] = None if v != v else v
+        records.append((ts0 + dt / 1e6, values))
+    return {"stream_id": uuid.UUID(bytes=stream_id).hex, "seq": seq, "keyframe": bool(flags & KEYFRAME), "records": records}
+
+
+class MetricsStreamDecoder:
+    """
+    Client side of the stream: applies the batches of every stream id in
+    order and returns full per-frame records. After a gap in the batch seq
+    (a slow client's queue dropped one) a stream returns nothing until its
+    next keyframe, rather than values that may be stale.
+    """
+
+    def __init__(self):
+        self.streams = {}   # stream id -> [next seq, state or None]
+        self.gaps = 0
+
+    def feed(self, data):
+        batch = decode_batch(data)
+        stream = self.streams.setdefault(batch["stream_id"], [batch["seq"], None])
+        if batch["seq"] != stream[0]:
+            self.gaps += 1
+            stream[1] = None
+        stream[0] = (batch["seq"] + 1) & 0xFFFFFFFF
+        if batch["keyframe"]:
+            stream[1] = {}
+        state = stream[1]
+        if state is None:
+            return []
+        frames = []
+        for ts, values in batch["records"]:
+            state.update(values)
+            frames.append({"ts": ts, "sessionId": batch["stream_id"], **state})
+        return frames
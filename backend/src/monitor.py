@@ -1,116 +1,171 @@
 import asyncio
-import random
-import cv2
 import mediapipe as mp
-import numpy as np
-from collections import deque
 from src.utils import wait_for_unpause
+from src.capture import FrameGrabber
+from src.stats import EventRateWindow, RollingStats
 import time
-from src.posture_engine import mp_drawing, mp_pose, compute_bad_posture_score, compute_posture_metrics
-from src.blink_engine import LEFT_EYE, RIGHT_EYE
-
-from src.blink_engine import compute_EAR
+from src.inference import ParallelInference, ProcessInference
+from src.pipeline import Pipeline
+from src.autotune import AutoTuner
+from src.tracker import SessionTracker
+from src.broadcast import METRICS_STREAM_TYPE, METRICS_TYPE
+from src.metrics_stream import MetricsStreamEncoder
+from src.posture_engine import mp_drawing, mp_pose, PostureAnalyzer
+from src.blink_engine import EAR_CONSEC_FRAMES, EAR_THRESHOLD, BlinkAnalyzer
 
 mp_face_mesh = mp.solutions.face_mesh
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
+
+# ---------------------------
+# ADAPTIVE INFERENCE SCHEDULER
+# ---------------------------
+class AdaptiveScheduler:
+    """
+    Decides per frame which models to run. Each signal has a full rate and an
+    idle rate (Hz, None = every frame):
+      - posture drops to `posture_idle_hz` while the smoothed score is stable
+        and jumps back to full rate as soon as the score starts to move;
+      - blink detection runs at full rate only while the EAR is within
+        `ear_margin` of the blink threshold (or the face was just lost).
+    Skipped runs are priced at the model's measured latency to report the
+    CPU time saved.
+    """
+
+    def __init__(
+        self,
+        full_rate_hz=None,
+        posture_idle_hz=3.0,
+        blink_idle_hz=10.0,
+        posture_delta=0.05,
+        ear_threshold=EAR_THRESHOLD,
+        ear_margin=0.07,
+    ):
+        self.full_rate_hz = full_rate_hz
+        self.idle_rate_hz = {"pose": posture_idle_hz, "face": blink_idle_hz}
+        self.posture_delta = posture_delta
+        self.ear_threshold = ear_threshold
+        self.ear_margin = ear_margin
+
+        self.rate_hz = {"pose": full_rate_hz, "face": full_rate_hz}
+        self._last_run = {"pose": 0.0, "face": 0.0}
+        self._last_score = None
+
+        # ---- STATS ----
+        self.runs = {"pose": 0, "face": 0}
+        self.skips = {"pose": 0, "face": 0}
+        self.avg_latency = {"pose": 0.0, "face": 0.0}  # EWMA, seconds
+
+    def due(self, now, only=None):
+        """Return the set of model names that should run on this frame."""
+        run = set()
+        for name, rate in self.rate_hz.items():
+            if only is not None and name not in only:
+                continue
+            # small slack so a 10 Hz limit on a 30 fps camera means every 3rd frame
+            if rate is None or now - self._last_run[name] >= 1.0 / rate - 1e-3:
+                run.add(name)
+            else:
+                self.skips[name] += 1
+        return run
+
+    def record_run(self, name, now, latency):
+        self._last_run[name] = now
+        self.runs[name] += 1
+        prev = self.avg_latency[name]
+        self.avg_latency[name] = latency if prev == 0.0 else 0.9 * prev + 0.1 * latency
+
+    def update_posture(self, score, avg_score):
+        # Stable = the new score agrees with both the last one and the
+        # smoothing window; anything else means the user is moving.
+        if score is None:
+            self.rate_hz["pose"] = self.full_rate_hz
+            self._last_score = None
+            return
+
+        changing = (
+            self._last_score is None
+            or abs(score - self._last_score) > self.posture_delta
+            or abs(score - avg_score) > self.posture_delta
+        )
+        self.rate_hz["pose"] = self.full_rate_hz if changing else self.idle_rate_hz["pose"]
+        self._last_score = score
+
+    def update_blink(self, ear):
+        # No face yet -> keep searching at full rate.
+        near_threshold = ear is None or ear < self.ear_threshold + self.ear_margin
+        self.rate_hz["face"] = self.full_rate_hz if near_threshold else self.idle_rate_hz["face"]
+
+    def stats(self):
+        saved = {name: self.skips[name] * self.avg_latency[name] for name in self.skips}
+        spent = {name: self.runs[name] * self.avg_latency[name] for name in self.runs}
+        total = sum(saved.values()) + sum(spent.values())
+        return {
+            "rate_hz": dict(self.rate_hz),
+            "runs": dict(self.runs),
+            "skips": dict(self.skips),
+            "avg_latency_ms": {name: lat * 1000.0 for name, lat in self.avg_latency.items()},
+            "cpu_saved_sec": sum(saved.values()),
+            "cpu_saved_pct": 100.0 * sum(saved.values()) / total if total > 0 else 0.0,
+        }
+
+
 # ---------------------------
 # USED FOR WEBSOCKET
 # ---------------------------
 async def run_combined_monitor(recording_flag, posture_manager, blink_manager):
     print("combined monitor started")
 
-    # ---- CAMERA SETUP ----
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH,  640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-    # ---- MEDIAPIPE SETUP ----
-    pose = mp_pose.Pose(
-        static_image_mode=False,
-        model_complexity=1,
-        enable_segmentation=False,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5,
-    )
-
-    face_mesh = mp_face_mesh.FaceMesh(
-        refine_landmarks=True,
-        max_num_faces=1,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5,
+    # ---- CAMERA + MEDIAPIPE SETUP ----
+    # capture runs on its own thread; Pose and FaceMesh run concurrently
+    pipeline = Pipeline(
+        [PostureAnalyzer(), BlinkAnalyzer()],
+        source=FrameGrabber(0, width=640, height=480),
     )
+    await pipeline.open_async()
 
     # ---- POSTURE HISTORY ----
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or fps > 120:
-        fps = 30
-
     window_seconds = 3
-    bad_history = deque(maxlen=int(fps * window_seconds))
+    bad_history = RollingStats(int(pipeline.source.fps * window_seconds))
 
     # ---- BLINK HISTORY ----
-    EAR_THRESHOLD = 0.23
-    EAR_CONSEC_FRAMES = 2
     frame_counter = 0
-    blink_times = deque()
+    blink_times = EventRateWindow(60, start_time=time.time())
 
     while True:
         # wait until recording_flag = True (non-blocking)
         await wait_for_unpause(recording_flag)
 
-        ret, frame = cap.read()
-        if not ret:
-            await asyncio.sleep(0.01)
+        ctx = await pipeline.step()
+        if ctx is None:
             continue
 
-        # Mirror the frame
-        frame = cv2.flip(frame, 1)
-        h, w, _ = frame.shape
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
         # ---------- POSTURE PROCESSING ----------
-        posture_score = None
+        posture_score = ctx.values["posture_score"]
         current_posture = "unknown"
 
-        pose_results = pose.process(rgb)
-        if pose_results.pose_landmarks:
-            lm = pose_results.pose_landmarks.landmark
-
-            metrics = compute_posture_metrics(lm, w, h)
-            posture_score = compute_bad_posture_score(metrics)
-
+        if posture_score is not None:
             bad_history.append(posture_score)
-            avg_score = np.mean(bad_history)
+            avg_score = bad_history.mean
             current_posture = "bad" if avg_score > 0.5 else "good"
 
         # ---------- BLINK PROCESSING ----------
         blink_rate = 0
         current_blink = "unknown"
+        EAR = ctx.values["ear"]
 
-        face_results = face_mesh.process(rgb)
-        if face_results.multi_face_landmarks:
-            face = face_results.multi_face_landmarks[0].landmark
-
-            left_EAR  = compute_EAR(face, w, h, LEFT_EYE)
-            right_EAR = compute_EAR(face, w, h, RIGHT_EYE)
-            EAR       = (left_EAR + right_EAR) / 2.0
-
+        if EAR is not None:
             # Blink logic
             if EAR < EAR_THRESHOLD:
                 frame_counter += 1
             else:
                 if frame_counter >= EAR_CONSEC_FRAMES:
-                    blink_times.append(time.time())
+                    blink_times.add(time.time())
                 frame_counter = 0
 
-            # cleanup blink timestamps older than 60s
-            now = time.time()
-            while blink_times and now - blink_times[0] > 60:
-                blink_times.popleft()
-
-            blink_rate = len(blink_times)
+            # blinks over the last 60s
+            blink_rate = blink_times.count(time.time())
             current_blink = "bad" if blink_rate > 10 else "good"
 
         # ---------- BROADCAST TO SOCKETS ----------
@@ -120,205 +175,232 @@ async def run_combined_monitor(recording_flag, posture_manager, blink_manager):
         await blink_manager.broadcast({"blink": blink_rate})
 
         # yield to event loop (important!)
-        await asyncio.sleep(0)  
-
-    cap.release()
-
-
-async def main_backend(recording_flag, general_manager):
-    print("combined monitor started")
-
-    # ---- CAMERA SETUP ----
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH,  640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-    # ---- MEDIAPIPE SETUP ----
-    pose = mp_pose.Pose(
-        static_image_mode=False,
-        model_complexity=1,
-        enable_segmentation=False,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5,
-    )
-
-    face_mesh = mp_face_mesh.FaceMesh(
-        refine_landmarks=True,
-        max_num_faces=1,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5,
-    )
-
-    # ---- POSTURE HISTORY (SHORT-TERM SMOOTHING) ----
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or fps > 120:
-        fps = 30
-
-    window_seconds = 3
-    bad_history = deque(maxlen=int(fps * window_seconds))
-
-    # ---- BLINK HISTORY ----
-    EAR_THRESHOLD = 0.23
-    EAR_CONSEC_FRAMES = 2
-    frame_counter = 0
-    blink_times = deque([time.time()] * 15)  # timestamps of each detected blink (for last 60s)
-
-    # ---- PROLONGED STATE CONFIG ----
-    # Posture: "prolonged bad" = 60s of continuous bad posture
-    POSTURE_PROLONGED_THRESHOLD_SEC = 2
-
-    # Blink: "prolonged low blink rate" = < 8 blinks/min for at least 60s
-    LOW_BLINK_RATE_THRESHOLD = 8          # blinks / minute
-    LOW_BLINK_PROLONGED_THRESHOLD_SEC = 2
-
-    # ---- PROLONGED STATE VARIABLES ----
-    posture_bad_since = None
-    posture_prolonged_active = False
-
-    low_blink_since = None
-    low_blink_prolonged_active = False
-
-    while True:
-        # wait until recording_flag = True (non-blocking)
-        await wait_for_unpause(recording_flag)
-
-        ret, frame = cap.read()
-        if not ret:
-            await asyncio.sleep(0.01)
-            continue
-
-        now = time.time()
+        await asyncio.sleep(0)
 
-        # Mirror the frame
-        frame = cv2.flip(frame, 1)
-        h, w, _ = frame.shape
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    pipeline.close()
+
+
+# Session stage -> pipeline analyzer. A session only loads the graphs for
+# the stages it asked for.
+PIPELINE_STAGES = {
+    "posture": PostureAnalyzer,
+    "eye_strain": BlinkAnalyzer,
+}
+
+
+def stage_analyzers(stages, face_roi=False, pose_complexity=1):
+    """
+    Analyzers for the enabled stages. With `face_roi` FaceMesh runs on the
+    head crop found by Pose, when the posture stage is on to provide it.
+    """
+    analyzers = []
+    for stage in sorted(stages):
+        if stage == "posture":
+            analyzers.append(PostureAnalyzer(model_complexity=pose_complexity))
+        elif stage == "eye_strain" and face_roi and "posture" in stages:
+            analyzers.append(BlinkAnalyzer(roi=True))
+        elif stage in PIPELINE_STAGES:
+            analyzers.append(PIPELINE_STAGES[stage]())
+    return analyzers
+
+
+class SessionSink:
+    """
+    main_backend's pipeline sink: feeds analyzer values into the
+    SessionTracker and the scheduler, publishes warning/resolved events
+    (and raw metrics when someone subscribed, as JSON and/or through the
+    `stream` encoder) and records session history. Throttled models keep
+    their previous result in the tracker.
+    """
+
+    name = "session"
+
+    def __init__(self, tracker, scheduler, manager, store=None, stream=None):
+        self.tracker = tracker
+        self.scheduler = scheduler
+        self.manager = manager
+        self.store = store
+        self.stream = stream  # MetricsStreamEncoder for "metrics_stream" subscribers
+        self.metrics = None   # last posture metrics, for "metrics" subscribers
+
+    def stage_removed(self, model, now):
+        # a removed stage reads as "not detected" so its active warning resolves
+        if model == "pose":
+            self.tracker.update_posture(now, None)
+            self.metrics = None
+        elif model == "face":
+            self.tracker.update_blink(now, None)
+
+    def __call__(self, ctx):
+        tracker, store, now = self.tracker, self.store, ctx.ts
+        ran_pose = "pose" in ctx.results
+        ran_face = "face" in ctx.results
 
         # ---------- POSTURE PROCESSING ----------
-        posture_score = None
-        current_posture = "unknown"
-
-        pose_results = pose.process(rgb)
-        if pose_results.pose_landmarks:
-            lm = pose_results.pose_landmarks.landmark
-
-            metrics = compute_posture_metrics(lm, w, h)
-            posture_score = compute_bad_posture_score(metrics)
-
-            bad_history.append(posture_score)
-            avg_score = np.mean(bad_history)
-            current_posture = "bad" if avg_score > 0.67 else "good"
-        else:
-            current_posture = "unknown"
+        if ran_pose:
+            posture_score = ctx.values["posture_score"]
+            self.metrics = ctx.values["metrics"]
+            avg_score = tracker.update_posture(now, posture_score)
+            self.scheduler.update_posture(posture_score, avg_score)
 
         # ---------- BLINK PROCESSING ----------
-        blink_rate = None    # blinks per 60s
-        face_visible = False
-
-        face_results = face_mesh.process(rgb)
-        if face_results.multi_face_landmarks:
-            face_visible = True
-            face = face_results.multi_face_landmarks[0].landmark
-
-            left_EAR  = compute_EAR(face, w, h, LEFT_EYE)
-            right_EAR = compute_EAR(face, w, h, RIGHT_EYE)
-            EAR       = (left_EAR + right_EAR) / 2.0
-
-            # Blink logic
-            if EAR < EAR_THRESHOLD:
-                frame_counter += 1
-            else:
-                if frame_counter >= EAR_CONSEC_FRAMES:
-                    blink_times.append(now)
-                frame_counter = 0
-
-        # cleanup blink timestamps older than 60s
-        while blink_times and now - blink_times[0] > 60:
-            blink_times.popleft()
-
-        # compute blink rate over last 60s if face is visible
-        if face_visible:
-            blink_rate = len(blink_times)
-
-        # ---------- PROLONGED POSTURE LOGIC & WEBSOCKET EVENTS ----------
-        # We treat "unknown" posture (no pose detected) as a break in continuity.
-        if current_posture == "bad":
-            if posture_bad_since is None:
-                posture_bad_since = now
-
-            bad_duration = now - posture_bad_since
-
-            if (not posture_prolonged_active and
-                    bad_duration >= POSTURE_PROLONGED_THRESHOLD_SEC):
-                posture_prolonged_active = True
-
-                # Send a single event when prolonged bad posture starts
-                await general_manager.broadcast({
-                    "type": "posture_warning",
-                    "status": "prolonged_bad",
-                    "bad_duration_sec": int(bad_duration),
-                })
-
-        else:
-            # Posture is either "good" or "unknown" -> break streak
-            if posture_prolonged_active:
-                posture_prolonged_active = False
-                posture_bad_since = None
-
-                # Notify client that posture returned to non-prolonged state
-                await general_manager.broadcast({
-                    "type": "posture_resolved",
-                    "status": "back_to_good_or_unknown",
-                })
-            else:
-                posture_bad_since = None
-
-        # ---------- PROLONGED LOW BLINK RATE LOGIC & WEBSOCKET EVENTS ----------
-        # Only reason about eye fatigue when we have a face in frame and a blink_rate.
-        if face_visible and blink_rate is not None:
-            if blink_rate < LOW_BLINK_RATE_THRESHOLD:
-                if low_blink_since is None:
-                    low_blink_since = now
-
-                low_duration = now - low_blink_since
-
-                if (not low_blink_prolonged_active and
-                        low_duration >= LOW_BLINK_PROLONGED_THRESHOLD_SEC):
-                    low_blink_prolonged_active = True
-
-                    await general_manager.broadcast({
-                        "type": "blink_warning",
-                        "status": "prolonged_low_rate",
-                        "blink_rate_per_min": blink_rate,
-                        "low_duration_sec": int(low_duration),
-                    })
-            else:
-                # Blink rate back to normal
-                if low_blink_prolonged_active:
-                    low_blink_prolonged_active = False
-                    low_blink_since = None
-
-                    await general_manager.broadcast({
-                        "type": "blink_resolved",
-                        "status": "back_to_normal",
-                        "blink_rate_per_min": blink_rate,
-                    })
-                else:
-                    low_blink_since = None
-        else:
-            # No reliable face / blink measurement -> clear any active low-blink state
-            if low_blink_prolonged_active:
-                low_blink_prolonged_active = False
-                low_blink_since = None
-
-                await general_manager.broadcast({
-                    "type": "blink_resolved",
-                    "status": "face_not_visible",
-                })
-            else:
-                low_blink_since = None
-
-        # yield to event loop (important!)
-        await asyncio.sleep(0)
+        if ran_face:
+            EAR = ctx.values["ear"]
+            blinked = tracker.update_blink(now, EAR)
+            self.scheduler.update_blink(EAR)
+            if blinked and store is not None:
+                store.record_event(now, "blink")
+
+        # ---------- PROLONGED POSTURE / LOW BLINK RATE -> WEBSOCKET EVENTS ----------
+        # publish() hands events to the server loop and never blocks us
+        for event in tracker.step(now):
+            self.manager.publish(event)
+            if store is not None:
+                store.record_event(now, event["type"], event)
+
+        # ---------- SESSION HISTORY ----------
+        # Scores/EAR only when produced this frame (a throttled model's column
+        # is NULL); bad/face are the tracker's current state.
+        # record_sample() just queues the row for the store's writer thread.
+        if store is not None:
+            store.record_sample(
+                now,
+                posture_score=tracker.posture_score if ran_pose else None,
+                avg_score=tracker.avg_score if ran_pose else None,
+                bad={"bad": 1, "good": 0}.get(tracker.current_posture),
+                face=int(tracker.face_visible),
+                ear=tracker.ear if ran_face else None,
+                **(self.metrics if ran_pose and self.metrics else {}),
+            )
+
+        # Raw per-frame values, only built when a client subscribed to them
+        want_json = self.manager.has_subscribers(METRICS_TYPE)
+        stream = self.stream
+        want_stream = stream is not None and self.manager.has_subscribers(METRICS_STREAM_TYPE)
+        if want_json or want_stream:
+            values = {
+                "posture": tracker.current_posture,
+                "posture_score": tracker.posture_score,
+                "avg_score": tracker.avg_score,
+                "ear": tracker.ear,
+                "blink_rate_per_min": tracker.blink_rate,
+                **(self.metrics or {}),
+            }
+            if want_json:
+                self.manager.publish({"type": METRICS_TYPE, "ts": now, **values})
+            if want_stream:
+                batch = stream.add(now, values)
+                if batch is not None:
+                    self.manager.publish_binary(METRICS_STREAM_TYPE, batch)
+        if not want_stream and stream is not None and stream.active:
+            stream.reset()   # nobody listening: the next subscriber starts on a keyframe
+
+
+def default_source(width, height):
+    return FrameGrabber(0, width=width, height=height)
+
+
+async def main_backend(
+    recording_flag,
+    general_manager,
+    scheduler=None,
+    idle_release_sec=30.0,
+    store=None,
+    face_roi=False,
+    tuner=None,
+    metrics=None,
+    source_factory=None,
+    process_inference=False,
+    stream=None,
+):
+    print("combined monitor started")
 
-    cap.release()
\ No newline at end of file
+    # ---- INFERENCE SCHEDULER ----
+    if scheduler is None:
+        scheduler = AdaptiveScheduler()
+
+    # ---- RUNTIME SETTINGS ----
+    # Pose complexity and capture resolution; AutoTuner moves them to fit
+    # the frame budget, otherwise they stay at its default level.
+    if tuner is None:
+        tuner = AutoTuner(enabled=False)
+
+    # ---- CAMERA + MEDIAPIPE SETUP ----
+    # Capture runs on its own thread; we only ever see the newest frame.
+    # `source_factory(width, height)` swaps the webcam for another source
+    # (e.g. capture.ReplaySource for load tests).
+    # Each analyzer's graph is persistent on its own worker thread and all
+    # of them run on the same frame concurrently. Only the stages the
+    # session asked for are loaded (see /start). With `process_inference`
+    # each graph runs in its own process instead, reading the frames from
+    # shared memory (see inference.ProcessInference).
+    settings = tuner.settings
+    active_stages = recording_flag.stages
+    pipeline = Pipeline(
+        stage_analyzers(active_stages, face_roi, settings["pose_complexity"]),
+        source=(source_factory or default_source)(settings["width"], settings["height"]),
+        scheduler=scheduler,
+        inference_factory=ProcessInference if process_inference else ParallelInference,
+    )
+    try:
+        await pipeline.open_async()
+    except BaseException:
+        # camera missing, or the session was closed while starting
+        pipeline.close()
+        raise
+
+    # ---- SCORING + PROLONGED STATE ----
+    # smoothing, blink state machine and warning/resolved events; raw
+    # metrics go out as JSON and/or `stream` batches (binary, batched, deltas)
+    if stream is None:
+        stream = MetricsStreamEncoder()
+    tracker = SessionTracker()
+    sink = SessionSink(tracker, scheduler, general_manager, store, stream)
+    pipeline.sinks.append(sink)
+    tuner.attach(pipeline)
+
+    # ---- INSTRUMENTATION ----
+    # per-stage histograms for /metrics; without it nothing is timed
+    if metrics is not None:
+        metrics.attach(pipeline)
+
+    # Cancelling the task (session closed) releases the camera and graphs.
+    try:
+        while True:
+            # ---------- PAUSE HANDLING ----------
+            # Event-driven: wakes the moment /start flips the state. After
+            # `idle_release_sec` paused, the camera and the graphs are released
+            # so a paused app costs (almost) nothing; resume reopens both at once.
+            if not recording_flag.recording:
+                resumed = await recording_flag.wait_for(True, timeout=idle_release_sec)
+                if not resumed and pipeline.is_open:
+                    print("paused: releasing camera and models")
+                    pipeline.close()
+                    await recording_flag.wait_for(True)
+
+            # ---------- STAGE CHANGES ----------
+            # Stages can be added/removed mid-session; only the graphs change.
+            stages = recording_flag.stages
+            if stages != active_stages:
+                analyzers = stage_analyzers(stages, face_roi, tuner.settings["pose_complexity"])
+                removed = await pipeline.set_analyzers(analyzers)
+                for model in removed:
+                    sink.stage_removed(model, time.time())
+                active_stages = stages
+                print(f"pipeline stages: {sorted(stages)}")
+
+            if not pipeline.is_open:
+                await pipeline.open_async()
+                print("resumed: camera and models ready")
+
+            # read -> mirror/RGB -> due models in parallel -> analyzers -> sinks
+            await pipeline.step()
+
+            # ---------- AUTOTUNE ----------
+            # a pending complexity/resolution switch from the last window
+            await tuner.apply()
+
+            # yield to event loop (important!)
+            await asyncio.sleep(0)
+    finally:
+        pipeline.close()
@@ -0,0 +1,339 @@
+"""
+Offline analysis of recorded sessions.
+
+Runs the posture and blink pipelines over video files or directories of
+frames as fast as the machine allows (no real-time pacing) and writes
+per-frame metrics to a columnar .npz file, one array per column:
+
+    python -m src.offline session.mp4 frames_dir/ -o metrics.npz --workers 8
+
+With --landmarks DIR the raw pose and eye landmarks are also cached per
+source (see src.landmark_store) so scoring changes can be checked with
+src.replay without running MediaPipe again.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from src.blink_engine import EAR_CONSEC_FRAMES, EAR_THRESHOLD, EYE_LANDMARKS, EYE_LANDMARKS_MIRRORED, BlinkAnalyzer
+from src.capture import IMAGE_EXTENSIONS
+from src.landmark_store import EYES_SHAPE, POSE_SHAPE, LandmarkWriter
+from src.pipeline import Pipeline, Preprocess
+from src.posture_engine import POSE_MIRROR_ORDER, PostureAnalyzer
+from src.utils import mirror_x, normalized_landmarks
+
+METRIC_COLUMNS = ("back_angle", "neck_angle", "head_forward_cm", "shoulder_tilt_deg")
+
+
+# ---------------------------
+# INPUT DISCOVERY / CHUNKING
+# ---------------------------
+def list_images(directory):
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def plan_tasks(paths, chunk_frames=900, fps=30.0):
+    """
+    Split every input into chunks of at most `chunk_frames` frames. Returns
+    (sources, tasks); each task is a picklable tuple handed to one worker.
+    """
+    sources = []
+    tasks = []
+    for source_id, path in enumerate(paths):
+        if os.path.isdir(path):
+            images = list_images(path)
+            sources.append({"path": path, "fps": fps, "frames": len(images)})
+            for start in range(0, len(images), chunk_frames):
+                tasks.append(("images", source_id, start, images[start:start + chunk_frames], fps))
+        else:
+            cap = cv2.VideoCapture(path)
+            if not cap.isOpened():
+                raise ValueError(f"cannot open video: {path}")
+            n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            video_fps = cap.get(cv2.CAP_PROP_FPS)
+            cap.release()
+            if video_fps <= 0 or video_fps > 120:
+                video_fps = fps
+            sources.append({"path": path, "fps": video_fps, "frames": n})
+            if n <= 0:
+                # unknown length (some containers): one task reads to the end
+                tasks.append(("video", source_id, 0, (path, None), video_fps))
+                continue
+            for start in range(0, n, chunk_frames):
+                tasks.append(("video", source_id, start, (path, chunk_frames), video_fps))
+    return sources, tasks
+
+
+def _iter_frames(kind, start, payload):
+    if kind == "images":
+        for path in payload:
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield frame
+        return
+
+    # Seeking by CAP_PROP_POS_FRAMES is not exact for every codec/container
+    # (some land on the nearest keyframe), so a chunk of a video can start a
+    # few frames off; image directories are always exact.
+    path, count = payload
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    try:
+        read = 0
+        while count is None or read < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            read += 1
+            yield frame
+    finally:
+        cap.release()
+
+
+# ---------------------------
+# WORKER PROCESS
+# ---------------------------
+def _init_worker():
+    cv2.setNumThreads(1)
+
+
+def _stored_landmarks(ctx, landmarks, fields, indices, mirrored_indices):
+    # the store always holds the mirrored view the live scoring sees
+    if not ctx.mirror_landmarks:
+        return normalized_landmarks(landmarks, fields, indices=indices)
+    return mirror_x(normalized_landmarks(landmarks, fields, indices=mirrored_indices))
+
+
+def analyze_chunk(task, mirror=True, keep_landmarks=False):
+    """
+    Run both models over one chunk. Returns (columns, landmarks): the
+    per-frame metric columns and, with keep_landmarks, the normalized pose
+    (n, 33, 4) and eye (n, 12, 3) landmarks plus the frame size.
+    """
+    kind, source_id, start, payload, fps = task
+
+    rows = {name: [] for name in ("frame", "pose_detected", "score", "face_detected", "ear") + METRIC_COLUMNS}
+    pose_records = []
+    eye_records = []
+    size = None
+
+    # Fresh Pose/FaceMesh graphs for every chunk: they run in tracking mode,
+    # and state left over from whatever chunk (or source) this worker ran
+    # before would make the results depend on the scheduling. Mirrored like
+    # the live pipeline, which mirrors the camera image.
+    pipeline = Pipeline([PostureAnalyzer(), BlinkAnalyzer()], preprocess=Preprocess(mirror=mirror)).open()
+    try:
+        for i, frame in enumerate(_iter_frames(kind, start, payload)):
+            ctx = pipeline.process(frame, seq=start + i, ts=(start + i) / fps)
+            values = ctx.values
+            size = (ctx.width, ctx.height)
+
+            rows["frame"].append(start + i)
+
+            if values["pose_detected"]:
+                metrics = values["metrics"]
+                rows["pose_detected"].append(True)
+                rows["score"].append(values["posture_score"])
+                if keep_landmarks:
+                    pose_records.append(_stored_landmarks(
+                        ctx, ctx.results["pose"].pose_landmarks.landmark, ("x", "y", "z", "visibility"),
+                        None, POSE_MIRROR_ORDER,
+                    ))
+                for name in METRIC_COLUMNS:
+                    rows[name].append(metrics[name])
+            else:
+                rows["pose_detected"].append(False)
+                rows["score"].append(np.nan)
+                if keep_landmarks:
+                    pose_records.append(np.full(POSE_SHAPE, np.nan, dtype=np.float32))
+                for name in METRIC_COLUMNS:
+                    rows[name].append(np.nan)
+
+            if values["face_detected"]:
+                rows["face_detected"].append(True)
+                rows["ear"].append(values["ear"])
+                if keep_landmarks:
+                    face = ctx.results["face"].multi_face_landmarks[0].landmark
+                    eye_records.append(_stored_landmarks(
+                        ctx, face, ("x", "y", "z"), EYE_LANDMARKS, EYE_LANDMARKS_MIRRORED,
+                    ))
+            else:
+                rows["face_detected"].append(False)
+                rows["ear"].append(np.nan)
+                if keep_landmarks:
+                    eye_records.append(np.full(EYES_SHAPE, np.nan, dtype=np.float32))
+    finally:
+        pipeline.close()
+
+    columns = {
+        "frame": np.asarray(rows["frame"], dtype=np.int64),
+        "pose_detected": np.asarray(rows["pose_detected"], dtype=bool),
+        "face_detected": np.asarray(rows["face_detected"], dtype=bool),
+    }
+    for name in ("score", "ear") + METRIC_COLUMNS:
+        columns[name] = np.asarray(rows[name], dtype=np.float32)
+    columns["source"] = np.full(len(rows["frame"]), source_id, dtype=np.int32)
+    columns["timestamp"] = columns["frame"] / fps
+
+    landmarks = None
+    if keep_landmarks:
+        n = len(rows["frame"])
+        landmarks = {
+            "pose": np.stack(pose_records) if n else np.empty((0,) + POSE_SHAPE, dtype=np.float32),
+            "eyes": np.stack(eye_records) if n else np.empty((0,) + EYES_SHAPE, dtype=np.float32),
+            "size": size,
+        }
+    return columns, landmarks
+
+
+# ---------------------------
+# SEQUENTIAL POST-PROCESSING
+# ---------------------------
+def detect_blinks(ear, ear_threshold=EAR_THRESHOLD, consec_frames=EAR_CONSEC_FRAMES):
+    """
+    Replay the live blink state machine over one source's EAR column.
+    Returns a bool column that is True on the frame a blink is counted.
+    Frames without a face (NaN) leave the state untouched, like the live loop.
+    """
+    blinks = np.zeros(len(ear), dtype=bool)
+    frame_counter = 0
+    for i, value in enumerate(ear.tolist()):
+        if value != value:  # NaN -> no face
+            continue
+        if value < ear_threshold:
+            frame_counter += 1
+        else:
+            if frame_counter >= consec_frames:
+                blinks[i] = True
+            frame_counter = 0
+    return blinks
+
+
+def smooth_scores(score, timestamps, window_seconds):
+    """
+    Trailing mean of the posture score over the detected frames of the
+    last `window_seconds`, as the live SessionTracker smooths it
+    (stats.TimeWindowStats: frames in (t - window_seconds, t]).
+    """
+    avg = np.full(len(score), np.nan, dtype=np.float32)
+    detected = ~np.isnan(score)
+    values = score[detected].astype(np.float64)
+    if len(values) == 0:
+        return avg
+    t = np.asarray(timestamps, dtype=np.float64)[detected]
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    idx = np.arange(1, len(values) + 1)
+    lo = np.searchsorted(t, t - window_seconds, side="right")
+    avg[detected] = (csum[idx] - csum[lo]) / (idx - lo)
+    return avg
+
+
+def write_landmark_stores(directory, sources, tasks, chunks, landmarks):
+    """Write one landmark store per source, as DIR/source_<id>."""
+    for source_id, source in enumerate(sources):
+        parts = [
+            (columns, lm)
+            for task, columns, lm in zip(tasks, chunks, landmarks)
+            if task[1] == source_id and lm["size"] is not None
+        ]
+        if not parts:
+            continue
+        width, height = parts[0][1]["size"]
+        store_dir = os.path.join(directory, f"source_{source_id}")
+        with LandmarkWriter(store_dir, width, height, source["fps"]) as writer:
+            for columns, lm in parts:
+                writer.append_batch(
+                    columns["timestamp"], lm["pose"], lm["eyes"],
+                    columns["pose_detected"], columns["face_detected"],
+                )
+
+
+def analyze(paths, out_path, workers=None, chunk_frames=900, fps=30.0,
+            ear_threshold=EAR_THRESHOLD, window_seconds=3, mirror=True,
+            landmarks_dir=None):
+    """
+    Analyze every input in `paths` across a process pool and write the
+    merged per-frame columns to `out_path` (.npz). With `landmarks_dir`, the
+    raw landmarks are cached for replay as well. Returns a summary dict.
+    """
+    t0 = time.perf_counter()
+    sources, tasks = plan_tasks(paths, chunk_frames=chunk_frames, fps=fps)
+    keep_landmarks = landmarks_dir is not None
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        results = list(pool.map(
+            analyze_chunk, tasks, [mirror] * len(tasks), [keep_landmarks] * len(tasks)
+        ))
+    chunks = [columns for columns, _ in results]
+
+    if keep_landmarks:
+        write_landmark_stores(landmarks_dir, sources, tasks, chunks, [lm for _, lm in results])
+
+    names = chunks[0].keys() if chunks else ()
+    columns = {name: np.concatenate([c[name] for c in chunks]) for name in names}
+
+    # Blink detection and smoothing depend on frame order, so they run per
+    # source on the merged columns instead of inside the chunks.
+    if chunks:
+        columns["blink"] = np.zeros(len(columns["frame"]), dtype=bool)
+        columns["avg_score"] = np.full(len(columns["frame"]), np.nan, dtype=np.float32)
+        for source_id, source in enumerate(sources):
+            mask = columns["source"] == source_id
+            columns["blink"][mask] = detect_blinks(columns["ear"][mask], ear_threshold)
+            columns["avg_score"][mask] = smooth_scores(
+                columns["score"][mask], columns["timestamp"][mask], window_seconds
+            )
+
+    columns["source_paths"] = np.array([s["path"] for s in sources])
+    np.savez(out_path, **columns)
+
+    elapsed = time.perf_counter() - t0
+    n_frames = len(columns.get("frame", ()))
+    return {
+        "sources": len(sources),
+        "chunks": len(tasks),
+        "frames": n_frames,
+        "elapsed_sec": elapsed,
+        "frames_per_sec": n_frames / elapsed if elapsed > 0 else 0.0,
+        "output": out_path,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline posture/blink analysis of recorded sessions.")
+    parser.add_argument("inputs", nargs="+", help="video files or directories of frames")
+    parser.add_argument("-o", "--output", default="metrics.npz", help="columnar output file (.npz)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-frames", type=int, default=900, help="frames per worker task")
+    parser.add_argument("--fps", type=float, default=30.0, help="frame rate for image directories")
+    parser.add_argument("--ear-threshold", type=float, default=EAR_THRESHOLD)
+    parser.add_argument("--no-mirror", action="store_true", help="do not flip frames like the live camera")
+    parser.add_argument("--landmarks", default=None, help="also cache raw landmarks here for src.replay")
+    args = parser.parse_args(argv)
+
+    summary = analyze(
+        args.inputs,
+        args.output,
+        workers=args.workers,
+        chunk_frames=args.chunk_frames,
+        fps=args.fps,
+        ear_threshold=args.ear_threshold,
+        mirror=not args.no_mirror,
+        landmarks_dir=args.landmarks,
+    )
+    print(
+        f"{summary['frames']} frames from {summary['sources']} source(s) in "
+        f"{summary['elapsed_sec']:.1f}s ({summary['frames_per_sec']:.0f} fps) -> {summary['output']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
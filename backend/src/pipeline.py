@@ -0,0 +1,321 @@
+import asyncio
+import time
+
+import cv2
+
+from src.inference import ParallelInference
+
+
+class FrameContext:
+    """
+    Everything the stages know about one frame. `results` holds the raw
+    MediaPipe output of the models that ran this frame; analyzers add their
+    values (posture_score, ear, ...) to `values`, sinks read both.
+    """
+
+    __slots__ = ("seq", "ts", "started", "frame", "rgb", "width", "height", "mirror_landmarks", "results", "values")
+
+    def __init__(self, seq, ts, frame, rgb, mirror_landmarks=False, started=None):
+        self.seq = seq
+        self.ts = ts
+        self.started = started   # perf_counter() when processing began
+        self.frame = frame   # preprocessed BGR (flipped only with flip_pixels)
+        self.rgb = rgb
+        # True: the models saw the unflipped frame, so analyzers mirror the
+        # landmarks (x -> w - x, left <-> right) to get the mirrored view
+        self.mirror_landmarks = mirror_landmarks
+        self.height, self.width = frame.shape[:2]
+        self.results = {}
+        self.values = {}
+
+
+class Preprocess:
+    """
+    BGR->RGB conversion into a buffer reused across frames (cv2 `dst`), so
+    steady-state preprocessing allocates nothing. The returned arrays are
+    only valid until the next call.
+
+    `mirror` asks for the selfie view the app reports in. Only the debug
+    tools that display the frame need the pixels flipped (`flip_pixels`);
+    everywhere else the flip is skipped and the analyzers mirror the
+    landmark coordinates instead, which saves a full-frame copy.
+    """
+
+    def __init__(self, mirror=True, flip_pixels=False):
+        self.mirror = mirror
+        self.flip_pixels = flip_pixels
+        self._bgr = None
+        self._rgb = None
+
+    @property
+    def mirror_landmarks(self):
+        return self.mirror and not self.flip_pixels
+
+    def __call__(self, frame, rgb_out=None):
+        # rgb_out: buffer to convert into instead of our own (e.g. a shared
+        # memory slot from ProcessInference.acquire)
+        if self.mirror and self.flip_pixels:
+            if self._bgr is None or self._bgr.shape != frame.shape:
+                self._bgr = cv2.flip(frame, 1)
+            else:
+                cv2.flip(frame, 1, dst=self._bgr)
+            frame = self._bgr
+
+        if rgb_out is not None:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb_out)
+            return frame, rgb_out
+        if self._rgb is None or self._rgb.shape != frame.shape:
+            self._rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        return frame, self._rgb
+
+
+class Pipeline:
+    """
+    source -> preprocess -> inference -> analyzers -> sinks.
+
+    - source: anything with start()/stop()/read()/read_async() returning
+      (seq, frame), e.g. FrameGrabber. Optional: offline callers push frames
+      through process() themselves.
+    - preprocess: Preprocess() by default (mirrored view, pixels unflipped).
+    - analyzers: objects with `model` (name), `factory` (builds the graph)
+      and analyze(ctx). Each one owns one model, so the set of analyzers
+      decides which graphs are loaded; they all run in parallel. Optional
+      hooks: model_input(ctx) returns the image to run on instead of the
+      full frame (e.g. a crop), fallback(ctx), called after the run,
+      returns an image to run the model again on (or None), and `settings`
+      (graph options; set_analyzers reloads the graph when they change).
+    - scheduler: optional AdaptiveScheduler-like object (due/record_run)
+      that skips models on frames where they are not needed.
+    - sinks: callables sink(ctx) run after the analyzers, in order.
+    - metrics: optional PipelineMetrics (see PipelineMetrics.attach); when
+      set, every stage is timed into its histograms.
+    - inference_factory: ParallelInference (a thread per model) or
+      ProcessInference (a process per model, frames in shared memory).
+
+    The camera, the graphs, the reused buffers and the frame skipping live
+    here once, for the GUI debug tools, the WebSocket backend and offline
+    runs alike.
+    """
+
+    def __init__(self, analyzers, source=None, preprocess=None, scheduler=None, sinks=(), inference_factory=ParallelInference):
+        self.analyzers = {a.model: a for a in analyzers}
+        self.inference_factory = inference_factory
+        self.source = source
+        self.preprocess = preprocess or Preprocess()
+        self.scheduler = scheduler
+        self.sinks = list(sinks)
+        self.inference = None
+        self.metrics = None
+
+        # ---- COUNTERS ----
+        self.frames = 0     # frames read from the source
+        self.skipped = 0    # frames on which no model was due
+
+    @property
+    def is_open(self):
+        return self.inference is not None
+
+    # ----------------- Lifecycle -----------------
+    def open(self):
+        if self.source is not None:
+            self.source.start()
+        self.inference = self.inference_factory(self._factories(self.analyzers))
+        return self
+
+    async def open_async(self):
+        """Open the source and load every graph concurrently (cold start / resume)."""
+        factories = self._factories(self.analyzers)
+        if self.source is None:
+            self.inference = await asyncio.to_thread(self.inference_factory, factories)
+        else:
+            _, self.inference = await asyncio.gather(
+                asyncio.to_thread(self.source.start),
+                asyncio.to_thread(self.inference_factory, factories),
+            )
+        return self
+
+    def close(self):
+        if self.inference is not None:
+            self.inference.close()
+            self.inference = None
+        if self.source is not None:
+            self.source.stop()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def set_analyzers(self, analyzers):
+        """
+        Swap the analyzer set while running: only graphs that are added,
+        removed or whose `settings` changed are loaded/closed, the source
+        keeps running. Returns the names of the removed models.
+        """
+        wanted = {a.model: a for a in analyzers}
+        removed = [name for name in self.analyzers if name not in wanted]
+        reload = [
+            name for name, a in wanted.items()
+            if name in self.analyzers
+            and getattr(a, "settings", None) != getattr(self.analyzers[name], "settings", None)
+        ]
+        self.analyzers = wanted
+        if self.inference is not None:
+            for name in removed + reload:
+                await asyncio.to_thread(self.inference.remove, name)
+            for name, factory in self._factories(wanted).items():
+                if name not in self.inference.workers:
+                    await asyncio.to_thread(self.inference.add, name, factory)
+        return removed
+
+    @staticmethod
+    def _factories(analyzers):
+        return {name: a.factory for name, a in analyzers.items()}
+
+    # ----------------- Per-frame processing -----------------
+    def _due(self, now):
+        if self.scheduler is None:
+            return None
+        return self.scheduler.due(now, only=self.inference.workers)
+
+    def _prepare(self, seq, ts, frame):
+        started = time.perf_counter()
+        # models in other processes read the RGB frame from shared memory
+        acquire = getattr(self.inference, "acquire", None)
+        frame, rgb = self.preprocess(frame, acquire(frame.shape) if acquire is not None else None)
+        if self.metrics is not None:
+            self.metrics.observe("preprocess", time.perf_counter() - started)
+        return FrameContext(seq, ts, frame, rgb, self.preprocess.mirror_landmarks, started)
+
+    def _model_inputs(self, ctx, only):
+        inputs = {}
+        for name, analyzer in self.analyzers.items():
+            if (only is None or name in only) and hasattr(analyzer, "model_input"):
+                image = analyzer.model_input(ctx)
+                if image is not None:
+                    inputs[name] = image
+        return inputs
+
+    def _record(self, ctx, results, t0):
+        ctx.results = results
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.observe("inference", time.perf_counter() - t0)
+            for name in results:
+                metrics.observe(_stage("model", name), self.inference.latency(name))
+        if self.scheduler is not None:
+            for name in results:
+                self.scheduler.record_run(name, ctx.ts, self.inference.latency(name))
+
+    def _fallbacks(self, ctx):
+        retry = {}
+        for name, analyzer in self.analyzers.items():
+            if name in ctx.results and hasattr(analyzer, "fallback"):
+                image = analyzer.fallback(ctx)
+                if image is not None:
+                    retry[name] = image
+        return retry
+
+    def _finish(self, ctx):
+        if self.metrics is not None:
+            return self._finish_timed(ctx)
+        for name, analyzer in self.analyzers.items():
+            if name in ctx.results:
+                analyzer.analyze(ctx)
+        for sink in self.sinks:
+            sink(ctx)
+        return ctx
+
+    def _finish_timed(self, ctx):
+        metrics, clock = self.metrics, time.perf_counter
+        for name, analyzer in self.analyzers.items():
+            if name in ctx.results:
+                t0 = clock()
+                analyzer.analyze(ctx)
+                metrics.observe(_stage("analyze", name), clock() - t0)
+        for sink in self.sinks:
+            t0 = clock()
+            sink(ctx)
+            metrics.observe(_stage("sink", getattr(sink, "name", None) or getattr(sink, "__name__", type(sink).__name__)), clock() - t0)
+        end = clock()
+        metrics.observe("frame", end - ctx.started)
+        metrics.frame_done(end)
+        return ctx
+
+    def process(self, frame, seq=None, ts=None, only=None):
+        """Run one frame through every stage (blocking)."""
+        ts = time.time() if ts is None else ts
+        ctx = self._prepare(seq, ts, frame)
+        inputs = self._model_inputs(ctx, only)
+        t0 = time.perf_counter()
+        self._record(ctx, self.inference.process(ctx.rgb, only, inputs), t0)
+        retry = self._fallbacks(ctx)
+        if retry:
+            ctx.results.update(self.inference.process(None, retry, retry))
+        return self._finish(ctx)
+
+    async def process_async(self, frame, seq=None, ts=None, only=None):
+        ts = time.time() if ts is None else ts
+        ctx = self._prepare(seq, ts, frame)
+        inputs = self._model_inputs(ctx, only)
+        t0 = time.perf_counter()
+        self._record(ctx, await self.inference.process_async(ctx.rgb, only, inputs), t0)
+        retry = self._fallbacks(ctx)
+        if retry:
+            ctx.results.update(await self.inference.process_async(None, retry, retry))
+        return self._finish(ctx)
+
+    async def step(self):
+        """
+        Read the newest frame from the source and process it. Returns the
+        FrameContext, or None when no frame arrived or no model was due.
+        """
+        t0 = time.perf_counter()
+        seq, frame = await self.source.read_async()
+        if frame is None:
+            return None
+        if self.metrics is not None:
+            self.metrics.observe("read_wait", time.perf_counter() - t0)
+        self.frames += 1
+
+        # Models that are not due this frame keep their previous result.
+        now = time.time()
+        due = self._due(now)
+        if due is not None and not due:
+            self.skipped += 1
+            return None
+        return await self.process_async(frame, seq, now, due)
+
+    def run(self, keep_going=None):
+        """
+        Blocking loop for the GUI debug tools: runs until the source stops
+        delivering frames or `keep_going(ctx)` returns False.
+        """
+        while True:
+            seq, frame = self.source.read(timeout=1.0)
+            if frame is None:
+                break
+            self.frames += 1
+            now = time.time()
+            due = self._due(now)
+            if due is not None and not due:
+                self.skipped += 1
+                continue
+            ctx = self.process(frame, seq, now, due)
+            if keep_going is not None and not keep_going(ctx):
+                break
+
+
+_STAGE_NAMES = {"model": {}, "analyze": {}, "sink": {}}
+
+
+def _stage(kind, name):
+    # "analyze.pose" etc., built once per name instead of once per frame
+    names = _STAGE_NAMES[kind]
+    stage = names.get(name)
+    if stage is None:
+        stage = names[name] = f"{kind}.{name}"
+    return stage
@@ -1,18 +1,43 @@
-import asyncio
-import random
+import functools
+import math
 import cv2
 import mediapipe as mp
 import numpy as np
-from collections import deque
-from src.utils import wait_for_unpause
-import time
+from src.capture import FrameGrabber
+from src.pipeline import Pipeline, Preprocess
+from src.stats import RollingStats
+from src.utils import wait_for_unpause, landmarks_to_array, mirror_x
 
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
-def get_point(landmarks, idx, w, h):
-    lm = landmarks[idx]
-    return np.array([lm.x * w, lm.y * h, lm.z * w])  # scale z ~ width
+def create_pose(model_complexity=1):
+    return mp_pose.Pose(
+        static_image_mode=False,
+        model_complexity=model_complexity,  # 0,1,2 (higher = more accurate, slower)
+        enable_segmentation=False,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5,
+    )
+
+
+# Rows of the (33, 3) pose array from utils.landmarks_to_array
+NOSE = mp_pose.PoseLandmark.NOSE.value
+SHOULDERS = slice(mp_pose.PoseLandmark.LEFT_SHOULDER.value, mp_pose.PoseLandmark.RIGHT_SHOULDER.value + 1)
+HIPS = slice(mp_pose.PoseLandmark.LEFT_HIP.value, mp_pose.PoseLandmark.RIGHT_HIP.value + 1)
+
+
+def _mirror_name(name):
+    if name.startswith("LEFT_"):
+        return "RIGHT_" + name[5:]
+    if name.startswith("RIGHT_"):
+        return "LEFT_" + name[6:]
+    return name
+
+
+# Row k of a mirrored pose is landmark POSE_MIRROR_ORDER[k] of the unflipped
+# frame: on a mirrored image the model labels the person's left as right.
+POSE_MIRROR_ORDER = [mp_pose.PoseLandmark[_mirror_name(lm.name)].value for lm in mp_pose.PoseLandmark]
 
 
 def angle_with_vertical(p1, p2):
@@ -20,14 +45,15 @@ def angle_with_vertical(p1, p2):
     Angle (in degrees) between vector p2->p1 and the vertical axis.
     0° = perfectly vertical, larger = more slouched/tilted.
     """
-    v = p1 - p2
-    # vertical direction: (0, -1, 0) in image coordinates (y down)
-    vertical = np.array([0, -1, 0], dtype=np.float32)
-    v_norm = np.linalg.norm(v)
+    vx = p1[0] - p2[0]
+    vy = p1[1] - p2[1]
+    vz = p1[2] - p2[2]
+    v_norm = math.sqrt(vx * vx + vy * vy + vz * vz)
     if v_norm < 1e-6:
         return 0.0
-    v_unit = v / v_norm
-    dot = np.clip(np.dot(v_unit, vertical), -1.0, 1.0)
+    # vertical direction: (0, -1, 0) in image coordinates (y down),
+    # so the dot product with the unit vector is just -v_y / |v|
+    dot = min(max(-vy / v_norm, -1.0), 1.0)
     angle_rad = np.arccos(dot)
     return np.degrees(angle_rad)
 
@@ -36,30 +62,35 @@ def euclidean_distance(p1, p2):
     return float(np.linalg.norm(p1 - p2))
 
 
-def compute_posture_metrics(landmarks, w, h):
-    # Key points
-    L_SH = get_point(landmarks, mp.solutions.pose.PoseLandmark.LEFT_SHOULDER, w, h)
-    R_SH = get_point(landmarks, mp.solutions.pose.PoseLandmark.RIGHT_SHOULDER, w, h)
-    L_HIP = get_point(landmarks, mp.solutions.pose.PoseLandmark.LEFT_HIP, w, h)
-    R_HIP = get_point(landmarks, mp.solutions.pose.PoseLandmark.RIGHT_HIP, w, h)
-    NOSE = get_point(landmarks, mp.solutions.pose.PoseLandmark.NOSE, w, h)
+def compute_posture_metrics(points):
+    """
+    `points` is the (33, 3) pixel-space pose array for one frame
+    (see utils.landmarks_to_array). Each key point is read once as a row
+    slice; the rest is scalar math, so no temporary arrays are created.
+    """
+    L_SH, R_SH = points[SHOULDERS].tolist()
+    L_HIP, R_HIP = points[HIPS].tolist()
+    NOSE_PT = points[NOSE].tolist()
 
     # Midpoints
-    MID_SH = 0.5 * (L_SH + R_SH)
-    MID_HIP = 0.5 * (L_HIP + R_HIP)
+    MID_SH = [0.5 * (l + r) for l, r in zip(L_SH, R_SH)]
+    MID_HIP = [0.5 * (l + r) for l, r in zip(L_HIP, R_HIP)]
 
     # 1) Back angle: shoulder-to-hip line vs vertical
     back_angle = angle_with_vertical(MID_SH, MID_HIP)  # larger = more leaning
 
     # 2) Neck angle: head-to-shoulder line vs vertical
-    neck_angle = angle_with_vertical(NOSE, MID_SH)      # larger = more forward neck
+    neck_angle = angle_with_vertical(NOSE_PT, MID_SH)   # larger = more forward neck
 
     # 3) Head forward distance (how far nose is in front of shoulders in z or x)
     # Option A: use x-offset (nose left/right vs shoulders) — but not ideal.
     # Option B: use z difference (depth) — more robust.
-    head_forward_raw = NOSE[2] - MID_SH[2]  # positive = closer to camera
+    head_forward_raw = NOSE_PT[2] - MID_SH[2]  # positive = closer to camera
     # Convert to "cm-ish": scale relative to shoulder width
-    shoulder_width_px = euclidean_distance(L_SH, R_SH)
+    # (spelled out rather than math.dist, whose rounding numpy cannot
+    # reproduce, so compute_posture_metrics_batch matches exactly)
+    dx, dy, dz = L_SH[0] - R_SH[0], L_SH[1] - R_SH[1], L_SH[2] - R_SH[2]
+    shoulder_width_px = math.sqrt(dx * dx + dy * dy + dz * dz)
     if shoulder_width_px < 1e-6:
         shoulder_width_px = 1.0
     head_forward_cm = (head_forward_raw / shoulder_width_px) * 30.0  # 30 cm ≈ 1 shoulder-width
@@ -77,82 +108,161 @@ def compute_posture_metrics(landmarks, w, h):
     }
 
 
-def compute_bad_posture_score(metrics):
-    back = metrics["back_angle"]
-    neck = metrics["neck_angle"]
-    head_fwd = metrics["head_forward_cm"]
-    tilt = abs(metrics["shoulder_tilt_deg"])
+def compute_posture_metrics_batch(points):
+    """
+    compute_posture_metrics over N frames at once: `points` is an
+    (N, 33, 3) pixel-space pose array, the result a dict of (N,) float64
+    arrays. The same float64 operations run in the same order as the
+    per-frame function, so every value is identical to it.
+    """
+    points = np.asarray(points)
+    L_SH = points[:, SHOULDERS.start].astype(np.float64)
+    R_SH = points[:, SHOULDERS.stop - 1].astype(np.float64)
+    L_HIP = points[:, HIPS.start].astype(np.float64)
+    R_HIP = points[:, HIPS.stop - 1].astype(np.float64)
+    NOSE_PT = points[:, NOSE].astype(np.float64)
 
-    # Normalize each into [0,1] “badness” scores using piecewise linear functions.
-    def norm_bad(x, good_max, bad_max):
-        # 0 if x <= good_max, 1 if x >= bad_max, linear in between
+    MID_SH = 0.5 * (L_SH + R_SH)
+    MID_HIP = 0.5 * (L_HIP + R_HIP)
+
+    head_forward_raw = NOSE_PT[:, 2] - MID_SH[:, 2]
+    d = L_SH - R_SH
+    shoulder_width_px = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2])
+    shoulder_width_px[shoulder_width_px < 1e-6] = 1.0
+
+    return {
+        "back_angle": _angles_with_vertical(MID_SH, MID_HIP),
+        "neck_angle": _angles_with_vertical(NOSE_PT, MID_SH),
+        "head_forward_cm": (head_forward_raw / shoulder_width_px) * 30.0,
+        "shoulder_tilt_deg": np.degrees(np.arctan2(d[:, 1], d[:, 0])),
+    }
+
+
+def _angles_with_vertical(p1, p2):
+    # angle_with_vertical, row by row
+    v = p1 - p2
+    v_norm = np.sqrt(v[:, 0] * v[:, 0] + v[:, 1] * v[:, 1] + v[:, 2] * v[:, 2])
+    upright = v_norm < 1e-6
+    dot = np.divide(-v[:, 1], v_norm, out=np.zeros_like(v_norm), where=~upright)
+    angles = np.degrees(np.arccos(np.clip(dot, -1.0, 1.0)))
+    angles[upright] = 0.0
+    return angles
+
+
+# Per metric: (good_max, bad_max) of its "badness" ramp, 0 at or below
+# good_max, 1 at or above bad_max, linear in between. Head forward and
+# shoulder tilt are ramped by magnitude.
+POSTURE_THRESHOLDS = {
+    "back_angle": (8, 20),
+    "neck_angle": (50, 80),
+    "head_forward_cm": (2, 8),
+    "shoulder_tilt_deg": (5, 20),
+}
+# Weights of the badness ramps in the score; tune them to the app's priorities.
+POSTURE_WEIGHTS = {
+    "back_angle": 0.00,
+    "neck_angle": 1.00,
+    "head_forward_cm": 0.00,
+    "shoulder_tilt_deg": 0.00,
+}
+_SIGNED_METRICS = ("head_forward_cm", "shoulder_tilt_deg")
+
+
+def compute_bad_posture_score(metrics, weights=None, thresholds=None):
+    """
+    Posture "badness" of one frame in [0, 1]: the weighted sum of every
+    metric's badness ramp (POSTURE_WEIGHTS / POSTURE_THRESHOLDS, with any
+    entries of `weights` / `thresholds` overriding them), clipped.
+    """
+    # partial overrides are merged over the defaults
+    weights = {**POSTURE_WEIGHTS, **weights} if weights else POSTURE_WEIGHTS
+    thresholds = {**POSTURE_THRESHOLDS, **thresholds} if thresholds else POSTURE_THRESHOLDS
+    score = 0.0
+    for name, (good_max, bad_max) in thresholds.items():
+        x = metrics[name]
+        if name in _SIGNED_METRICS:
+            x = abs(x)
         if x <= good_max:
-            return 0.0
-        if x >= bad_max:
-            return 1.0
-        return (x - good_max) / (bad_max - good_max)
-
-    back_bad = norm_bad(back, good_max=8, bad_max=20)
-    neck_bad = norm_bad(neck, good_max=50, bad_max=80)
-    head_bad = norm_bad(abs(head_fwd), good_max=2, bad_max=8)
-    tilt_bad = norm_bad(tilt, good_max=5, bad_max=20)
-
-    # Weighted sum; you can tune these based on your app’s priorities.
-    score = (
-        0.00 * back_bad +
-        1.00 * neck_bad +
-        0.00 * head_bad +
-        0.00 * tilt_bad
-    )
+            bad = 0.0
+        elif x >= bad_max:
+            bad = 1.0
+        else:
+            bad = (x - good_max) / (bad_max - good_max)
+        score = score + weights[name] * bad
     return float(np.clip(score, 0.0, 1.0))
 
 
-def main():
-    cap = cv2.VideoCapture(0)  # 0 = default camera
+def compute_bad_posture_score_batch(metrics, weights=None, thresholds=None):
+    """
+    compute_bad_posture_score over N frames: `metrics` maps each metric to
+    an (N,) array (see compute_posture_metrics_batch); returns the (N,)
+    float64 scores, identical to the per-frame ones.
+    """
+    # partial overrides are merged over the defaults
+    weights = {**POSTURE_WEIGHTS, **weights} if weights else POSTURE_WEIGHTS
+    thresholds = {**POSTURE_THRESHOLDS, **thresholds} if thresholds else POSTURE_THRESHOLDS
+    score = 0.0
+    for name, (good_max, bad_max) in thresholds.items():
+        x = np.asarray(metrics[name], dtype=np.float64)
+        if name in _SIGNED_METRICS:
+            x = np.abs(x)
+        # the branches of compute_bad_posture_score; NaN falls through to the ramp like there
+        with np.errstate(invalid="ignore"):
+            bad = np.where(x <= good_max, 0.0, np.where(x >= bad_max, 1.0, (x - good_max) / (bad_max - good_max)))
+        score = score + weights[name] * bad
+    return np.clip(score, 0.0, 1.0)
+
+
+class PostureAnalyzer:
+    """
+    Pipeline stage for the Pose model: landmarks -> posture metrics -> score.
+    Sets ctx.values "pose_detected", "metrics" and "posture_score" (None when
+    nobody is in frame) on frames where Pose ran. Metrics are always for the
+    mirrored view, whether the pixels or the landmarks were mirrored.
+    """
 
-    # Optional: lower resolution to reduce CPU usage
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH,  640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    model = "pose"
+
+    def __init__(self, factory=create_pose, model_complexity=1):
+        self.factory = functools.partial(factory, model_complexity=model_complexity)
+        self.settings = {"model_complexity": model_complexity}
+        self._pts = None  # reused (33, 3) landmark buffer
+
+    def analyze(self, ctx):
+        results = ctx.results[self.model]
+        if not results.pose_landmarks:
+            ctx.values.update(pose_detected=False, metrics=None, posture_score=None)
+            return
+
+        landmarks = results.pose_landmarks.landmark
+        if ctx.mirror_landmarks:
+            self._pts = landmarks_to_array(landmarks, ctx.width, ctx.height, self._pts, POSE_MIRROR_ORDER)
+            mirror_x(self._pts, ctx.width)
+        else:
+            self._pts = landmarks_to_array(landmarks, ctx.width, ctx.height, self._pts)
+        metrics = compute_posture_metrics(self._pts)
+        ctx.values.update(
+            pose_detected=True,
+            metrics=metrics,
+            posture_score=compute_bad_posture_score(metrics),
+        )
 
-    pose = mp_pose.Pose(
-        static_image_mode=False,
-        model_complexity=1,  # 0,1,2 (higher = more accurate, slower)
-        enable_segmentation=False,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5,
-    )
 
+def main():
     # For temporal smoothing
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or fps > 120:  # fallback if unknown
-        fps = 30
     window_seconds = 3
-    max_len = int(fps * window_seconds)
-    bad_history = deque(maxlen=max_len)
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    bad_history = None
 
-        # Flip horizontally so it feels like a mirror
-        frame = cv2.flip(frame, 1)
-        h, w, _ = frame.shape
-
-        # Convert to RGB for MediaPipe
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        results = pose.process(rgb)
+    def show(ctx):
+        frame = ctx.frame
+        h = ctx.height
 
         bad_posture_score = 0.0
         debug_text = "No person detected"
 
-        if results.pose_landmarks:
-            landmarks = results.pose_landmarks.landmark
-
-            # Compute posture metrics
-            metrics = compute_posture_metrics(landmarks, w, h)
-            bad_posture_score = compute_bad_posture_score(metrics)
+        if ctx.values["pose_detected"]:
+            metrics = ctx.values["metrics"]
+            bad_posture_score = ctx.values["posture_score"]
 
             debug_text = (
                 f"Back: {metrics['back_angle']:.1f}°, "
@@ -164,7 +274,7 @@ def main():
             # Draw pose for visualization
             mp_drawing.draw_landmarks(
                 frame,
-                results.pose_landmarks,
+                ctx.results["pose"].pose_landmarks,
                 mp_pose.POSE_CONNECTIONS,
             )
 
@@ -172,7 +282,7 @@ def main():
         bad_history.append(bad_posture_score)
 
         # Decide if posture is bad for prolonged period
-        avg_score = np.mean(bad_history) if bad_history else 0.0
+        avg_score = bad_history.mean
         is_bad_now = avg_score > 0.5  # tune threshold
 
         if is_bad_now:
@@ -201,10 +311,19 @@ def main():
 
         cv2.imshow("Posture Monitor", frame)
         key = cv2.waitKey(1) & 0xFF
-        if key == ord("q"):
-            break
+        return key != ord("q")
+
+    # 0 = default camera; lower resolution to reduce CPU usage
+    # this window draws on the frame, so flip the pixels themselves
+    pipeline = Pipeline(
+        [PostureAnalyzer()],
+        source=FrameGrabber(0, width=640, height=480),
+        preprocess=Preprocess(flip_pixels=True),
+    )
+    with pipeline:
+        bad_history = RollingStats(int(pipeline.source.fps * window_seconds))
+        pipeline.run(show)
 
-    cap.release()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
@@ -217,77 +336,29 @@ if __name__ == "__main__":
 async def run_posture_monitor(recording_flag, posture_manager):
     print("monitor loop started")
 
-    # while True:
-    #     await posture_manager.broadcast({"posture": "bad"})
-    #     await asyncio.sleep(1)
-    # return
-    cap = cv2.VideoCapture(0)  # 0 = default camera
-
-    # Optional: lower resolution to reduce CPU usage
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH,  640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-    pose = mp_pose.Pose(
-        static_image_mode=False,
-        model_complexity=1,  # 0,1,2 (higher = more accurate, slower)
-        enable_segmentation=False,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5,
-    )
+    pipeline = Pipeline([PostureAnalyzer()], source=FrameGrabber(0, width=640, height=480))
+    await pipeline.open_async()
 
     # For temporal smoothing
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps <= 0 or fps > 120:  # fallback if unknown
-        fps = 30
     window_seconds = 3
-    max_len = int(fps * window_seconds)
-    bad_history = deque(maxlen=max_len)
+    bad_history = RollingStats(int(pipeline.source.fps * window_seconds))
 
     while True:
         await wait_for_unpause(recording_flag)
 
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        # Flip horizontally so it feels like a mirror
-        frame = cv2.flip(frame, 1)
-        h, w, _ = frame.shape
-
-        # Convert to RGB for MediaPipe
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        results = pose.process(rgb)
-
-        bad_posture_score = 0.0
-        debug_text = "No person detected"
-
-        if results.pose_landmarks:
-            landmarks = results.pose_landmarks.landmark
+        ctx = await pipeline.step()
+        if ctx is None:
+            continue
 
-            # Compute posture metrics
-            metrics = compute_posture_metrics(landmarks, w, h)
-            bad_posture_score = compute_bad_posture_score(metrics)
-
-            debug_text = (
-                f"Back: {metrics['back_angle']:.1f}°, "
-                f"Neck: {metrics['neck_angle']:.1f}°, "
-                f"Head fwd: {metrics['head_forward_cm']:.1f}cm, "
-                f"Score: {bad_posture_score:.2f}"
-            )
+        bad_posture_score = ctx.values["posture_score"] or 0.0
 
         # Update rolling history
         bad_history.append(bad_posture_score)
 
         # Decide if posture is bad for prolonged period
-        avg_score = np.mean(bad_history) if bad_history else 0.0
+        avg_score = bad_history.mean
         is_bad_now = avg_score > 0.5  # tune threshold
 
         # send to socket connections
         current_posture = "bad" if is_bad_now else "good"
-        # current_blink = random.choice(["blinking", "not_blinking"]) # TODO: implement blink detection
         await posture_manager.broadcast({"posture": current_posture})
-        # await blink_manager.broadcast({"blink": current_blink})
-
-    cap.release()
-    # cv2.destroyAllWindows()
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Replay cached landmarks through the live scoring and prolonged-state logic.
+
+Feeds a landmark store (see src.landmark_store, written by
+`python -m src.offline ... --landmarks DIR`) straight into the posture
+scoring (the batched compute_posture_metrics / compute_bad_posture_score,
+identical to the per-frame ones), compute_EAR and the SessionTracker used
+by main_backend, without running MediaPipe:
+
+    python -m src.replay landmarks/source_0 --bad-threshold 0.6
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from src.blink_engine import LEFT_EYE_ROWS, RIGHT_EYE_ROWS, compute_EAR
+from src.landmark_store import LandmarkStore
+from src.posture_engine import compute_bad_posture_score_batch, compute_posture_metrics_batch
+from src.tracker import SessionTracker
+
+# Frames scored per vectorized pass; bounds the memory of a long store.
+SCORE_CHUNK = 4096
+
+
+def replay(store, **tracker_kwargs):
+    """
+    Run every cached frame of `store` through a fresh SessionTracker.
+    Returns (events, scores, ears); each event carries the frame index and
+    timestamp it fired on. `tracker_kwargs` override the tracker thresholds.
+    """
+    n = len(store)
+    scores = np.full(n, np.nan, dtype=np.float32)
+    ears = np.full(n, np.nan, dtype=np.float32)
+    events = []
+    if n == 0:
+        return events, scores, ears
+
+    tracker = SessionTracker(start_time=float(store.timestamps[0]), **tracker_kwargs)
+
+    # Scale normalized coordinates into the same float32 pixel space the
+    # live loop builds with landmarks_to_array.
+    scale = np.array([store.width, store.height, store.width], dtype=np.float32)
+    eye_pts = np.empty((12, 3), dtype=np.float32)
+
+    # Posture scores of every frame with a pose up front, a chunk at a time
+    posture_scores = [None] * n
+    valid = np.flatnonzero(store.pose_valid)
+    for start in range(0, len(valid), SCORE_CHUNK):
+        rows = valid[start:start + SCORE_CHUNK]
+        chunk = compute_bad_posture_score_batch(compute_posture_metrics_batch(store.pose[rows, :, :3] * scale))
+        scores[rows] = chunk
+        for i, score in zip(rows.tolist(), chunk.tolist()):
+            posture_scores[i] = score
+
+    timestamps = store.timestamps.tolist()
+    face_valid = store.face_valid.tolist()
+
+    for i, now in enumerate(timestamps):
+        tracker.update_posture(now, posture_scores[i])
+
+        ear = None
+        if face_valid[i]:
+            np.multiply(store.eyes[i], scale, out=eye_pts)
+            ear = (compute_EAR(eye_pts[LEFT_EYE_ROWS]) + compute_EAR(eye_pts[RIGHT_EYE_ROWS])) / 2.0
+            ears[i] = ear
+        tracker.update_blink(now, ear)
+
+        for event in tracker.step(now):
+            events.append(dict(event, frame=i, timestamp=now))
+
+    return events, scores, ears
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay cached landmarks through the scoring logic.")
+    parser.add_argument("store", help="landmark store directory")
+    parser.add_argument("--bad-threshold", type=float, default=None, help="smoothed score counted as bad posture")
+    parser.add_argument("--ear-threshold", type=float, default=None)
+    parser.add_argument("--posture-prolonged-sec", type=float, default=None)
+    parser.add_argument("--low-blink-rate", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    overrides = {
+        "bad_threshold": args.bad_threshold,
+        "ear_threshold": args.ear_threshold,
+        "posture_prolonged_sec": args.posture_prolonged_sec,
+        "low_blink_rate": args.low_blink_rate,
+    }
+    store = LandmarkStore(args.store)
+
+    t0 = time.perf_counter()
+    events, _, _ = replay(store, **{k: v for k, v in overrides.items() if v is not None})
+    elapsed = time.perf_counter() - t0
+
+    for event in events:
+        print(json.dumps(event))
+    print(f"replayed {len(store)} frames in {elapsed:.3f}s ({len(store) / max(elapsed, 1e-9):.0f} fps), {len(events)} events")
+
+
+if __name__ == "__main__":
+    main()
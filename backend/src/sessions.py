@@ -0,0 +1,651 @@
+import asyncio
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+
+from src.autotune import DEFAULT_LEVEL, LEVELS, AutoTuner
+from src.broadcast import COALESCE, BroadcastHub, covers
+from src.instrumentation import PipelineMetrics
+from src.metrics_stream import MetricsStreamEncoder
+from src.utils import RecordingState
+
+# The pipeline modules (src.monitor, src.capture and through them cv2 and
+# mediapipe) are imported by the workers only, when they first need them:
+# the server itself never loads them.
+
+# Session states, as reported by Session.info()
+RUNNING = "running"
+CLOSING = "closing"
+CLOSED = "closed"
+FAILED = "failed"
+
+
+class AdmissionError(Exception):
+    """A new session was refused: no free slot, CPU budget spent, or camera in use."""
+
+
+def camera_device(source):
+    """"camera:N" for a webcam source spec (None means camera 0), else None."""
+    if source is None or source == "camera":
+        return "camera:0"
+    if source.startswith("camera:"):
+        return source
+    return None
+
+
+class Session:
+    """
+    Server-side record of one monitoring session. The pipeline itself runs
+    in a worker process; this keeps its config, its own BroadcastHub (the
+    clients of /current_status?session=<id>) and the latest stats the
+    worker reported.
+    """
+
+    def __init__(self, session_id, config, worker, hub):
+        self.id = session_id
+        self.config = config          # {"stages", "source", "realtime", "record"}
+        self.stages = frozenset(config["stages"])
+        self.worker = worker
+        self.hub = hub
+        self.state = RUNNING
+        self.paused = False           # see SessionManager.pause()
+        self.error = None
+        self.started_at = time.time()
+        self.ended_at = None
+        self.stats = {}               # {"scheduler", "autotune", "metrics", "stream"} from the worker
+        self.pushed_types = None      # subscribed types last sent to the worker
+        self.ended = asyncio.Event()
+
+    @property
+    def live(self):
+        return self.state in (RUNNING, CLOSING)
+
+    @property
+    def device(self):
+        return camera_device(self.config["source"])
+
+    def duration(self):
+        return (self.ended_at or time.time()) - self.started_at
+
+    def info(self):
+        return {
+            "sessionId": self.id,
+            "state": self.state,
+            "paused": self.paused,
+            "error": self.error,
+            "stages": sorted(self.stages),
+            "source": self.config["source"] or "camera",
+            "record": self.config["record"],
+            "worker": self.worker.index,
+            "startTime": self.started_at,
+            "endTime": self.ended_at,
+            "duration": self.duration(),
+            "clients": len(self.hub.channels),
+        }
+
+
+class _Worker:
+    """A session worker process and the server's view of its load."""
+
+    def __init__(self, index, mp_context, outbox, options):
+        self.index = index
+        self.inbox = mp_context.Queue()
+        # not daemonic, so a session can start model processes of its own
+        # (ProcessInference); SessionManager.shutdown() stops it at exit
+        self.process = mp_context.Process(
+            target=worker_main, args=(index, self.inbox, outbox, options),
+            name=f"session-worker-{index}",
+        )
+        self.sessions = set()
+        self.cpu_pct = 0.0    # share of the machine, from the last report
+        self.started_at = time.time()
+        self.prewarm_sec = None   # reported once its prewarm is done
+
+    def send(self, *message):
+        self.inbox.put(message)
+
+    def stats(self):
+        return {
+            "index": self.index,
+            "pid": self.process.pid,
+            "alive": self.process.is_alive(),
+            "sessions": sorted(self.sessions),
+            "cpu_pct": self.cpu_pct,
+            "prewarm_sec": self.prewarm_sec,
+        }
+
+
+class SessionManager:
+    """
+    Creates, tracks and tears down independent monitoring sessions, keyed
+    by session id. Each session is a full main_backend() pipeline (its own
+    source, scheduler, tracker, autotuner and metrics) running as a task in
+    one of up to `max_workers` worker processes, so sessions do not share
+    a GIL and a crash takes down only the sessions of one worker.
+
+    Admission control in create():
+      - a webcam can only be held by one live session;
+      - a worker hosts at most `sessions_per_worker` sessions; a new worker
+        is spawned only when the running ones are full;
+      - with the workers' reported CPU use above `max_cpu_pct` (of the
+        whole machine), new sessions are refused until it drops.
+
+    Worker -> server traffic (events, history rows, stats) goes through one
+    queue drained by a reader thread onto the server loop: events are
+    published to the session's hub and to `hub` (the all-sessions hub, with
+    a "sessionId" field added), history goes to `store`. Per-frame
+    "metrics" messages are only built in the worker while a client of
+    either hub subscribes to them.
+    """
+
+    def __init__(
+        self,
+        hub,
+        store=None,
+        max_workers=None,
+        sessions_per_worker=2,
+        max_cpu_pct=85.0,
+        session_options=None,
+        metrics=None,
+        hub_maxsize=64,
+        keep_closed=50,
+    ):
+        self.hub = hub
+        self.store = store
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.sessions_per_worker = sessions_per_worker
+        self.max_cpu_pct = max_cpu_pct
+        self.options = dict(session_options or {})
+        # each session's autotuner measures its CPU against the cores one
+        # session gets at full capacity
+        capacity = self.max_workers * sessions_per_worker
+        self.options["autotune"] = {
+            "cpu_cores": max((os.cpu_count() or 1) / capacity, 1.0),
+            **self.options.get("autotune", {}),
+        }
+        self.metrics = metrics        # server-side PipelineMetrics (broadcast.send)
+        self.hub_maxsize = hub_maxsize
+        self.keep_closed = keep_closed
+
+        self.loop = None
+        self.sessions = {}            # id -> Session, closed ones included
+        self.workers = {}             # index -> _Worker
+        self._mp = multiprocessing.get_context("spawn")
+        self._outbox = self._mp.Queue()
+        self._reader = None
+        self._next_worker = 0
+        self._shut_down = False
+
+        # ---- COUNTERS ----
+        self.created = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def bind(self, loop=None):
+        """Attach to the server loop and start draining the workers (call from startup)."""
+        self.loop = loop or asyncio.get_running_loop()
+        self.hub.add_listener(lambda hub: self._push_subscriptions())
+        self._reader = threading.Thread(target=self._read, name="session-reader", daemon=True)
+        self._reader.start()
+        atexit.register(self.shutdown)
+
+    def prewarm(self, stages=("eye_strain", "posture"), workers=1):
+        """
+        Start `workers` session workers now (call after bind()) and have
+        them load the models of `stages` in the background, so the first
+        create() does not wait for the process start, the imports and the
+        model setup.
+        """
+        for _ in range(min(workers, self.max_workers) - len(self.workers)):
+            self._spawn().send("prewarm", None, sorted(stages))
+
+    # ----------------- Lifecycle (server loop) -----------------
+    def create(self, stages, source=None, realtime=True, record=True):
+        """Admit and start a session; raises AdmissionError when it cannot run."""
+        device = camera_device(source)
+        if device is not None:
+            holder = next((s for s in self.sessions.values() if s.live and s.device == device), None)
+            if holder is not None:
+                self._reject(f"{device} is in use by session {holder.id}")
+        cpu = sum(w.cpu_pct for w in self.workers.values())
+        if cpu > self.max_cpu_pct:
+            self._reject(f"workers use {cpu:.0f}% CPU (limit {self.max_cpu_pct:.0f}%)")
+        worker = self._pick_worker()
+
+        config = {"stages": sorted(stages), "source": source, "realtime": realtime, "record": record}
+        hub = BroadcastHub(maxsize=self.hub_maxsize, policy=COALESCE)
+        hub.bind(self.loop)
+        hub.metrics = self.metrics
+        session = Session(uuid.uuid4().hex, config, worker, hub)
+        hub.add_listener(lambda hub: self._push_subscriptions(session))
+
+        self.sessions[session.id] = session
+        worker.sessions.add(session.id)
+        worker.send("open", session.id, config)
+        self._push_subscriptions(session)
+        self.created += 1
+        return session
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise AdmissionError(reason)
+
+    def _pick_worker(self):
+        # least loaded worker with a free slot; spawn one only when all are full
+        free = [w for w in self.workers.values() if len(w.sessions) < self.sessions_per_worker]
+        if free:
+            return min(free, key=lambda w: (len(w.sessions), w.cpu_pct))
+        if len(self.workers) >= self.max_workers:
+            live = sum(len(w.sessions) for w in self.workers.values())
+            self._reject(f"at capacity: {live} sessions on {len(self.workers)} workers")
+        return self._spawn()
+
+    def _spawn(self):
+        worker = _Worker(self._next_worker, self._mp, self._outbox, self.options)
+        self._next_worker += 1
+        worker.process.start()
+        self.workers[worker.index] = worker
+        print(f"sessions: started worker {worker.index} (pid {worker.process.pid})")
+        return worker
+
+    def get(self, session_id=None):
+        """The session with this id, or the newest live one; KeyError if none."""
+        if session_id is not None:
+            return self.sessions[session_id]
+        live = [s for s in self.sessions.values() if s.live]
+        if not live:
+            raise KeyError("no active session")
+        return max(live, key=lambda s: s.started_at)
+
+    def configure(self, session_id, stages):
+        session = self.get(session_id)
+        session.stages = frozenset(stages)
+        session.worker.send("configure", session.id, sorted(stages))
+        return session
+
+    def pause(self, session_id, paused=True):
+        """
+        Pause or resume a session. A paused worker stops reading frames;
+        after `idle_release_sec` it also releases the camera and the graphs
+        (see monitor.main_backend), resuming reopens them.
+        """
+        session = self.get(session_id)
+        session.paused = paused
+        session.worker.send("pause", session.id, paused)
+        return session
+
+    def set_autotune(self, session_id, enabled=None, level=None):
+        session = self.get(session_id)
+        session.worker.send("autotune", session.id, enabled, level)
+        return session
+
+    async def close(self, session_id=None, timeout=5.0):
+        """Stop a session and wait until its worker released the camera."""
+        session = self.get(session_id)
+        if session.live:
+            session.state = CLOSING
+            session.worker.send("close", session.id)
+            try:
+                await asyncio.wait_for(session.ended.wait(), timeout)
+            except asyncio.TimeoutError:
+                print(f"sessions: {session.id} did not close within {timeout}s")
+        return session
+
+    def shutdown(self, timeout=5.0):
+        if self._shut_down:
+            return
+        self._shut_down = True
+        for worker in self.workers.values():
+            worker.send("exit", None)
+        for worker in self.workers.values():
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._outbox.put(None)
+
+    # ----------------- Worker -> server -----------------
+    def _read(self):
+        # hands messages to the loop in batches; checks for dead workers every second
+        next_check = time.monotonic() + 1.0
+        while True:
+            batch = []
+            try:
+                batch.append(self._outbox.get(timeout=1.0))
+                while len(batch) < 256:
+                    batch.append(self._outbox.get_nowait())
+            except queue.Empty:
+                pass
+            if None in batch:
+                return
+            if batch:
+                self.loop.call_soon_threadsafe(self._dispatch_batch, batch)
+            if time.monotonic() >= next_check:
+                next_check = time.monotonic() + 1.0
+                self.loop.call_soon_threadsafe(self._check_workers)
+
+    def _dispatch_batch(self, batch):
+        for message in batch:
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        kind, key, *payload = message
+        if kind == "event":
+            session = self.sessions.get(key)
+            if session is not None:
+                event = payload[0]
+                event["sessionId"] = key
+                session.hub.publish(event)
+                self.hub.publish(event)
+        elif kind == "binary":
+            session = self.sessions.get(key)
+            if session is not None:
+                # the stream id in the batch header tells sessions apart
+                session.hub.publish_binary(*payload)
+                self.hub.publish_binary(*payload)
+        elif kind == "sample":
+            if self.store is not None:
+                ts, values = payload
+                self.store.record_sample(ts, session_id=key, **values)
+        elif kind == "record":
+            if self.store is not None:
+                self.store.record_event(*payload, session_id=key)
+        elif kind == "stats":
+            worker = self.workers.get(key)
+            if worker is not None:
+                worker.cpu_pct = payload[0]["cpu_pct"]
+            for session_id, stats in payload[0]["sessions"].items():
+                if session_id in self.sessions:
+                    self.sessions[session_id].stats = stats
+        elif kind == "closed":
+            self._ended(self.sessions.get(key), payload[0])
+        elif kind == "prewarmed":
+            seconds, error = payload
+            worker = self.workers.get(key)
+            if worker is not None:
+                worker.prewarm_sec = seconds
+            print(f"sessions: worker {key} prewarmed in {seconds:.2f}s" + (f" ({error})" if error else ""))
+
+    def _ended(self, session, error=None):
+        if session is None or not session.live:
+            return
+        session.state = FAILED if error else CLOSED
+        session.error = error
+        session.ended_at = time.time()
+        session.worker.sessions.discard(session.id)
+        session.ended.set()
+        if error:
+            self.failed += 1
+            print(f"sessions: {session.id} failed: {error}")
+        # keep the newest `keep_closed` ended sessions around for /sessions
+        ended = [s for s in self.sessions.values() if not s.live]
+        for old in ended[:max(len(ended) - self.keep_closed, 0)]:
+            del self.sessions[old.id]
+
+    def _check_workers(self):
+        for index, worker in list(self.workers.items()):
+            if worker.process.is_alive():
+                continue
+            del self.workers[index]
+            for session_id in list(worker.sessions):
+                self._ended(self.sessions[session_id], f"worker {index} exited with code {worker.process.exitcode}")
+            print(f"sessions: worker {index} exited")
+
+    def _push_subscriptions(self, session=None):
+        # a worker builds "metrics" only if a client of either hub wants them
+        for s in ([session] if session is not None else self.sessions.values()):
+            if not s.live:
+                continue
+            types = self.hub.subscribed_types() | s.hub.subscribed_types()
+            if types != s.pushed_types:
+                s.pushed_types = types
+                s.worker.send("subscribers", s.id, types)
+
+    def stats(self):
+        return {
+            "created": self.created,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "capacity": self.max_workers * self.sessions_per_worker,
+            "live": sum(s.live for s in self.sessions.values()),
+            "cpu_pct": sum(w.cpu_pct for w in self.workers.values()),
+            "max_cpu_pct": self.max_cpu_pct,
+            "workers": [w.stats() for w in self.workers.values()],
+            "sessions": [s.info() for s in self.sessions.values()],
+        }
+
+
+# ---------------------------
+# WORKER PROCESS
+# ---------------------------
+class _RemoteHub:
+    """
+    Stands in for the server's BroadcastHub inside a worker: publish()
+    forwards to the server process, has_subscribers() answers from the
+    types the server last pushed for this session.
+    """
+
+    def __init__(self, session_id, outbox):
+        self.session_id = session_id
+        self.outbox = outbox
+        self.types = frozenset()
+
+    def publish(self, message):
+        self.outbox.put(("event", self.session_id, message))
+
+    def publish_binary(self, msg_type, data):
+        self.outbox.put(("binary", self.session_id, msg_type, data))
+
+    def has_subscribers(self, msg_type):
+        return covers(self.types, msg_type)
+
+
+class _RemoteStore:
+    """
+    MetricsStore producer side inside a worker; the server process writes
+    the rows, tagged with this session's id.
+    """
+
+    def __init__(self, session_id, outbox):
+        self.session_id = session_id
+        self.outbox = outbox
+
+    def record_sample(self, ts, **values):
+        self.outbox.put(("sample", self.session_id, ts, values))
+
+    def record_event(self, ts, event_type, data=None):
+        self.outbox.put(("record", self.session_id, ts, event_type, data))
+
+
+class _SessionWorker:
+    """Runs the sessions assigned to one worker process on its event loop."""
+
+    def __init__(self, index, inbox, outbox, options):
+        self.index = index
+        self.inbox = inbox
+        self.outbox = outbox
+        self.options = options
+        self.sessions = {}   # id -> dict(task, flag, hub, scheduler, tuner, metrics, stream)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        threading.Thread(target=self._read_inbox, args=(loop, done), daemon=True).start()
+        reporter = asyncio.create_task(self._report(self.options.get("stats_interval", 1.0)))
+        await done
+        reporter.cancel()
+        tasks = [s["task"] for s in self.sessions.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _read_inbox(self, loop, done):
+        parent = os.getppid()
+        while True:
+            try:
+                message = self.inbox.get(timeout=1.0)
+            except queue.Empty:
+                if os.getppid() == parent:
+                    continue
+                message = ("exit", None)   # the server went away without telling us
+            if message[0] == "exit":
+                loop.call_soon_threadsafe(done.set_result, None)
+                return
+            loop.call_soon_threadsafe(self._handle, message)
+
+    def _handle(self, message):
+        kind, session_id, *payload = message
+        if kind == "open":
+            self._open(session_id, payload[0])
+            return
+        if kind == "prewarm":
+            asyncio.create_task(self._prewarm(payload[0]))
+            return
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        if kind == "configure":
+            session["flag"].configure(payload[0])
+        elif kind == "pause":
+            session["flag"].set(not payload[0])
+        elif kind == "subscribers":
+            session["hub"].types = payload[0]
+        elif kind == "autotune":
+            enabled, level = payload
+            if level is not None:
+                session["tuner"].pending = level
+            if enabled is not None:
+                session["tuner"].enabled = enabled
+        elif kind == "close":
+            session["task"].cancel()
+
+    async def _prewarm(self, stages):
+        started = time.perf_counter()
+        error = None
+        try:
+            await asyncio.to_thread(_warm_models, stages, self.options)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.outbox.put(("prewarmed", self.index, time.perf_counter() - started, error))
+
+    def _open(self, session_id, config):
+        from src.monitor import AdaptiveScheduler
+
+        o = self.options
+        session = {
+            "flag": RecordingState(True, config["stages"]),
+            "hub": _RemoteHub(session_id, self.outbox),
+            "scheduler": AdaptiveScheduler(**o.get("scheduler", {})),
+            "tuner": AutoTuner(**o.get("autotune", {})),
+            "metrics": PipelineMetrics() if o.get("instrumentation", True) else None,
+            "stream": MetricsStreamEncoder(session_id, **o.get("stream", {})),
+        }
+        session["task"] = asyncio.create_task(self._run_session(session_id, config, session))
+        self.sessions[session_id] = session
+        self._share_cpu()
+
+    def _share_cpu(self):
+        # the autotuners split this process's CPU time between its sessions
+        for s in self.sessions.values():
+            s["tuner"].cpu_share = len(self.sessions)
+
+    async def _run_session(self, session_id, config, session):
+        from src.capture import open_source
+        from src.monitor import main_backend
+
+        def source_factory(width, height):
+            return open_source(config["source"], width, height, realtime=config["realtime"])
+
+        error = None
+        try:
+            await main_backend(
+                session["flag"],
+                session["hub"],
+                scheduler=session["scheduler"],
+                idle_release_sec=self.options.get("idle_release_sec", 30.0),
+                store=_RemoteStore(session_id, self.outbox) if config["record"] else None,
+                face_roi=self.options.get("face_roi", False),
+                tuner=session["tuner"],
+                metrics=session["metrics"],
+                source_factory=source_factory,
+                process_inference=self.options.get("process_inference", False),
+                stream=session["stream"],
+            )
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            self.sessions.pop(session_id, None)
+            self._share_cpu()
+            self.outbox.put(("closed", session_id, error))
+
+    def _child_cpu(self):
+        # model processes of ProcessInference; a reopened pipeline starts at 0
+        total = 0.0
+        for s in self.sessions.values():
+            pipeline = s["tuner"].pipeline
+            cpu_time = getattr(pipeline.inference if pipeline is not None else None, "cpu_time", None)
+            now = cpu_time() if cpu_time is not None else 0.0
+            last = s.get("child_cpu", 0.0)
+            total += now - last if now >= last else now
+            s["child_cpu"] = now
+        return total
+
+    async def _report(self, interval):
+        cpus = os.cpu_count() or 1
+        wall, cpu = time.monotonic(), time.process_time()
+        while True:
+            await asyncio.sleep(interval)
+            now_wall, now_cpu = time.monotonic(), time.process_time()
+            used = now_cpu - cpu + self._child_cpu()
+            cpu_pct = 100.0 * used / ((now_wall - wall) * cpus)
+            wall, cpu = now_wall, now_cpu
+            self.outbox.put(("stats", self.index, {
+                "cpu_pct": cpu_pct,
+                "sessions": {
+                    session_id: {
+                        "scheduler": s["scheduler"].stats(),
+                        "autotune": s["tuner"].stats(),
+                        "metrics": s["metrics"].snapshot() if s["metrics"] is not None else None,
+                        "stream": s["stream"].stats(),
+                    }
+                    for session_id, s in self.sessions.items()
+                },
+            }))
+
+
+def _warm_models(stages, options):
+    """
+    Import the pipeline modules and run a blank frame through each model
+    `stages` use, at the autotuner's starting level: loads the model files
+    and sets up TFLite once per process. The graphs are closed again (a
+    session builds its own); with process inference they run elsewhere, so
+    this warms the imports and the page cache only.
+    """
+    import numpy as np
+    from src.blink_engine import create_face_mesh
+    from src.posture_engine import create_pose
+
+    autotune = options.get("autotune", {})
+    complexity, width, height = autotune.get("levels", LEVELS)[autotune.get("level", DEFAULT_LEVEL)]
+    blank = np.zeros((height, width, 3), dtype=np.uint8)
+    factories = []
+    if "posture" in stages:
+        factories.append(lambda: create_pose(complexity))
+    if "eye_strain" in stages:
+        factories.append(create_face_mesh)
+    for factory in factories:
+        graph = factory()
+        try:
+            graph.process(blank)
+        finally:
+            graph.close()
+
+
+def worker_main(index, inbox, outbox, options):
+    """Entry point of a session worker process."""
+    asyncio.run(_SessionWorker(index, inbox, outbox, options).run())
@@ -0,0 +1,123 @@
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Bytes in front of every slot: sequence number (int64), height, width,
+# channels (int32).
+HEADER_BYTES = 32
+
+
+class SharedFrameRing:
+    """
+    `slots` frame buffers in one multiprocessing.shared_memory segment, so
+    frames reach inference processes without being pickled (a 640x480 RGB
+    frame is about 900 KB). The writer fills a slot in place (cv2 `dst`) and
+    only sends (slot, seq) to the readers.
+
+    Each slot starts with a header holding the sequence number of the frame
+    in it and its size. acquire() bumps the sequence number before handing
+    the slot out, so a reader that checks it before and after using the slot
+    (see SharedFrameReader) notices a frame that was replaced under it.
+    Replacing one should not happen anyway: hold()/release() count the
+    readers of every slot and acquire() only returns free slots, the least
+    recently handed out first.
+
+    The writer side (acquire/hold/release) is used from one process; the
+    counts are locked because releases come from the inference threads.
+    """
+
+    def __init__(self, shape, slots=4):
+        self.shape = tuple(shape)     # largest (h, w, c) a slot can hold
+        self.slots = slots
+        self.slot_bytes = HEADER_BYTES + int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_bytes)
+        self.name = self.shm.name
+
+        self._headers = [
+            np.ndarray((4,), dtype=np.int64, buffer=self.shm.buf, offset=i * self.slot_bytes)
+            for i in range(slots)
+        ]
+        self._views = [None] * slots  # frame view per slot, for its current size
+        self._readers = [0] * slots
+        self._seq = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+        # ---- COUNTERS ----
+        self.acquired = 0
+        self.exhausted = 0   # acquire() found every slot in use
+
+    def fits(self, shape):
+        return len(shape) == len(self.shape) and all(a <= b for a, b in zip(shape, self.shape))
+
+    def acquire(self, shape):
+        """A free slot sized to `shape`: (slot, seq, writable view)."""
+        with self._lock:
+            for k in range(self.slots):
+                slot = (self._next + k) % self.slots
+                if not self._readers[slot]:
+                    break
+            else:
+                self.exhausted += 1
+                raise RuntimeError(f"all {self.slots} shared frame slots are in use")
+            self._next = (slot + 1) % self.slots
+            self._seq += 1
+            seq = self._seq
+
+        h, w, c = shape
+        self._headers[slot][:] = (seq, h, w, c)
+        view = self._views[slot]
+        if view is None or view.shape != tuple(shape):
+            offset = slot * self.slot_bytes + HEADER_BYTES
+            view = self._views[slot] = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+        self.acquired += 1
+        return slot, seq, view
+
+    def locate(self, image):
+        """(slot, seq) if `image` is the current view of one of our slots, else None."""
+        for slot, view in enumerate(self._views):
+            if view is image:
+                return slot, int(self._headers[slot][0])
+        return None
+
+    def hold(self, slot):
+        with self._lock:
+            self._readers[slot] += 1
+
+    def release(self, slot):
+        with self._lock:
+            self._readers[slot] -= 1
+
+    def close(self):
+        self._views = [None] * self.slots
+        self._headers = []
+        try:
+            self.shm.close()
+        except BufferError:
+            pass   # a caller still holds a view; the mapping goes with it
+        self.shm.unlink()
+
+
+class SharedFrameReader:
+    """Read-only side of a SharedFrameRing, attached by name in another process."""
+
+    def __init__(self, name, slot_bytes):
+        self.name = name
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(name=name)
+
+    def seq(self, slot):
+        return int(np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf, offset=slot * self.slot_bytes)[0])
+
+    def frame(self, slot):
+        """(seq, view) of the frame in `slot`; the view aliases shared memory."""
+        offset = slot * self.slot_bytes
+        seq, h, w, c = np.ndarray((4,), dtype=np.int64, buffer=self.shm.buf, offset=offset).tolist()
+        return seq, np.ndarray((h, w, c), dtype=np.uint8, buffer=self.shm.buf, offset=offset + HEADER_BYTES)
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
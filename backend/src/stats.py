@@ -0,0 +1,215 @@
+from collections import deque
+
+import numpy as np
+
+
+class RollingStats:
+    """
+    Rolling window over the last `size` values, backed by a preallocated
+    ring array. Sum, mean, variance and an EWMA are maintained incrementally,
+    so push() and every summary except percentile() are O(1). The running
+    sums are rebuilt from the ring once per `size` pushes so floating-point
+    drift cannot accumulate over a long session.
+    """
+
+    def __init__(self, size, ewma_alpha=None):
+        if size < 1:
+            raise ValueError("RollingStats size must be >= 1")
+        self.size = size
+        self.alpha = ewma_alpha if ewma_alpha is not None else 2.0 / (size + 1)
+
+        self._buf = np.zeros(size, dtype=np.float64)
+        self._n = 0          # number of valid values (<= size)
+        self._i = 0          # next write position
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._since_resync = 0
+        self.ewma = None
+
+    def push(self, x):
+        x = float(x)
+        buf = self._buf
+        i = self._i
+
+        if self._n == self.size:
+            old = buf[i].item()
+            self._sum -= old
+            self._sumsq -= old * old
+        else:
+            self._n += 1
+
+        buf[i] = x
+        self._sum += x
+        self._sumsq += x * x
+        self._i = i + 1 if i + 1 < self.size else 0
+
+        self.ewma = x if self.ewma is None else self.ewma + self.alpha * (x - self.ewma)
+
+        self._since_resync += 1
+        if self._since_resync >= self.size:
+            self._resync()
+
+    append = push  # drop-in for the deque(maxlen=...) histories it replaces
+
+    def _resync(self):
+        valid = self._buf if self._n == self.size else self._buf[:self._n]
+        self._sum = float(valid.sum())
+        self._sumsq = float(np.dot(valid, valid))
+        self._since_resync = 0
+
+    def clear(self):
+        self._n = 0
+        self._i = 0
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._since_resync = 0
+        self.ewma = None
+
+    def __len__(self):
+        return self._n
+
+    def __bool__(self):
+        return self._n > 0
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def mean(self):
+        return self._sum / self._n if self._n else 0.0
+
+    @property
+    def variance(self):
+        # population variance; clamp tiny negatives from cancellation
+        if not self._n:
+            return 0.0
+        mean = self._sum / self._n
+        return max(self._sumsq / self._n - mean * mean, 0.0)
+
+    @property
+    def std(self):
+        return self.variance ** 0.5
+
+    def values(self):
+        """Window contents, oldest first (allocates; not for the hot path)."""
+        if self._n < self.size:
+            return self._buf[:self._n].copy()
+        return np.roll(self._buf, -self._i)
+
+    def percentile(self, q):
+        """Percentile(s) of the current window; O(size), computed on demand."""
+        if not self._n:
+            return float("nan") if np.isscalar(q) else np.full(len(q), np.nan)
+        valid = self._buf if self._n == self.size else self._buf[:self._n]
+        return np.percentile(valid, q)
+
+    def summary(self, percentiles=(50, 90, 99)):
+        out = {
+            "count": self._n,
+            "mean": self.mean,
+            "std": self.std,
+            "ewma": self.ewma,
+        }
+        if percentiles:
+            for q, v in zip(percentiles, np.atleast_1d(self.percentile(list(percentiles)))):
+                out[f"p{q}"] = float(v)
+        return out
+
+
+class TimeWindowStats:
+    """
+    Rolling mean over the values pushed in the last `seconds` seconds, for
+    streams whose rate changes (a throttled model): the window always spans
+    the same time, however many samples that is. Values older than the
+    window are evicted on push() and expire(); the running sum is rebuilt
+    from the window once per `resync_every` pushes against float drift.
+    """
+
+    def __init__(self, seconds, resync_every=1024):
+        if seconds <= 0:
+            raise ValueError("TimeWindowStats seconds must be > 0")
+        self.seconds = seconds
+        self.resync_every = resync_every
+        self._items = deque()   # (timestamp, value), oldest first
+        self._sum = 0.0
+        self._since_resync = 0
+
+    def push(self, now, x):
+        x = float(x)
+        self.expire(now)
+        self._items.append((now, x))
+        self._sum += x
+        self._since_resync += 1
+        if self._since_resync >= self.resync_every:
+            self._sum = sum(v for _, v in self._items)
+            self._since_resync = 0
+
+    def expire(self, now):
+        """Drop the values pushed at or before `now - seconds`."""
+        items = self._items
+        cutoff = now - self.seconds
+        while items and items[0][0] <= cutoff:
+            self._sum -= items.popleft()[1]
+        if not items:
+            self._sum = 0.0
+
+    def clear(self):
+        self._items.clear()
+        self._sum = 0.0
+        self._since_resync = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def mean(self):
+        return self._sum / len(self._items) if self._items else 0.0
+
+
+class EventRateWindow:
+    """
+    Number of events in the last `seconds` seconds, e.g. blinks per minute.
+    Events are counted into one-second bins; completed bins live in a
+    RollingStats ring whose running sum is the windowed count, so add() and
+    count() are O(1) apart from zero-filling after long gaps.
+
+    The window is `seconds` completed bins plus the current partial second,
+    so every event of the last `seconds` seconds is counted; events up to
+    one second older may be counted too (at most one bin over, never under).
+    """
+
+    def __init__(self, seconds=60, start_time=0.0, initial_count=0):
+        self.bins = RollingStats(max(int(seconds), 1))
+        self._second = int(start_time)
+        self._current = initial_count
+
+    def advance(self, now):
+        second = int(now)
+        gap = second - self._second
+        if gap <= 0:
+            return
+        self.bins.push(self._current)
+        for _ in range(min(gap - 1, self.bins.size)):
+            self.bins.push(0)
+        self._second = second
+        self._current = 0
+
+    def add(self, now):
+        self.advance(now)
+        self._current += 1
+
+    def count(self, now):
+        self.advance(now)
+        return int(round(self.bins.sum)) + self._current
+
+    def per_second_stats(self):
+        """Rolling stats of the per-second event counts (completed seconds)."""
+        return self.bins
@@ -0,0 +1,174 @@
+import time
+
+from src.blink_engine import EAR_CONSEC_FRAMES, EAR_THRESHOLD
+from src.stats import EventRateWindow, TimeWindowStats
+
+
+class SessionTracker:
+    """
+    Scoring state behind main_backend: short-term posture smoothing, the EAR
+    blink state machine and the prolonged-state logic that turns them into
+    websocket events. It only sees scores, EARs and timestamps, so the live
+    loop and a replay over cached landmarks drive exactly the same logic.
+    """
+
+    def __init__(
+        self,
+        start_time=None,
+        window_seconds=3,
+        bad_threshold=0.67,
+        ear_threshold=EAR_THRESHOLD,
+        ear_consec_frames=EAR_CONSEC_FRAMES,
+        posture_prolonged_sec=2,
+        low_blink_rate=8,
+        low_blink_prolonged_sec=2,
+        initial_blinks=15,
+    ):
+        # ---- POSTURE HISTORY (SHORT-TERM SMOOTHING) ----
+        # by time, not sample count: the scheduler may run Pose at a few Hz
+        self.bad_history = TimeWindowStats(window_seconds)
+        self.bad_threshold = bad_threshold
+        self.current_posture = "unknown"
+        self.posture_score = None
+        self.avg_score = None
+
+        # ---- BLINK HISTORY ----
+        self.ear_threshold = ear_threshold
+        self.ear_consec_frames = ear_consec_frames
+        self.frame_counter = 0
+        # blinks over the last 60s; seeded so a new session does not start
+        # out as "low blink rate"
+        start = time.time() if start_time is None else start_time
+        self.blinks = EventRateWindow(60, start_time=start, initial_count=initial_blinks)
+        self.face_visible = False
+        self.ear = None
+        self.blink_rate = None    # blinks per 60s
+
+        # ---- PROLONGED STATE CONFIG ----
+        # Posture: "prolonged bad" = N seconds of continuous bad posture
+        self.posture_prolonged_sec = posture_prolonged_sec
+        # Blink: "prolonged low blink rate" = < low_blink_rate blinks/min for N seconds
+        self.low_blink_rate = low_blink_rate
+        self.low_blink_prolonged_sec = low_blink_prolonged_sec
+
+        # ---- PROLONGED STATE VARIABLES ----
+        self.posture_bad_since = None
+        self.posture_prolonged_active = False
+
+        self.low_blink_since = None
+        self.low_blink_prolonged_active = False
+
+    # ----------------- Per-model updates -----------------
+    def update_posture(self, now, score):
+        """Feed one posture score (None = no pose detected). Returns the smoothed score."""
+        self.posture_score = score
+        if score is None:
+            self.current_posture = "unknown"
+            self.avg_score = None
+            return None
+
+        self.bad_history.push(now, score)
+        self.avg_score = self.bad_history.mean
+        self.current_posture = "bad" if self.avg_score > self.bad_threshold else "good"
+        return self.avg_score
+
+    def update_blink(self, now, ear):
+        """Feed one EAR measurement (None = no face). Returns True if a blink completed."""
+        self.ear = ear
+        self.face_visible = ear is not None
+        if ear is None:
+            return False
+
+        if ear < self.ear_threshold:
+            self.frame_counter += 1
+            return False
+
+        blinked = self.frame_counter >= self.ear_consec_frames
+        if blinked:
+            self.blinks.add(now)
+        self.frame_counter = 0
+        return blinked
+
+    # ----------------- Prolonged-state logic -----------------
+    def step(self, now):
+        """Advance the prolonged-state machines to `now` and return any events."""
+        events = []
+
+        # blink rate over last 60s, only meaningful if the face is visible
+        blinks_last_minute = self.blinks.count(now)
+        self.blink_rate = blinks_last_minute if self.face_visible else None
+
+        # ---------- PROLONGED POSTURE LOGIC ----------
+        # We treat "unknown" posture (no pose detected) as a break in continuity.
+        if self.current_posture == "bad":
+            if self.posture_bad_since is None:
+                self.posture_bad_since = now
+
+            bad_duration = now - self.posture_bad_since
+
+            if (not self.posture_prolonged_active and
+                    bad_duration >= self.posture_prolonged_sec):
+                self.posture_prolonged_active = True
+
+                # A single event when prolonged bad posture starts
+                events.append({
+                    "type": "posture_warning",
+                    "status": "prolonged_bad",
+                    "bad_duration_sec": int(bad_duration),
+                })
+
+        else:
+            # Posture is either "good" or "unknown" -> break streak
+            if self.posture_prolonged_active:
+                self.posture_prolonged_active = False
+
+                # Notify client that posture returned to non-prolonged state
+                events.append({
+                    "type": "posture_resolved",
+                    "status": "back_to_good_or_unknown",
+                })
+            self.posture_bad_since = None
+
+        # ---------- PROLONGED LOW BLINK RATE LOGIC ----------
+        # Only reason about eye fatigue when we have a face in frame and a blink_rate.
+        blink_rate = self.blink_rate
+        if self.face_visible and blink_rate is not None:
+            if blink_rate < self.low_blink_rate:
+                if self.low_blink_since is None:
+                    self.low_blink_since = now
+
+                low_duration = now - self.low_blink_since
+
+                if (not self.low_blink_prolonged_active and
+                        low_duration >= self.low_blink_prolonged_sec):
+                    self.low_blink_prolonged_active = True
+
+                    events.append({
+                        "type": "blink_warning",
+                        "status": "prolonged_low_rate",
+                        "blink_rate_per_min": blink_rate,
+                        "low_duration_sec": int(low_duration),
+                    })
+            else:
+                # Blink rate back to normal
+                if self.low_blink_prolonged_active:
+                    self.low_blink_prolonged_active = False
+
+                    events.append({
+                        "type": "blink_resolved",
+                        "status": "back_to_normal",
+                        "blink_rate_per_min": blink_rate,
+                    })
+                self.low_blink_since = None
+        else:
+            # No reliable face / blink measurement -> clear any active low-blink state
+            if self.low_blink_prolonged_active:
+                self.low_blink_prolonged_active = False
+
+                events.append({
+                    "type": "blink_resolved",
+                    "status": "face_not_visible",
+                })
+            self.low_blink_since = None
+
+        return events
@@ -1,7 +1,152 @@
 import asyncio
+import operator
+import threading
+import time
+from itertools import chain
+
+import numpy as np
+
+_XYZ = operator.attrgetter("x", "y", "z")
+
+class RecordingState:
+    """
+    Recording on/off switch shared by the HTTP handlers and the monitor.
+    Thread-safe, and awaitable from any event loop: waiters are woken
+    through their own loop's call_soon_threadsafe the moment the state
+    flips, so nothing has to poll.
+
+    `stages` is the set of pipeline stages the current session asked for
+    (see monitor.PIPELINE_STAGES). It is replaced as a whole, so the
+    monitor can read it once per frame without locking.
+    """
+
+    def __init__(self, recording=False, stages=()):
+        self._cond = threading.Condition()
+        self._recording = recording
+        self._waiters = []  # (loop, future, wanted state)
+        self.changed_at = time.monotonic()
+        self.stages = frozenset(stages)
+
+    @property
+    def recording(self):
+        return self._recording
+
+    def __getitem__(self, key):
+        # keeps old recording_flag["recording"] reads working
+        if key != "recording":
+            raise KeyError(key)
+        return self._recording
+
+    def set(self, recording):
+        recording = bool(recording)
+        with self._cond:
+            if recording == self._recording:
+                return
+            self._recording = recording
+            self.changed_at = time.monotonic()
+            ready = [w for w in self._waiters if w[2] == recording]
+            self._waiters = [w for w in self._waiters if w[2] != recording]
+            self._cond.notify_all()
+
+        for loop, fut, _ in ready:
+            loop.call_soon_threadsafe(_resolve_waiter, fut)
+
+    def start(self, stages=None):
+        if stages is not None:
+            self.configure(stages)
+        self.set(True)
+
+    def configure(self, stages):
+        """Change the active stages; takes effect on the monitor's next frame."""
+        self.stages = frozenset(stages)
+
+    def stop(self):
+        self.set(False)
+
+    async def wait_for(self, recording=True, timeout=None):
+        """Wait until the state equals `recording`. Returns False on timeout."""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._recording == recording:
+                return True
+            fut = loop.create_future()
+            waiter = (loop, fut, recording)
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._cond:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+
+def _resolve_waiter(fut):
+    if not fut.done():
+        fut.set_result(None)
+
 
 async def wait_for_unpause(recording_flag):
-    while True:
-        if recording_flag["recording"]:
-            return
-        await asyncio.sleep(1)
\ No newline at end of file
+    await recording_flag.wait_for(True)
+
+
+def landmarks_to_array(landmarks, w, h, out=None, indices=None):
+    """
+    Convert a MediaPipe landmark list to an (N, 3) float32 array of pixel
+    coordinates (x*w, y*h, z*w) in one pass. The result is written into `out`
+    when it already has the right shape, so callers can reuse one buffer per
+    frame. `indices` converts a subset only; row k then holds landmarks[indices[k]].
+    Array-backed lists (inference.LandmarkArray) skip the per-field pass.
+    """
+    array = getattr(landmarks, "array", None)
+    if array is not None:
+        points = array[:, :3] if indices is None else array[indices, :3]
+        if out is None or out.shape != points.shape:
+            out = np.empty(points.shape, dtype=np.float32)
+        np.multiply(points, (w, h, w), out=out)
+        return out
+
+    if indices is not None:
+        landmarks = [landmarks[i] for i in indices]
+
+    n = len(landmarks)
+    if out is None or out.shape != (n, 3):
+        out = np.empty((n, 3), dtype=np.float32)
+
+    # one flat pass over the protobuf fields, then scale in place;
+    # z uses the width like x (MediaPipe's convention)
+    out.reshape(-1)[:] = np.fromiter(chain.from_iterable(map(_XYZ, landmarks)), dtype=np.float32, count=3 * n)
+    np.multiply(out, (w, h, w), out=out)
+    return out
+
+
+def mirror_x(points, width=1.0):
+    """
+    Mirror x in place (x -> width - x) for landmarks from an unflipped frame,
+    so they match what the model would see on the mirrored image. Use
+    width=1.0 for normalized coordinates, the frame width for pixels. Pair
+    with a left/right swapped index order (see posture_engine.POSE_MIRROR_ORDER).
+    """
+    np.subtract(width, points[:, 0], out=points[:, 0])
+    return points
+
+
+def normalized_landmarks(landmarks, fields=("x", "y", "z"), out=None, indices=None):
+    """
+    Copy the raw (normalized) landmark fields into an (N, len(fields))
+    float32 array, e.g. fields=("x", "y", "z", "visibility") for storage.
+    """
+    if indices is not None:
+        landmarks = [landmarks[i] for i in indices]
+
+    n = len(landmarks)
+    shape = (n, len(fields))
+    if out is None or out.shape != shape:
+        out = np.empty(shape, dtype=np.float32)
+
+    getter = operator.attrgetter(*fields)
+    out.reshape(-1)[:] = np.fromiter(chain.from_iterable(map(getter, landmarks)), dtype=np.float32, count=n * len(fields))
+    return out
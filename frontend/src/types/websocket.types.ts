@@ -3,34 +3,82 @@ export type WebSocketEventType =
   | "posture_warning"
   | "posture_resolved"
   | "blink_warning"
-  | "blink_resolved";
+  | "blink_resolved"
+  | "metrics"
+  | "metrics_stream";
 
-export interface PostureWarningEvent {
+// Events from /current_status without ?session= carry the id of the
+// session they came from (per-session sockets get it too).
+interface SessionEvent {
+  sessionId?: string;
+}
+
+export interface PostureWarningEvent extends SessionEvent {
   type: "posture_warning";
   status: "prolonged_bad";
   bad_duration_sec: number;
 }
 
-export interface PostureResolvedEvent {
+export interface PostureResolvedEvent extends SessionEvent {
   type: "posture_resolved";
   status: "back_to_good_or_unknown";
 }
 
-export interface BlinkWarningEvent {
+export interface BlinkWarningEvent extends SessionEvent {
   type: "blink_warning";
   status: "prolonged_low_rate";
   blink_rate_per_min: number;
   low_duration_sec: number;
 }
 
-export interface BlinkResolvedEvent {
+export interface BlinkResolvedEvent extends SessionEvent {
   type: "blink_resolved";
   status: "back_to_normal" | "face_not_visible";
   blink_rate_per_min?: number;
 }
 
+// Raw per-frame values; only sent to clients subscribed to "metrics".
+export interface MetricsEvent extends SessionEvent {
+  type: "metrics";
+  ts: number;
+  posture: "good" | "bad" | "unknown";
+  posture_score: number | null;
+  avg_score: number | null;
+  ear: number | null;
+  blink_rate_per_min: number | null;
+  back_angle?: number;
+  neck_angle?: number;
+  head_forward_cm?: number;
+  shoulder_tilt_deg?: number;
+}
+
+// Reply to a subscription request, listing the client's current types.
+export interface SubscribedEvent {
+  type: "subscribed";
+  types: string[];
+}
+
+// Sent when a client message cannot be handled (bad JSON, unknown action,
+// `types` not a list of strings).
+export interface ServerErrorEvent {
+  type: "error";
+  detail: string;
+}
+
+// Client -> server. Clients start subscribed to the four warning/resolved
+// events; "*" subscribes to every JSON type. "metrics_stream" must be named:
+// it arrives as binary frames (ArrayBuffer/Blob, not JSON), batches of the
+// per-frame metrics laid out as in backend/src/metrics_stream.py.
+export interface SubscriptionRequest {
+  action: "subscribe" | "unsubscribe" | "set";
+  types: (WebSocketEventType | "*")[];
+}
+
 export type WebSocketEvent =
   | PostureWarningEvent
   | PostureResolvedEvent
   | BlinkWarningEvent
-  | BlinkResolvedEvent;
+  | BlinkResolvedEvent
+  | MetricsEvent
+  | SubscribedEvent
+  | ServerErrorEvent;